@@ -0,0 +1,174 @@
+# aggregates.py
+# Column-at-a-time ledger aggregation with NumPy: per-account totals and month-end statements for all accounts.
+#
+# Amounts are integer minor units (see money.py) summed in int64, so results are exact; nothing goes through float.
+# Pulling rows out of SQLite costs about as much as one row-by-row pass, so the columns are loaded once into a
+# LedgerColumns snapshot and every later aggregation (any period, any as-of time) is pure array work.
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+from sqlalchemy import select, func, cast, Integer
+
+CHUNK_ROWS = 100_000
+EPOCH = datetime(1970, 1, 1)
+
+def load_columns(conn, stmt, chunk_rows: int = CHUNK_ROWS) -> np.ndarray:
+    """Run stmt and stack its (integer) rows into one int64 array, fetching chunk_rows at a time."""
+    result = conn.execute(stmt)
+    width = len(result.keys())
+    parts = []
+    while True:
+        rows = result.fetchmany(chunk_rows)
+        if not rows:
+            break
+        # flattening through fromiter is ~100x faster than np.array() over Row objects
+        flat = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64, count=len(rows) * width)
+        parts.append(flat.reshape(len(rows), width))
+    return np.concatenate(parts) if parts else np.empty((0, width), dtype=np.int64)
+
+def epoch_us(created_col):
+    # SQLite stores DateTime as 'YYYY-MM-DD HH:MM:SS.ffffff'; integer microseconds keep comparisons exact
+    return cast(func.strftime("%s", created_col), Integer) * 1_000_000 + cast(func.substr(created_col, 21, 6), Integer)
+
+def to_epoch_us(dt: datetime) -> int:
+    return (dt.replace(tzinfo=None) - EPOCH) // timedelta(microseconds=1)
+
+def group_sum(keys: np.ndarray, values: np.ndarray, size: int) -> np.ndarray:
+    """Exact integer sum of values per key in [0, size). bincount would go through float64 weights."""
+    out = np.zeros(size, dtype=np.int64)
+    np.add.at(out, keys, values)  # unbuffered, int64 throughout; fast since NumPy 1.25
+    return out
+
+class LedgerColumns:
+    """int64 column snapshot of transfers and pays; refresh() appends rows with ids above the last one loaded.
+
+    Transfers and pays are insert-only, so appending by primary key keeps the snapshot exact; call reset()
+    after anything that rewrites or removes rows. archives() returns (name, transfers, pays) tables of
+    archived months (see partitions.py); each is immutable and loaded once.
+    """
+
+    def __init__(self, metadata, archives: Callable[[], List[tuple]] = None):
+        self.metadata = metadata
+        self.archives = archives or (lambda: [])
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.account_ids = np.empty(0, dtype=np.int64)
+            self.transfers = np.empty((0, 4), dtype=np.int64)  # from, to, amount_minor, created_us
+            self.pays = np.empty((0, 4), dtype=np.int64)       # from, amount_minor, created_us, merchant
+            self.last_ids = {"transfers": 0, "pays": 0}
+            self.loaded_archives = set()
+            self.generation += 1  # lets derived structures (graph.py) notice they must rebuild
+
+    def tables(self, name: str) -> List[Any]:
+        """The live table and its archived copies."""
+        return [self.metadata.tables[name]] + [t if name == "transfers" else p for _, t, p in self.archives()]
+
+    def refresh(self, conn) -> "LedgerColumns":
+        transfers, pays, accounts = (self.metadata.tables[n] for n in ("transfers", "pays", "accounts"))
+        with self._lock:
+            self.account_ids = load_columns(conn, select(accounts.c.id).order_by(accounts.c.id))[:, 0]
+            for name, t, p in self.archives():
+                if name in self.loaded_archives:
+                    continue
+                self.transfers = np.concatenate([self.transfers, load_columns(conn, select(
+                    t.c.from_account_id, t.c.to_account_id, t.c.amount_minor, epoch_us(t.c.created_at)))])
+                self.pays = np.concatenate([self.pays, load_columns(conn, select(
+                    p.c.from_account_id, p.c.amount_minor, epoch_us(p.c.created_at), p.c.merchant_id_fk))])
+                self.loaded_archives.add(name)
+            for name, table, cols, extra in (
+                ("transfers", transfers, (transfers.c.from_account_id, transfers.c.to_account_id), ()),
+                ("pays", pays, (pays.c.from_account_id,), (pays.c.merchant_id_fk,)),
+            ):
+                new = load_columns(conn, select(table.c.id, *cols, table.c.amount_minor, epoch_us(table.c.created_at), *extra)
+                                   .where(table.c.id > self.last_ids[name]).order_by(table.c.id))
+                if len(new):
+                    self.last_ids[name] = int(new[-1, 0])
+                    setattr(self, name, np.concatenate([getattr(self, name), new[:, 1:]]))
+        return self
+
+    def bucket_sums(self, edges: List[datetime]) -> Tuple[np.ndarray, np.ndarray]:
+        """Sums per account and time bucket: bucket 0 is before edges[0], bucket i is [edges[i-1], edges[i]).
+
+        Returns (account ids, int64 array shaped [incoming | outgoing_transfers | outgoing_pays, account, bucket]).
+        """
+        with self._lock:
+            ids, t, p = self.account_ids, self.transfers, self.pays
+        size = int(ids.max()) + 1 if ids.size else 1
+        edges_us = np.array([to_epoch_us(e) for e in edges], dtype=np.int64)
+        nb = len(edges) + 1  # the last bucket (after every edge) is computed and dropped
+        tb = np.searchsorted(edges_us, t[:, 3], side="right")
+        pb = np.searchsorted(edges_us, p[:, 2], side="right")
+        # key = account_id * nb + bucket, so one pass sums every account and bucket at once
+        sums = np.stack([
+            group_sum(t[:, 1] * nb + tb, t[:, 2], size * nb),
+            group_sum(t[:, 0] * nb + tb, t[:, 2], size * nb),
+            group_sum(p[:, 0] * nb + pb, p[:, 1], size * nb),
+        ]).reshape(3, size, nb)
+        return ids, sums[:, ids, :-1]
+
+def account_totals(cols: LedgerColumns, before: datetime) -> Dict[str, np.ndarray]:
+    """incoming / outgoing_transfers / outgoing_pays / balance per account for rows created before `before`."""
+    ids, sums = cols.bucket_sums([before])
+    inc, out_t, out_p = sums[0, :, 0], sums[1, :, 0], sums[2, :, 0]
+    return {"account_id": ids, "incoming": inc, "outgoing_transfers": out_t, "outgoing_pays": out_p,
+            "balance": inc - out_t - out_p}
+
+def month_bounds(period: str) -> Tuple[datetime, datetime]:
+    start = datetime.strptime(period, "%Y-%m")
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start, end
+
+def month_statements(cols: LedgerColumns, period: str) -> Dict[str, np.ndarray]:
+    """Month-end statement for every account: opening, incoming, outgoing, paid, closing (minor units)."""
+    ids, sums = cols.bucket_sums(list(month_bounds(period)))
+    opening = sums[0, :, 0] - sums[1, :, 0] - sums[2, :, 0]
+    inc, out, paid = sums[0, :, 1], sums[1, :, 1], sums[2, :, 1]
+    return {"account_id": ids, "opening": opening, "incoming": inc, "outgoing": out, "paid": paid,
+            "closing": opening + inc - out - paid}
+
+def month_statements_rowwise(conn, cols: LedgerColumns, period: str) -> Dict[int, List[int]]:
+    """Reference implementation: one Python addition per row. Used by `statements --verify`."""
+    start, end = month_bounds(period)
+    accounts = cols.metadata.tables["accounts"]
+    out = {acct_id: [0, 0, 0, 0] for (acct_id,) in conn.execute(select(accounts.c.id))}  # opening, in, out, paid
+    for transfers in cols.tables("transfers"):
+        for src, dst, amount, created in conn.execute(select(transfers.c.from_account_id, transfers.c.to_account_id,
+                                                             transfers.c.amount_minor, transfers.c.created_at)):
+            if created >= end:
+                continue
+            if created < start:
+                out[dst][0] += amount; out[src][0] -= amount
+            else:
+                out[dst][1] += amount; out[src][2] += amount
+    for pays in cols.tables("pays"):
+        for src, amount, created in conn.execute(select(pays.c.from_account_id, pays.c.amount_minor, pays.c.created_at)):
+            if created >= end:
+                continue
+            if created < start:
+                out[src][0] -= amount
+            else:
+                out[src][3] += amount
+    return out
+
+def verify_statements(conn, cols: LedgerColumns, period: str) -> Dict[str, Any]:
+    """Compare the NumPy path against the row-by-row reference; returns timings and mismatching account ids."""
+    t0 = time.perf_counter()
+    fast = month_statements(cols, period)
+    t1 = time.perf_counter()
+    slow = month_statements_rowwise(conn, cols, period)
+    t2 = time.perf_counter()
+    names = ("opening", "incoming", "outgoing", "paid")
+    mismatched = [
+        int(acct_id) for i, acct_id in enumerate(fast["account_id"])
+        if [int(fast[c][i]) for c in names] != slow.get(int(acct_id))
+    ]
+    return {"accounts": len(fast["account_id"]), "mismatched": mismatched,
+            "numpy_seconds": t1 - t0, "rowwise_seconds": t2 - t1}
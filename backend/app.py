@@ -1,106 +1,138 @@
+import atexit
+import base64
+import csv
+import io
+import json
 import os
-from datetime import datetime, timezone
-from typing import Any, Dict, List
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List
 
-from flask import Flask, request, jsonify
+IMPORT_STARTED = time.perf_counter()
+
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 
-from sqlalchemy import (create_engine, Column, Integer, String, Float, DateTime, ForeignKey, UniqueConstraint, func, select, or_, literal)
+import click
+from sqlalchemy import inspect, func, select, insert, update, union_all, and_, or_, literal
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker, scoped_session, aliased
 
-from sqlalchemy.orm import declarative_base, relationship, sessionmaker, scoped_session
+import aggregates
+import graph
+import migrations
+import partitions
+import storage
+from cache import TTLCache
+from ingest import IngestLog, GroupWriter
+from instrumentation import Instrumentation
+from models import (Base, Customer, Account, Merchant, Owns, Transfer, Pay, AccountBalance, IngestCheckpoint, LedgerPartition,
+                    PartitionClosing, merchants_fts, merchants_prefix, compute_balances)
+from money import to_minor, from_minor, format_minor
 
 # -------------------- setup --------------------
+# importing this module only reads settings and builds statements; the database is first touched by
+# init_engines() (on first use, or at worker boot through create_app(warmup=True))
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 DEV_SEED_TOKEN = os.getenv("DEV_SEED_TOKEN")
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "300"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "100000"))
+RECENT_TX_TTL_SECONDS = float(os.getenv("RECENT_TX_TTL_SECONDS", "600"))
+RECENT_TX_MAX_ENTRIES = int(os.getenv("RECENT_TX_MAX_ENTRIES", "50000"))
+INGEST_MODE = os.getenv("INGEST_MODE", "").lower() in ("1", "true", "yes")
+INGEST_LOG_PATH = os.getenv("INGEST_LOG_PATH", "./records/ingest.log")
+INGEST_GROUP_ROWS = int(os.getenv("INGEST_GROUP_ROWS", "500"))
+INGEST_GROUP_MS = float(os.getenv("INGEST_GROUP_MS", "50"))
+INGEST_FSYNC = os.getenv("INGEST_FSYNC", "1").lower() in ("1", "true", "yes")
+INGEST_LOG_MAX_BYTES = int(os.getenv("INGEST_LOG_MAX_BYTES", str(64 << 20)))
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "wal")
+SQLITE_PRAGMAS = os.getenv("SQLITE_PRAGMAS", "")
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", "8"))
+SQLITE_WRITE_TIMEOUT = float(os.getenv("SQLITE_WRITE_TIMEOUT", "30"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "./records/archive")
+GRAPH_REFRESH_SECONDS = float(os.getenv("GRAPH_REFRESH_SECONDS", "1"))
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "").lower() in ("1", "true", "yes")
+WARMUP_LEDGER = os.getenv("WARMUP_LEDGER", "").lower() in ("1", "true", "yes")
+
+# engine: the single serialized writer (POST endpoints, migrations); read_engine: query_only pool for GETs (storage.py).
+# Both stay None until init_engines(); use get_engine() / get_read_engine() / db() / read_db().
+engine = read_engine = None
+SQLITE_PRAGMA_VALUES: Dict[str, Any] = {}
+SessionLocal = scoped_session(sessionmaker(autoflush=False, expire_on_commit=False, future=True))
+ReadSessionLocal = scoped_session(sessionmaker(autoflush=False, expire_on_commit=False, future=True))
+
+# routes and CLI commands; create_app() registers them (cli_group=None keeps `flask db-upgrade` etc. top level)
+bp = Blueprint("api", __name__, cli_group=None)
+
+# routes transfers/pays queries over the live tables and the attached archive files (partitions.py)
+ledger = partitions.LedgerRouter(Base.metadata, ARCHIVE_DIR)
+
+# -------------------- engines (lazy) --------------------
+_init_lock = threading.RLock()
+engines_ready = False
+merchant_fts = None  # whether migration 7 created merchants_fts; checked once the engines exist
+
+def init_engines():
+    """Create the write/read engines and load the archive routing, once per process.
+
+    Runs the pending migrations first only with AUTO_MIGRATE=1; otherwise the schema is set up by `flask db-upgrade`.
+    """
+    global engine, read_engine, SQLITE_PRAGMA_VALUES, engines_ready
+    if engines_ready:
+        return
+    with _init_lock:
+        if engine is not None:  # ready, or being initialized further up this thread's stack
+            return
+        writer, reader, pragmas = storage.create_engines(
+            DATABASE_URL, SQLITE_PROFILE, SQLITE_PRAGMAS, read_pool_size=SQLITE_READ_POOL_SIZE, write_timeout=SQLITE_WRITE_TIMEOUT)
+        SessionLocal.configure(bind=writer)
+        ReadSessionLocal.configure(bind=reader)
+        # both pools attach the archives: reads span archived months, txId dedupe on writes checks them
+        ledger.install(reader)
+        ledger.install(writer)
+        if instrumentation:
+            watch_engines(instrumentation, writer, reader)
+        engine, read_engine, SQLITE_PRAGMA_VALUES = writer, reader, pragmas
+        if AUTO_MIGRATE:
+            migrations.upgrade(engine, Base.metadata)
+        reload_ledger_partitions()
+        engines_ready = True
+
+def get_engine():
+    init_engines()
+    return engine
+
+def get_read_engine():
+    init_engines()
+    return read_engine
+
+def has_merchant_fts() -> bool:
+    global merchant_fts
+    if merchant_fts is None:
+        merchant_fts = inspect(get_read_engine()).has_table("merchants_fts")
+    return merchant_fts
 
-engine = create_engine(DATABASE_URL, echo=False, future=True)
-SessionLocal = scoped_session(sessionmaker(bind=engine, autoflush=False, expire_on_commit=False, future=True))
-Base = declarative_base()
-
-app = Flask(__name__)
-CORS(app)
-
-# -------------------- models --------------------
-class Customer(Base):
-    __tablename__ = "customers"
-    id = Column(Integer, primary_key=True)
-    customer_id = Column(String(64), unique=True, index=True, nullable=False)
-    name = Column(String(128))
-
-    accounts = relationship("Owns", back_populates="customer", cascade="all, delete-orphan")
-
-class Account(Base):
-    __tablename__ = "accounts"
-    id = Column(Integer, primary_key=True)
-    account_no = Column(String(64), unique=True, index=True, nullable=False)
-    type = Column(String(32))
-    currency = Column(String(8), default="USD")
-    status = Column(String(32), default="active")
-
-    owners = relationship("Owns", back_populates="account", cascade="all, delete-orphan")
-    transfers_out = relationship("Transfer", foreign_keys="Transfer.from_account_id", back_populates="from_account")
-    transfers_in = relationship("Transfer", foreign_keys="Transfer.to_account_id", back_populates="to_account")
-    pays_out = relationship("Pay", back_populates="from_account")
-
-class Merchant(Base):
-    __tablename__ = "merchants"
-    id = Column(Integer, primary_key=True)
-    merchant_id = Column(String(64), unique=True, index=True, nullable=False)
-    name = Column(String(128))
-    mcc = Column(String(8))
-
-    pays_in = relationship("Pay", back_populates="merchant")
-
-class Owns(Base):
-    __tablename__ = "owns"
-    id = Column(Integer, primary_key=True)
-    customer_id_fk = Column(Integer, ForeignKey("customers.id"), nullable=False)
-    account_id_fk = Column(Integer, ForeignKey("accounts.id"), nullable=False)
-    since = Column(DateTime, default=datetime.now)
-
-    customer = relationship("Customer", back_populates="accounts")
-    account = relationship("Account", back_populates="owners")
-    __table_args__ = (UniqueConstraint("customer_id_fk", "account_id_fk", name="uq_owns"),)
-
-class Transfer(Base):
-    __tablename__ = "transfers"
-    id = Column(Integer, primary_key=True)
-    tx_id = Column(String(128), unique=True, index=True, nullable=False)
-    amount = Column(Float, nullable=False)
-    currency = Column(String(8), default="USD")
-    channel = Column(String(32), default="api")
-    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
-
-    from_account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
-    to_account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
-
-    from_account = relationship("Account", foreign_keys=[from_account_id], back_populates="transfers_out")
-    to_account = relationship("Account", foreign_keys=[to_account_id], back_populates="transfers_in")
-
-class Pay(Base):
-    __tablename__ = "pays"
-    id = Column(Integer, primary_key=True)
-    tx_id = Column(String(128), unique=True, index=True, nullable=False)
-    amount = Column(Float, nullable=False)
-    currency = Column(String(8), default="USD")
-    channel = Column(String(32), default="api")
-    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
-
-    from_account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
-    merchant_id_fk = Column(Integer, ForeignKey("merchants.id"), nullable=False)
-
-    from_account = relationship("Account", back_populates="pays_out")
-    merchant = relationship("Merchant", back_populates="pays_in")
-
-
-Base.metadata.create_all(engine)
+def upgrade_schema(target: int = None) -> List[tuple]:
+    """Apply pending migrations (`flask db-upgrade`) and re-read what they may have added."""
+    global merchant_fts
+    applied = migrations.upgrade(get_engine(), Base.metadata, target=target)
+    merchant_fts = None
+    reload_ledger_partitions()
+    return applied
 
 # -------------------- helpers --------------------
-def db():  # context helper
+def db():  # context helper; the write connection
+    init_engines()
     return SessionLocal()
 
+def read_db():  # GET endpoints: never waits on a writer's commit
+    init_engines()
+    return ReadSessionLocal()
+
 def ok(data: Any = None):
     if data is None:
         return jsonify({"ok": True})
@@ -115,199 +147,972 @@ def require_fields(obj: Dict[str, Any], fields: List[str]):
             return False
     return True
 
+TRANSFER_FIELDS = ["from", "to", "amount", "currency", "txId"]
+PAY_FIELDS = ["from", "merchantId", "amount", "currency", "txId"]
+MAX_BATCH_ITEMS = 5000
+
+def validate_tx(data: Dict[str, Any], fields: List[str]):
+    """Shared per-item validation for single and batch writes; returns (row values, error message)."""
+    if not isinstance(data, dict) or not require_fields(data, fields):
+        return None, "missing fields"
+    for f in ("from", "to", "merchantId", "channel", "currency"):
+        # natural keys feed set-based lookups and currency picks the exponent; a list/dict/number would fail the whole batch
+        if data.get(f) is not None and not isinstance(data[f], str):
+            return None, f"invalid {f}"
+    tx_id = data["txId"]
+    if isinstance(tx_id, int) and not isinstance(tx_id, bool):
+        tx_id = str(tx_id)  # tx_id is TEXT: the insert, the dedupe lookups and the caches must all see '77'
+    if not isinstance(tx_id, str):
+        return None, "invalid txId"
+    currency = (data.get("currency") or "USD").upper()
+    try:
+        amt = to_minor(data["amount"], currency)
+        if amt < 0: raise ValueError()
+    except Exception:
+        return None, "invalid amount"
+    try:
+        # stored as naive UTC, which is also what the closed-month check compares
+        created_at = partitions.naive_utc(datetime.fromisoformat(data["createdAt"])) if data.get("createdAt") else datetime.now(timezone.utc)
+    except (TypeError, ValueError):
+        return None, "invalid createdAt"
+    init_engines()  # loads the closed periods
+    if ledger.in_closed_period(created_at):
+        # closings and as-of sums start after the last closed month; a row inside it would never be counted
+        return None, f"createdAt is in a closed month (closed through {ledger.closed[-1]})"
+    return {
+        "tx_id": tx_id,
+        "amount_minor": amt,
+        "currency": currency,
+        "channel": data.get("channel") or "api",
+        "created_at": created_at,
+    }, None
+
+def lookup_ids(s, key_col, id_col, keys) -> Dict[str, int]:
+    if not keys:
+        return {}
+    return dict(s.execute(select(key_col, id_col).where(key_col.in_(keys))).all())
+
+# -------------------- reference data cache --------------------
+# natural key -> id for the write paths, plus the rarely-changing list endpoints
+account_ids = TTLCache("account_ids", maxsize=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS)
+merchant_ids = TTLCache("merchant_ids", maxsize=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS)
+customer_ids = TTLCache("customer_ids", maxsize=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS)
+reference_lists = TTLCache("reference_lists", maxsize=1024, ttl=CACHE_TTL_SECONDS)
+# (table, txId) -> payload fingerprint of recent single writes, so client retries skip the DB
+recent_tx_ids = TTLCache("recent_tx_ids", maxsize=RECENT_TX_MAX_ENTRIES, ttl=RECENT_TX_TTL_SECONDS)
+REFERENCE_CACHES = [account_ids, merchant_ids, customer_ids, reference_lists, recent_tx_ids]
+
+def resolve_ids(s, cache: TTLCache, key_col, id_col, keys) -> Dict[str, int]:
+    """Natural keys -> ids, hitting the DB (one IN query) only for cache misses. Unknown keys are not cached."""
+    found, missing = cache.get_many(keys)
+    if missing:
+        loaded = lookup_ids(s, key_col, id_col, missing)
+        cache.set_many(loaded)
+        found.update(loaded)
+    return found
+
+def resolve_account(s, account_no: str):
+    return resolve_ids(s, account_ids, Account.account_no, Account.id, {account_no}).get(account_no)
+
+def resolve_merchant(s, merchant_id: str):
+    return resolve_ids(s, merchant_ids, Merchant.merchant_id, Merchant.id, {merchant_id}).get(merchant_id)
+
+def invalidate_reference_caches():
+    for c in REFERENCE_CACHES:
+        c.invalidate()
+
+def batch_items():
+    data = request.get_json(force=True)
+    items = data.get("items") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return None, json_error("items must be a list", 400)
+    if len(items) > MAX_BATCH_ITEMS:
+        return None, json_error(f"too many items (max {MAX_BATCH_ITEMS})", 400)
+    return items, None
+
+def batch_result(results: List[Dict[str, Any]]):
+    counts: Dict[str, int] = {}
+    for r in results:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    return ok({"results": results, "counts": counts})
+
+# -------------------- balance ledger --------------------
+def apply_balance_delta(s, account_id: int, incoming: int = 0, outgoing_transfers: int = 0, outgoing_pays: int = 0):
+    """Add a delta to an account's ledger row; caller commits together with the Transfer/Pay insert."""
+    delta = incoming - outgoing_transfers - outgoing_pays
+    res = s.execute(
+        update(AccountBalance)
+        .where(AccountBalance.account_id == account_id)
+        .values(
+            incoming=AccountBalance.incoming + incoming,
+            outgoing_transfers=AccountBalance.outgoing_transfers + outgoing_transfers,
+            outgoing_pays=AccountBalance.outgoing_pays + outgoing_pays,
+            balance=AccountBalance.balance + delta,
+            updated_at=datetime.now(timezone.utc),
+        )
+    )
+    if res.rowcount == 0:
+        s.add(AccountBalance(
+            account_id=account_id,
+            incoming=incoming,
+            outgoing_transfers=outgoing_transfers,
+            outgoing_pays=outgoing_pays,
+            balance=delta,
+        ))
+        s.flush()
+
+def rebuild_balances(s, dry_run: bool = False) -> List[Dict[str, Any]]:
+    """Rewrite the ledger from raw rows and return the accounts whose stored balance had drifted."""
+    expected = compute_balances(s)
+    stored = {b.account_id: b for b in s.execute(select(AccountBalance)).scalars().all()}
+    accts = {r.id: (r.account_no, r.currency) for r in s.execute(select(Account.id, Account.account_no, Account.currency))}
+    drift = []
+    for acct_id in sorted(set(expected) | set(stored)):
+        inc, out_t, out_p = expected.get(acct_id, (0, 0, 0))
+        bal = inc - out_t - out_p
+        row = stored.get(acct_id)
+        have = row.balance if row else 0
+        if have != bal:
+            account_no, currency = accts.get(acct_id, (None, None))
+            drift.append({"accountNo": account_no, "stored": from_minor(have, currency), "expected": from_minor(bal, currency),
+                          "diff": from_minor(have - bal, currency)})
+        if dry_run:
+            continue
+        if row is None:
+            row = AccountBalance(account_id=acct_id)
+            s.add(row)
+        row.incoming, row.outgoing_transfers, row.outgoing_pays, row.balance = inc, out_t, out_p, bal
+        row.updated_at = datetime.now(timezone.utc)
+    if not dry_run:
+        s.commit()
+    return drift
+
+
+# column snapshot for bulk statements/balances; refreshed incrementally (see aggregates.py)
+ledger_columns = aggregates.LedgerColumns(Base.metadata, lambda: [
+    (schema, a["tables"]["transfers"], a["tables"]["pays"]) for schema, a in ledger.archives.items()])
+
+def reload_ledger_partitions():
+    """Pick up months closed or archived by another process (e.g. `flask archive-partitions`)."""
+    with get_read_engine().connect() as conn:
+        ledger.load(conn)
+    ledger.reattach()
+    ledger_columns.reset()
+
+# -------------------- statements shared by the WSGI and ASGI (asgi.py) routes --------------------
+def accounts_stmt():
+    return select(Account.account_no, Account.type, Account.currency, Account.status).order_by(Account.account_no)
+
+def account_row(r) -> Dict[str, Any]:
+    return {"accountNo": r[0], "type": r[1], "currency": r[2], "status": r[3]}
+
+def balance_stmt(acct_id: int):
+    # the currency decides the minor-unit exponent; an account without ledger entries has a NULL balance
+    return (select(AccountBalance.balance, Account.currency)
+            .outerjoin(AccountBalance, AccountBalance.account_id == Account.id).where(Account.id == acct_id))
+
+def balance_body(account_no: str, r) -> Dict[str, Any]:
+    balance, currency = r if r is not None else (None, None)
+    return {"accountNo": account_no, "balance": from_minor(balance, currency)}
+
+MERCHANT_SEARCH_LIMIT = 50
+# bm25 is computed only for the first matches in rowid order, so common terms stay cheap on big catalogs
+MERCHANT_SEARCH_CANDIDATES = 1000
+
+def fts_phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+def merchant_search_stmts(q: str, mcc: str = None) -> List[Any]:
+    """Statements to try in order until one returns rows: indexed exact match first, then fuzzy.
+
+    q < 3 chars: word-prefix match (merchants_prefix). Otherwise substring match (trigram merchants_fts);
+    if that finds nothing, any of q's trigrams, ranked by bm25, so typos still find the merchant.
+    """
+    cols = select(Merchant.merchant_id, Merchant.name, Merchant.mcc)
+    if not q or not has_merchant_fts():
+        if mcc:
+            cols = cols.where(Merchant.mcc == mcc)
+        if q:
+            like = f"%{q}%"
+            cols = cols.where(or_(Merchant.name.like(like), Merchant.merchant_id.like(like)))
+        return [cols.order_by(Merchant.name).limit(MERCHANT_SEARCH_LIMIT)]
+
+    def ranked(fts, match):
+        cand = select(fts.c.rowid.label("id"), fts.c.rank.label("rank")).where(fts.c[fts.name].op("MATCH")(match))
+        if mcc:
+            # mcc || '' keeps SQLite from driving the join through ix_merchants_mcc and probing MATCH per row
+            cand = cand.join(Merchant, Merchant.id == fts.c.rowid).where(Merchant.mcc.concat("") == mcc)
+        cand = cand.limit(MERCHANT_SEARCH_CANDIDATES).subquery()
+        return cols.join(cand, cand.c.id == Merchant.id).order_by(cand.c.rank, Merchant.name).limit(MERCHANT_SEARCH_LIMIT)
+
+    words = q.lower().split()
+    if len(q) < 3:
+        return [ranked(merchants_prefix, " ".join(fts_phrase(w) + "*" for w in words))]
+    grams = sorted({w[i:i + 3] for w in words for i in range(len(w) - 2)})
+    stmts = [ranked(merchants_fts, fts_phrase(q.lower()))]
+    if grams:
+        stmts.append(ranked(merchants_fts, " OR ".join(fts_phrase(g) for g in grams)))
+    return stmts
+
+def merchant_row(r) -> Dict[str, Any]:
+    return {"merchantId": r[0], "name": r[1], "mcc": r[2]}
+
 # -------------------- endpoints --------------------
-@app.get("/api/health")
+@bp.get("/api/health")
 def api_health():
     try:
-        with db() as s:
+        with read_db() as s:
             s.execute(select(func.count(Account.id)))
         return ok({"ok": True})
     except Exception as e:
         return json_error(f"backend not ready: {e}", 500)
 
-@app.get("/api/accounts")
+@bp.get("/api/accounts")
 def api_accounts():
-    with db() as s:
-        rows = s.execute(
-            select(Account.account_no, Account.type, Account.currency, Account.status).order_by(Account.account_no)
-        ).all()
-        return ok([
-            {"accountNo": r[0], "type": r[1], "currency": r[2], "status": r[3]}
-            for r in rows
-        ])
-
-@app.get("/api/account/<acct>/balance")
+    def load():
+        with read_db() as s:
+            return [account_row(r) for r in s.execute(accounts_stmt()).all()]
+    return ok(reference_lists.get_or_load("accounts", load))
+
+@bp.get("/api/account/<acct>/balance")
 def api_balance(acct):
-    with db() as s:
-        acc = s.execute(select(Account).where(Account.account_no == acct)).scalar_one_or_none()
-        if not acc:
-            return ok({"accountNo": acct, "balance": 0})
-        incoming = s.execute(
-            select(func.coalesce(func.sum(Transfer.amount), 0.0))
-            .where(Transfer.to_account_id == acc.id)
-        ).scalar_one()
-        outgoing_transfers = s.execute(
-            select(func.coalesce(func.sum(Transfer.amount), 0.0))
-            .where(Transfer.from_account_id == acc.id)
-        ).scalar_one()
-        outgoing_pays = s.execute(
-            select(func.coalesce(func.sum(Pay.amount), 0.0))
-            .where(Pay.from_account_id == acc.id)
-        ).scalar_one()
-        balance = float(incoming) - float(outgoing_transfers) - float(outgoing_pays)
-        return ok({"accountNo": acct, "balance": balance})
-
-@app.get("/api/customer/<cid>/transactions")
-def api_customer_tx(cid):
-    with db() as s:
-        cust = s.execute(select(Customer).where(Customer.customer_id == cid)).scalar_one_or_none()
-        if not cust:
-            return ok([])
-        # 该客户拥有的账户
-        acct_ids = [o.account_id_fk for o in s.execute(select(Owns).where(Owns.customer_id_fk == cust.id)).scalars().all()]
-        if not acct_ids:
-            return ok([])
-        # outgoing transfers
-        t_rows = s.execute(
+    with read_db() as s:
+        acct_id = resolve_account(s, acct)
+        r = s.execute(balance_stmt(acct_id)).first() if acct_id else None
+        return ok(balance_body(acct, r))
+
+BALANCES_MAX_ACCOUNTS = 1000
+BALANCES_STREAM_ROWS = 1000
+
+def ledger_totals():
+    return select(AccountBalance.account_id, AccountBalance.incoming, AccountBalance.outgoing_transfers.label("outgoing"),
+                  AccountBalance.outgoing_pays.label("paid"))
+
+def as_of_totals(as_of: datetime, acct_ids=None):
+    """incoming / outgoing / paid per account over rows created before as_of, as one grouped aggregate.
+
+    Starts from the latest month closing at or before as_of, so only rows after it are summed.
+    """
+    closing = ledger.closing_at(as_of)
+    since = closing[1] if closing else None
+    def legs(acct_col, created_col, *cols):
+        stmt = select(acct_col.label("account_id"), *cols).where(created_col < as_of)
+        if since is not None:
+            stmt = stmt.where(created_col >= since)
+        return stmt.where(acct_col.in_(acct_ids)) if acct_ids is not None else stmt
+    zero = literal(0)
+    branches = []
+    for t in ledger.tables("transfers", since, as_of):
+        branches.append(legs(t.c.to_account_id, t.c.created_at, t.c.amount_minor.label("incoming"), zero.label("outgoing"), zero.label("paid")))
+        branches.append(legs(t.c.from_account_id, t.c.created_at, zero, t.c.amount_minor, zero))
+    for p in ledger.tables("pays", since, as_of):
+        branches.append(legs(p.c.from_account_id, p.c.created_at, zero, zero, p.c.amount_minor))
+    if closing:
+        c = select(PartitionClosing.account_id, PartitionClosing.incoming, PartitionClosing.outgoing_transfers,
+                   PartitionClosing.outgoing_pays).where(PartitionClosing.period == closing[0])
+        branches.append(c.where(PartitionClosing.account_id.in_(acct_ids)) if acct_ids is not None else c)
+    u = union_all(*branches).subquery()
+    return select(u.c.account_id, func.sum(u.c.incoming).label("incoming"), func.sum(u.c.outgoing).label("outgoing"),
+                  func.sum(u.c.paid).label("paid")).group_by(u.c.account_id)
+
+def balances_stmt(account_nos: List[str] = None, as_of: datetime = None):
+    """(account_no, currency, incoming, outgoing, paid) for the given accounts (all if None), current or as of a time."""
+    if as_of is None:
+        totals = ledger_totals()
+    else:
+        wanted = select(Account.id).where(Account.account_no.in_(account_nos)) if account_nos is not None else None
+        totals = as_of_totals(as_of, wanted)
+    totals = totals.subquery()
+    stmt = (select(Account.account_no, Account.currency, func.coalesce(totals.c.incoming, 0), func.coalesce(totals.c.outgoing, 0),
+                   func.coalesce(totals.c.paid, 0))
+            .outerjoin(totals, totals.c.account_id == Account.id).order_by(Account.account_no))
+    return stmt.where(Account.account_no.in_(account_nos)) if account_nos is not None else stmt
+
+def balances_row(account_no: str, currency: str, incoming: int, outgoing: int, paid: int) -> Dict[str, Any]:
+    return {"accountNo": account_no, "currency": currency, "incoming": from_minor(incoming, currency),
+            "outgoing": from_minor(outgoing, currency), "paid": from_minor(paid, currency),
+            "balance": from_minor(incoming - outgoing - paid, currency)}
+
+def all_balances_as_of(as_of: datetime):
+    # every account over the full history: the NumPy column snapshot beats a grouped scan once it is warm
+    with get_read_engine().connect() as conn:
+        totals = aggregates.account_totals(ledger_columns.refresh(conn), as_of)
+        accts = dict((r.id, (r.account_no, r.currency)) for r in conn.execute(select(Account.id, Account.account_no, Account.currency)))
+    rows = [(*accts[int(a)], int(i), int(o), int(p)) for a, i, o, p in zip(
+        totals["account_id"], totals["incoming"], totals["outgoing_transfers"], totals["outgoing_pays"])]
+    return sorted(rows)
+
+def parse_as_of(value: str):
+    return partitions.naive_utc(datetime.fromisoformat(value))
+
+@bp.get("/api/balances")
+def api_balances():
+    """Balances for ?accounts=A-1,A-2 (or ?all=1, streamed), optionally ?asOf=<ISO time> over created_at."""
+    try:
+        as_of = parse_as_of(request.args["asOf"]) if request.args.get("asOf") else None
+    except ValueError:
+        return json_error("invalid asOf", 400)
+    as_of_out = as_of.isoformat() if as_of else None
+
+    if request.args.get("all", "").lower() in ("1", "true", "yes"):
+        def rows():
+            if as_of is not None:
+                yield from all_balances_as_of(as_of)
+                return
+            with read_db() as s:
+                yield from s.execute(balances_stmt().execution_options(yield_per=BALANCES_STREAM_ROWS))
+
+        def generate():
+            yield '{"asOf": %s, "balances": [' % current_app.json.dumps(as_of_out)
+            for i, r in enumerate(rows()):
+                yield ("," if i else "") + current_app.json.dumps(balances_row(*r))
+            yield "]}"
+        return Response(stream_with_context(generate()), mimetype="application/json")
+
+    account_nos = list(dict.fromkeys(a.strip() for a in (request.args.get("accounts") or "").split(",") if a.strip()))
+    if not account_nos:
+        return json_error("accounts or all=1 required", 400)
+    if len(account_nos) > BALANCES_MAX_ACCOUNTS:
+        return json_error(f"at most {BALANCES_MAX_ACCOUNTS} accounts per request", 400)
+    with read_db() as s:
+        rows = s.execute(balances_stmt(account_nos, as_of)).all()
+    found = {r[0] for r in rows}
+    return ok({"asOf": as_of_out, "balances": [balances_row(*r) for r in rows],
+               "notFound": [a for a in account_nos if a not in found]})
+
+FEED_DEFAULT_LIMIT = 200
+FEED_MAX_LIMIT = 500
+
+def encode_cursor(created_at: datetime, tx_id: str) -> str:
+    raw = f"{created_at.isoformat()}|{tx_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(cursor: str):
+    created_at, tx_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|", 1)
+    return datetime.fromisoformat(created_at), tx_id
+
+def older_than(created_col, tx_col, cursor):
+    # keyset predicate for ORDER BY created_at DESC, tx_id DESC
+    ts, tx_id = cursor
+    return or_(created_col < ts, and_(created_col == ts, tx_col < tx_id))
+
+def customer_feed_stmt(customer_pk: int, limit: int, cursor=None):
+    """Newest-first transfers and pays of a customer's accounts, merged by one UNION ALL ... ORDER BY ... LIMIT."""
+    acct_ids = select(Owns.account_id_fk).where(Owns.customer_id_fk == customer_pk)
+    ToAccount = aliased(Account)
+    # later pages skip archives that start after the cursor
+    until = cursor[0] + timedelta(microseconds=1) if cursor else None
+    branches = []
+    for t in ledger.tables("transfers", until=until):
+        branches.append(
             select(
-                literal("Transfers").label("kind"),
-                Account.account_no,               # from
-                Account.account_no,               # placeholder; we'll replace with dst acct in loop
-                Transfer.tx_id, Transfer.amount, Transfer.currency,
-                Transfer.channel, Transfer.created_at, Transfer.to_account_id
+                literal("Transfers").label("kind"), Account.account_no.label("from_acct"), ToAccount.account_no.label("target"),
+                t.c.tx_id, t.c.amount_minor, t.c.currency, t.c.channel, t.c.created_at,
             )
-            .join(Account, Account.id == Transfer.from_account_id)
-            .where(Transfer.from_account_id.in_(acct_ids))
-            .order_by(Transfer.created_at.desc())
-            .limit(200)
-        ).all()
-
-        # pays
-        p_rows = s.execute(
+            .join(Account, Account.id == t.c.from_account_id)
+            .join(ToAccount, ToAccount.id == t.c.to_account_id)
+            .where(t.c.from_account_id.in_(acct_ids))
+        )
+    for p in ledger.tables("pays", until=until):
+        branches.append(
             select(
-                literal("Pays").label("kind"),
-                Account.account_no,
-                Merchant.merchant_id,
-                Pay.tx_id, Pay.amount, Pay.currency,
-                Pay.channel, Pay.created_at
+                literal("Pays").label("kind"), Account.account_no.label("from_acct"), Merchant.merchant_id.label("target"),
+                p.c.tx_id, p.c.amount_minor, p.c.currency, p.c.channel, p.c.created_at,
             )
-            .join(Account, Account.id == Pay.from_account_id)
-            .join(Merchant, Merchant.id == Pay.merchant_id_fk)
-            .where(Pay.from_account_id.in_(acct_ids))
-            .order_by(Pay.created_at.desc())
-            .limit(200)
-        ).all()
-
-        # map to dicts; for transfers, resolve target (dst accountNo)
-        id_to_acct = {a.id: a.account_no for a in s.execute(select(Account.id, Account.account_no)).all()}
-        out = []
-        for kind, fromAcct, _placeholder, txId, amount, currency, channel, ts, dst_id in t_rows:
-            out.append({
-                "kind": kind,
-                "fromAcct": fromAcct,
-                "target": id_to_acct.get(dst_id, None),
-                "txId": txId,
-                "amount": float(amount),
-                "currency": currency,
-                "channel": channel,
-                "createdAt": ts.isoformat() if isinstance(ts, datetime) else str(ts),
-            })
-        for kind, fromAcct, merchId, txId, amount, currency, channel, ts in p_rows:
-            out.append({
-                "kind": kind,
-                "fromAcct": fromAcct,
-                "target": merchId,
-                "txId": txId,
-                "amount": float(amount),
-                "currency": currency,
-                "channel": channel,
-                "createdAt": ts.isoformat() if isinstance(ts, datetime) else str(ts),
-            })
-        # 按时间统一排序并截 200
-        out.sort(key=lambda r: r["createdAt"], reverse=True)
-        return ok(out[:200])
-
-@app.get("/api/merchants")
+            .join(Account, Account.id == p.c.from_account_id)
+            .join(Merchant, Merchant.id == p.c.merchant_id_fk)
+            .where(p.c.from_account_id.in_(acct_ids))
+        )
+    # each branch is limited on its own so no table is read past the page
+    limited = []
+    for q in branches:
+        tbl = q.selected_columns
+        if cursor:
+            q = q.where(older_than(tbl.created_at, tbl.tx_id, cursor))
+        limited.append(select(q.order_by(tbl.created_at.desc(), tbl.tx_id.desc()).limit(limit).subquery()))
+    u = union_all(*limited).subquery()
+    return select(u).order_by(u.c.created_at.desc(), u.c.tx_id.desc()).limit(limit)
+
+def feed_row(r) -> Dict[str, Any]:
+    return {
+        "kind": r.kind,
+        "fromAcct": r.from_acct,
+        "target": r.target,
+        "txId": r.tx_id,
+        "amount": from_minor(r.amount_minor, r.currency),
+        "currency": r.currency,
+        "channel": r.channel,
+        "createdAt": r.created_at.isoformat() if isinstance(r.created_at, datetime) else str(r.created_at),
+    }
+
+def parse_feed_args(args):
+    """(limit, cursor, error message) from the feed's query string."""
+    try:
+        limit = int(args.get("limit") or FEED_DEFAULT_LIMIT)
+        if limit < 1: raise ValueError()
+    except ValueError:
+        return None, None, "invalid limit"
+    cursor = None
+    if args.get("cursor"):
+        try:
+            cursor = decode_cursor(args["cursor"])
+        except Exception:
+            return None, None, "invalid cursor"
+    return min(limit, FEED_MAX_LIMIT), cursor, None
+
+@bp.get("/api/customer/<cid>/transactions")
+def api_customer_tx(cid):
+    limit, cursor, err = parse_feed_args(request.args)
+    if err:
+        return json_error(err, 400)
+
+    with read_db() as s:
+        customer_pk = resolve_ids(s, customer_ids, Customer.customer_id, Customer.id, {cid}).get(cid)
+        if not customer_pk:
+            return ok([])
+        rows = s.execute(customer_feed_stmt(customer_pk, limit, cursor)).all()
+    resp = ok([feed_row(r) for r in rows])
+    # the body stays a plain list; the next page is addressed through this header
+    if len(rows) == limit:
+        last = rows[-1]
+        resp.headers["X-Next-Cursor"] = encode_cursor(last.created_at, last.tx_id)
+    return resp
+
+@bp.get("/api/merchants")
 def api_merchants():
-    q = (request.args.get("q") or "").strip()
+    """?q= search (prefix, substring, then fuzzy) and optional ?mcc= filter; up to 50 ranked merchants."""
+    q, mcc = (request.args.get("q") or "").strip(), (request.args.get("mcc") or "").strip() or None
+    def load():
+        with read_db() as s:
+            for stmt in merchant_search_stmts(q, mcc):
+                rows = s.execute(stmt).all()
+                if rows:
+                    break
+            return [merchant_row(r) for r in rows]
+    return ok(reference_lists.get_or_load(("merchants", q, mcc), load))
+
+# -------------------- idempotent single writes --------------------
+# a txId identifies one write; a retry with the same payload gets the original result back
+TX_IDENTITY = {
+    "transfers": ("from_account_id", "to_account_id", "amount_minor", "currency", "channel"),
+    "pays": ("from_account_id", "merchant_id_fk", "amount_minor", "currency", "channel"),
+}
+
+def tx_fingerprint(model, values: Dict[str, Any]) -> tuple:
+    return tuple(values[c] for c in TX_IDENTITY[model.__tablename__])
+
+def replayed(model, tx_id: str, fingerprint: tuple, stored: tuple, original: Dict[str, Any] = None, status: int = 200):
+    """Response for a txId that already exists: the original answer (ok, or `original` with `status`) for the
+    same payload, 409 otherwise."""
+    if stored != fingerprint:
+        return json_error("txId already used with a different payload", 409)
+    recent_tx_ids.set((model.__tablename__, tx_id), stored)
+    resp = ok(original)
+    resp.status_code = status
+    resp.headers["Idempotent-Replayed"] = "true"
+    return resp
+
+def replayed_item(index: int, tx_id: str, fingerprint: tuple, stored: tuple) -> Dict[str, Any]:
+    """Batch counterpart of replayed(): a same-payload retry is ok, a different payload is a conflict."""
+    if stored != fingerprint:
+        return {"index": index, "txId": tx_id, "status": "conflict", "error": "txId already used with a different payload"}
+    return {"index": index, "txId": tx_id, "status": "ok", "replayed": True}
+
+def stored_fingerprints(s, model, tx_ids) -> Dict[str, tuple]:
+    """txId -> identity fields of the rows already stored under those txIds, archived months included."""
+    if not tx_ids:
+        return {}
+    return ledger.find_tx(s, model.__tablename__, tx_ids, *TX_IDENTITY[model.__tablename__])
+
+def recent_replay(model, values: Dict[str, Any], original: Dict[str, Any] = None, status: int = 200):
+    """Replay/409 response if this txId was written recently by this process, else None."""
+    cached = recent_tx_ids.get((model.__tablename__, values["tx_id"]))
+    return replayed(model, values["tx_id"], tx_fingerprint(model, values), cached, original, status) if cached is not None else None
+
+def insert_tx(s, model, values: Dict[str, Any], deltas: List[tuple]):
+    """Insert relying on the unique tx_id index (plus a lookup in archived months, which it does not cover)
+    instead of a pre-check; duplicates become replays or 409s."""
+    resp = recent_replay(model, values)
+    if resp is not None:
+        return resp
+    fingerprint = tx_fingerprint(model, values)
+    if ledger.archives:
+        stored = stored_fingerprints(s, model, {values["tx_id"]}).get(values["tx_id"])
+        if stored is not None:
+            return replayed(model, values["tx_id"], fingerprint, stored)
+    try:
+        # first statement of the transaction, so a conflict can roll back the whole thing
+        s.execute(insert(model).values(**values))
+    except IntegrityError:
+        s.rollback()
+        stored = stored_fingerprints(s, model, {values["tx_id"]}).get(values["tx_id"])
+        if stored is None:
+            raise
+        return replayed(model, values["tx_id"], fingerprint, stored)
+    for acct_id, delta in deltas:
+        apply_balance_delta(s, acct_id, **delta)
+    s.commit()
+    recent_tx_ids.set((model.__tablename__, values["tx_id"]), fingerprint)
+    return ok()
+
+# -------------------- ingestion mode (opt-in, INGEST_MODE=1) --------------------
+# single writes are acknowledged once fsynced to an append-only log; one thread group-commits them (ingest.py)
+INGEST_CHECKPOINT = "ingest"
+QUEUED = {"ok": True, "queued": True}
+
+def ingest_key(rec: Dict[str, Any]) -> tuple:
+    return rec["kind"], rec["values"]["tx_id"]
+
+def enqueue_tx(model, values: Dict[str, Any]):
+    """202 once logged, unless the txId is already queued or stored: then a replay or 409, as insert_tx answers.
+
+    Single writes in this mode were acknowledged with 202, so a replay is a 202 too (with the seq while queued).
+    """
+    resp = recent_replay(model, values, QUEUED, 202)
+    if resp is not None:
+        return resp
+    writer, key = get_ingest_writer(), (model.__tablename__, values["tx_id"])
+    fingerprint = tx_fingerprint(model, values)
+    # queue before DB: a record leaves the queue only after its group committed, so one of the two sees it
+    pending = writer.queued(key)
+    stored = tx_fingerprint(model, pending["values"]) if pending else None
+    if stored is None:
+        with read_db() as r:
+            stored = stored_fingerprints(r, model, {values["tx_id"]}).get(values["tx_id"])
+    if stored is not None:
+        return replayed(model, values["tx_id"], fingerprint, stored, dict(QUEUED, seq=pending["seq"]) if pending else QUEUED, 202)
+    payload = dict(values, created_at=values["created_at"].isoformat())
+    rec = writer.submit(model.__tablename__, payload, key=key)
+    if rec["values"] is not payload:  # a concurrent request queued this txId first
+        return replayed(model, values["tx_id"], fingerprint, tx_fingerprint(model, rec["values"]), dict(QUEUED, seq=rec["seq"]), 202)
+    recent_tx_ids.set(key, fingerprint)
+    return jsonify(dict(QUEUED, seq=rec["seq"])), 202
+
+def apply_ingested(records: List[Dict[str, Any]]) -> int:
+    """One transaction per group: insert new rows, fold their ledger deltas, advance the checkpoint.
+
+    Returns how many records were skipped because their txId is already stored (enqueue_tx checks
+    before acknowledging, so only rows written meanwhile by a batch request or the CSV loader).
+    """
+    skipped = 0
     with db() as s:
-        stmt = select(Merchant.merchant_id, Merchant.name, Merchant.mcc)
-        if q:
-            like = f"%{q}%"
-            stmt = stmt.where(or_(Merchant.name.like(like), Merchant.merchant_id.like(like)))
-        stmt = stmt.order_by(Merchant.name).limit(50)
-        rows = s.execute(stmt).all()
-        return ok([{"merchantId": r[0], "name": r[1], "mcc": r[2]} for r in rows])
+        deltas: Dict[int, list] = {}
+        for model in (Transfer, Pay):
+            rows = [dict(r["values"], created_at=datetime.fromisoformat(r["values"]["created_at"]))
+                    for r in records if r["kind"] == model.__tablename__]
+            if not rows:
+                continue
+            taken = set(stored_fingerprints(s, model, {r["tx_id"] for r in rows}))
+            fresh = []
+            for r in rows:
+                if r["tx_id"] in taken:
+                    skipped += 1
+                    continue
+                taken.add(r["tx_id"])
+                fresh.append(r)
+                if model is Transfer:
+                    deltas.setdefault(r["from_account_id"], [0, 0, 0])[1] += r["amount_minor"]
+                    deltas.setdefault(r["to_account_id"], [0, 0, 0])[0] += r["amount_minor"]
+                else:
+                    deltas.setdefault(r["from_account_id"], [0, 0, 0])[2] += r["amount_minor"]
+            if fresh:
+                s.execute(insert(model), fresh)
+        for acct_id, (inc, out_t, out_p) in deltas.items():
+            apply_balance_delta(s, acct_id, incoming=inc, outgoing_transfers=out_t, outgoing_pays=out_p)
+        res = s.execute(update(IngestCheckpoint).where(IngestCheckpoint.name == INGEST_CHECKPOINT)
+                        .values(applied_seq=records[-1]["seq"], updated_at=datetime.now(timezone.utc)))
+        if res.rowcount == 0:
+            s.add(IngestCheckpoint(name=INGEST_CHECKPOINT, applied_seq=records[-1]["seq"]))
+        s.commit()
+    return skipped
+
+ingest_writer = None
+
+def get_ingest_writer():
+    """The group-commit writer, started on first use (or at worker boot); None unless INGEST_MODE."""
+    global ingest_writer
+    if not INGEST_MODE:
+        return None
+    with _init_lock:
+        if ingest_writer is None:
+            # through the read pool: the first caller may be a request already holding the single write connection
+            with get_read_engine().connect() as conn:
+                applied_seq = conn.execute(select(IngestCheckpoint.applied_seq).where(IngestCheckpoint.name == INGEST_CHECKPOINT)).scalar() or 0
+            writer = GroupWriter(IngestLog(INGEST_LOG_PATH, fsync=INGEST_FSYNC), apply_ingested, applied_seq,
+                                 group_rows=INGEST_GROUP_ROWS, group_ms=INGEST_GROUP_MS, max_log_bytes=INGEST_LOG_MAX_BYTES,
+                                 key_fn=ingest_key)
+            writer.start()  # replays whatever the log holds past the checkpoint
+            atexit.register(writer.stop)
+            ingest_writer = writer
+    return ingest_writer
 
-@app.post("/api/transfer")
+@bp.post("/api/transfer")
 def api_transfer():
     data = request.get_json(force=True) or {}
-    if not require_fields(data, ["from", "to", "amount", "currency", "txId"]):
-        return json_error("missing fields", 400)
-    try:
-        amt = float(data["amount"])
-        if amt < 0: raise ValueError()
-    except Exception:
-        return json_error("invalid amount", 400)
+    row, err = validate_tx(data, TRANSFER_FIELDS)
+    if err:
+        return json_error(err, 400)
 
     with db() as s:
-        src = s.execute(select(Account).where(Account.account_no == data["from"])).scalar_one_or_none()
-        dst = s.execute(select(Account).where(Account.account_no == data["to"])).scalar_one_or_none()
+        ids = resolve_ids(s, account_ids, Account.account_no, Account.id, {data["from"], data["to"]})
+        src, dst = ids.get(data["from"]), ids.get(data["to"])
         if not src or not dst:
             return json_error("account not found", 400)
-        # unique tx_id
-        exists = s.execute(select(Transfer).where(Transfer.tx_id == data["txId"])).scalar_one_or_none()
-        if exists:
-            return json_error("duplicate txId", 409)
-
-        t = Transfer(
-            tx_id=data["txId"],
-            amount=amt,
-            currency=(data.get("currency") or "USD").upper(),
-            channel=data.get("channel") or "api",
-            created_at=datetime.fromisoformat(data["createdAt"]) if data.get("createdAt") else datetime.now(timezone.utc),
-            from_account_id=src.id,
-            to_account_id=dst.id,
-        )
-        s.add(t)
-        s.commit()
-        return ok()
+        values = dict(row, from_account_id=src, to_account_id=dst)
+        if INGEST_MODE:
+            return enqueue_tx(Transfer, values)
+        amt = row["amount_minor"]
+        return insert_tx(s, Transfer, values, [(src, {"outgoing_transfers": amt}), (dst, {"incoming": amt})])
 
-@app.post("/api/pay")
+@bp.post("/api/pay")
 def api_pay():
     data = request.get_json(force=True) or {}
-    if not require_fields(data, ["from", "merchantId", "amount", "currency", "txId"]):
-        return json_error("missing fields", 400)
-    try:
-        amt = float(data["amount"])
-        if amt < 0: raise ValueError()
-    except Exception:
-        return json_error("invalid amount", 400)
+    row, err = validate_tx(data, PAY_FIELDS)
+    if err:
+        return json_error(err, 400)
 
     with db() as s:
-        acc = s.execute(select(Account).where(Account.account_no == data["from"])).scalar_one_or_none()
-        merch = s.execute(select(Merchant).where(Merchant.merchant_id == data["merchantId"])).scalar_one_or_none()
+        acc, merch = resolve_account(s, data["from"]), resolve_merchant(s, data["merchantId"])
         if not acc or not merch:
             return json_error("account or merchant not found", 400)
-        exists = s.execute(select(Pay).where(Pay.tx_id == data["txId"])).scalar_one_or_none()
-        if exists:
-            return json_error("duplicate txId", 409)
-
-        p = Pay(
-            tx_id=data["txId"],
-            amount=amt,
-            currency=(data.get("currency") or "USD").upper(),
-            channel=data.get("channel") or "api",
-            created_at=datetime.fromisoformat(data["createdAt"]) if data.get("createdAt") else datetime.now(timezone.utc),
-            from_account_id=acc.id,
-            merchant_id_fk=merch.id,
+        values = dict(row, from_account_id=acc, merchant_id_fk=merch)
+        if INGEST_MODE:
+            return enqueue_tx(Pay, values)
+        return insert_tx(s, Pay, values, [(acc, {"outgoing_pays": row["amount_minor"]})])
+
+@bp.post("/api/transfers/batch")
+def api_transfers_batch():
+    items, err = batch_items()
+    if err:
+        return err
+    results: List[Dict[str, Any]] = [None] * len(items)
+    valid = []
+    for i, item in enumerate(items):
+        row, msg = validate_tx(item, TRANSFER_FIELDS)
+        if msg:
+            results[i] = {"index": i, "txId": item.get("txId") if isinstance(item, dict) else None, "status": "invalid", "error": msg}
+        else:
+            valid.append((i, item, row))
+
+    with db() as s:
+        acct_ids = resolve_ids(s, account_ids, Account.account_no, Account.id, {it["from"] for _, it, _ in valid} | {it["to"] for _, it, _ in valid})
+        stored = stored_fingerprints(s, Transfer, {r["tx_id"] for _, _, r in valid})
+        rows, deltas = [], {}
+        for i, item, row in valid:
+            src, dst = acct_ids.get(item["from"]), acct_ids.get(item["to"])
+            if not src or not dst:
+                results[i] = {"index": i, "txId": row["tx_id"], "status": "not_found", "error": "account not found"}
+                continue
+            values = dict(row, from_account_id=src, to_account_id=dst)
+            fingerprint = tx_fingerprint(Transfer, values)
+            if row["tx_id"] in stored:
+                results[i] = replayed_item(i, row["tx_id"], fingerprint, stored[row["tx_id"]])
+            else:
+                stored[row["tx_id"]] = fingerprint
+                rows.append(values)
+                deltas.setdefault(src, [0, 0, 0])[1] += row["amount_minor"]
+                deltas.setdefault(dst, [0, 0, 0])[0] += row["amount_minor"]
+                results[i] = {"index": i, "txId": row["tx_id"], "status": "ok"}
+        if rows:
+            s.execute(insert(Transfer), rows)
+            for acct_id, (inc, out_t, out_p) in deltas.items():
+                apply_balance_delta(s, acct_id, incoming=inc, outgoing_transfers=out_t, outgoing_pays=out_p)
+            s.commit()
+    return batch_result(results)
+
+@bp.post("/api/pays/batch")
+def api_pays_batch():
+    items, err = batch_items()
+    if err:
+        return err
+    results: List[Dict[str, Any]] = [None] * len(items)
+    valid = []
+    for i, item in enumerate(items):
+        row, msg = validate_tx(item, PAY_FIELDS)
+        if msg:
+            results[i] = {"index": i, "txId": item.get("txId") if isinstance(item, dict) else None, "status": "invalid", "error": msg}
+        else:
+            valid.append((i, item, row))
+
+    with db() as s:
+        acct_ids = resolve_ids(s, account_ids, Account.account_no, Account.id, {it["from"] for _, it, _ in valid})
+        merch_ids = resolve_ids(s, merchant_ids, Merchant.merchant_id, Merchant.id, {it["merchantId"] for _, it, _ in valid})
+        stored = stored_fingerprints(s, Pay, {r["tx_id"] for _, _, r in valid})
+        rows, deltas = [], {}
+        for i, item, row in valid:
+            acc, merch = acct_ids.get(item["from"]), merch_ids.get(item["merchantId"])
+            if not acc or not merch:
+                results[i] = {"index": i, "txId": row["tx_id"], "status": "not_found", "error": "account or merchant not found"}
+                continue
+            values = dict(row, from_account_id=acc, merchant_id_fk=merch)
+            fingerprint = tx_fingerprint(Pay, values)
+            if row["tx_id"] in stored:
+                results[i] = replayed_item(i, row["tx_id"], fingerprint, stored[row["tx_id"]])
+            else:
+                stored[row["tx_id"]] = fingerprint
+                rows.append(values)
+                deltas[acc] = deltas.get(acc, 0) + row["amount_minor"]
+                results[i] = {"index": i, "txId": row["tx_id"], "status": "ok"}
+        if rows:
+            s.execute(insert(Pay), rows)
+            for acct_id, amt in deltas.items():
+                apply_balance_delta(s, acct_id, outgoing_pays=amt)
+            s.commit()
+    return batch_result(results)
+
+# -------------------- export --------------------
+# column layout of bank_seeds/*.csv, so an export can be fed back into load_csv_into_ultipa.py
+EXPORT_COLUMNS = {
+    "transfers": ["from_account_no", "to_account_no", "tx_id", "amount", "currency", "channel", "created_at"],
+    "pays": ["from_account_no", "merchant_id", "tx_id", "amount", "currency", "channel", "created_at"],
+}
+EXPORT_KINDS = ("transfers", "pays", "all")
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_YIELD_PER = 1000
+
+def export_stmt(kind: str, since: datetime = None, until: datetime = None, account_id: int = None, merchant_pk: int = None):
+    """Transfers and/or pays in (created_at, tx_id) order with the seed CSV columns; `target` is to_account_no or merchant_id."""
+    ToAccount = aliased(Account)
+    branches = []
+    # live tables plus only the archives that overlap [since, until)
+    for t in ledger.tables("transfers", since, until) if kind in ("transfers", "all") and merchant_pk is None else []:
+        q = (
+            select(
+                literal("transfers").label("kind"), Account.account_no.label("from_acct"), ToAccount.account_no.label("target"),
+                t.c.tx_id, t.c.amount_minor, t.c.currency, t.c.channel, t.c.created_at,
+            )
+            .join(Account, Account.id == t.c.from_account_id)
+            .join(ToAccount, ToAccount.id == t.c.to_account_id)
         )
-        s.add(p)
-        s.commit()
-        return ok()
+        if since: q = q.where(t.c.created_at >= since)
+        if until: q = q.where(t.c.created_at < until)
+        if account_id: q = q.where(or_(t.c.from_account_id == account_id, t.c.to_account_id == account_id))
+        branches.append(q)
+    for p in ledger.tables("pays", since, until) if kind in ("pays", "all") else []:
+        q = (
+            select(
+                literal("pays").label("kind"), Account.account_no.label("from_acct"), Merchant.merchant_id.label("target"),
+                p.c.tx_id, p.c.amount_minor, p.c.currency, p.c.channel, p.c.created_at,
+            )
+            .join(Account, Account.id == p.c.from_account_id)
+            .join(Merchant, Merchant.id == p.c.merchant_id_fk)
+        )
+        if since: q = q.where(p.c.created_at >= since)
+        if until: q = q.where(p.c.created_at < until)
+        if account_id: q = q.where(p.c.from_account_id == account_id)
+        if merchant_pk: q = q.where(p.c.merchant_id_fk == merchant_pk)
+        branches.append(q)
+    u = (union_all(*branches) if len(branches) > 1 else branches[0]).subquery()
+    return select(u).order_by(u.c.created_at, u.c.tx_id)
+
+def export_values(r) -> List[str]:
+    return [r.from_acct, r.target, r.tx_id, format_minor(r.amount_minor, r.currency), r.currency, r.channel,
+            r.created_at.isoformat()]
+
+def export_lines(stmt, kind: str, fmt: str):
+    """Yield the export as text lines; rows come through a server-side cursor EXPORT_YIELD_PER at a time."""
+    buf = io.StringIO()
+    w = csv.writer(buf, lineterminator="\n")
+    if fmt == "csv":
+        w.writerow(EXPORT_COLUMNS[kind])
+        yield buf.getvalue()
+    with read_db() as s:
+        for r in s.execute(stmt.execution_options(yield_per=EXPORT_YIELD_PER)):
+            if fmt == "csv":
+                buf.seek(0); buf.truncate()
+                w.writerow(export_values(r))
+                yield buf.getvalue()
+            else:
+                row = dict(zip(EXPORT_COLUMNS[r.kind], export_values(r)))
+                yield json.dumps({"kind": r.kind, **row}) + "\n"
+
+def export_args(args):
+    """(kind, fmt, stmt kwargs, error) from query-string or CLI style arguments."""
+    kind, fmt = args.get("kind") or "all", args.get("format") or "ndjson"
+    if kind not in EXPORT_KINDS:
+        return None, None, None, "invalid kind"
+    if fmt not in EXPORT_FORMATS:
+        return None, None, None, "invalid format"
+    if fmt == "csv" and kind == "all":
+        return None, None, None, "csv export needs kind=transfers or kind=pays"
+    try:
+        since = parse_as_of(args["from"]) if args.get("from") else None
+        until = parse_as_of(args["to"]) if args.get("to") else None
+    except ValueError:
+        return None, None, None, "invalid from/to"
+    filters = {"since": since, "until": until}
+    with read_db() as s:
+        if args.get("account"):
+            filters["account_id"] = resolve_account(s, args["account"])
+            if not filters["account_id"]:
+                return None, None, None, "account not found"
+        if args.get("merchant"):
+            if kind == "transfers":
+                return None, None, None, "merchant filter applies to pays"
+            filters["merchant_pk"] = resolve_merchant(s, args["merchant"])
+            if not filters["merchant_pk"]:
+                return None, None, None, "merchant not found"
+    return kind, fmt, filters, None
+
+@bp.get("/api/export/transactions")
+def api_export_transactions():
+    """Stream ?kind=transfers|pays|all as ?format=ndjson|csv, filtered by ?from=&to= (created_at), ?account=, ?merchant=."""
+    kind, fmt, filters, err = export_args(request.args)
+    if err:
+        return json_error(err, 404 if err.endswith("not found") else 400)
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    resp = Response(stream_with_context(export_lines(export_stmt(kind, **filters), kind, fmt)), mimetype=mimetype)
+    if fmt == "csv":
+        resp.headers["Content-Disposition"] = f"attachment; filename={kind}.csv"
+    return resp
+
+# -------------------- graph analytics --------------------
+# CSR adjacency over the ledger column snapshot (graph.py); new transfers reach it on the next refresh
+transfer_graph = graph.TransferGraph()
+graph_refreshed_at = 0.0
+GRAPH_MAX_HOPS = 6
+GRAPH_MAX_CYCLE_LEN = 8
+GRAPH_MAX_LIMIT = 1000
+
+def graph_snapshot() -> graph.GraphSnapshot:
+    """Current graph; the ledger snapshot is re-read at most every GRAPH_REFRESH_SECONDS."""
+    global graph_refreshed_at
+    if time.monotonic() - graph_refreshed_at >= GRAPH_REFRESH_SECONDS or not transfer_graph.layers:
+        with get_read_engine().connect() as conn:
+            ledger_columns.refresh(conn)
+        graph_refreshed_at = time.monotonic()
+    return transfer_graph.refresh(ledger_columns)
+
+def parse_graph_args(args, currency: str, defaults: Dict[str, int], maxima: Dict[str, int]):
+    """(options, error message): integer options within 1..max, plus minAmount (minor units) and since (epoch us)."""
+    opts = {}
+    for name, default in defaults.items():
+        try:
+            opts[name] = int(args.get(name) or default)
+        except ValueError:
+            return None, f"invalid {name}"
+        if not 1 <= opts[name] <= maxima[name]:
+            return None, f"{name} must be between 1 and {maxima[name]}"
+    try:
+        opts["min_amount"] = to_minor(args["minAmount"], currency) if args.get("minAmount") else 0
+    except ValueError as e:
+        return None, f"invalid minAmount: {e}"
+    try:
+        opts["since_us"] = aggregates.to_epoch_us(parse_as_of(args["since"])) if args.get("since") else graph.NO_TIME
+    except ValueError:
+        return None, "invalid since"
+    return opts, None
+
+def graph_account(s, acct: str):
+    """(account id, currency) or None."""
+    acct_id = resolve_account(s, acct)
+    if not acct_id:
+        return None
+    return acct_id, s.execute(select(Account.currency).where(Account.id == acct_id)).scalar()
+
+def account_nos(s, ids) -> Dict[int, str]:
+    return dict(s.execute(select(Account.id, Account.account_no).where(Account.id.in_(set(ids)))).all()) if ids else {}
+
+def epoch_iso(us: int):
+    return (aggregates.EPOCH + timedelta(microseconds=us)).isoformat() if us != graph.NO_TIME else None
+
+@bp.get("/api/graph/account/<acct>/fanout")
+def api_graph_fanout(acct):
+    """Accounts reached within ?hops= transfers (?direction=out|in), filtered by ?minAmount= and ?since=."""
+    direction = request.args.get("direction") or "out"
+    if direction not in ("out", "in"):
+        return json_error("direction must be out or in", 400)
+    with read_db() as s:
+        found = graph_account(s, acct)
+        if not found:
+            return json_error("account not found", 404)
+        acct_id, currency = found
+        opts, err = parse_graph_args(request.args, currency, {"hops": 2, "limit": 100},
+                                     {"hops": GRAPH_MAX_HOPS, "limit": GRAPH_MAX_LIMIT})
+        if err:
+            return json_error(err, 400)
+        r = graph_snapshot().fanout(acct_id, opts["hops"], direction, opts["min_amount"], opts["since_us"], opts["limit"])
+        nos = account_nos(s, [a for a, _, _ in r["accounts"]])
+    return ok({
+        "accountNo": acct, "direction": direction, "reached": r["reached"],
+        "hops": [dict(h, amount=from_minor(h["amount"], currency)) for h in r["hops"]],
+        "accounts": [{"accountNo": nos.get(a), "hop": hop, "amount": from_minor(amt, currency)} for a, hop, amt in r["accounts"]],
+    })
+
+@bp.get("/api/graph/account/<acct>/cycles")
+def api_graph_cycles(acct):
+    """Transfer cycles that return money to this account within ?maxLen= hops, heaviest first."""
+    with read_db() as s:
+        found = graph_account(s, acct)
+        if not found:
+            return json_error("account not found", 404)
+        acct_id, currency = found
+        opts, err = parse_graph_args(request.args, currency, {"maxLen": 4, "limit": 20},
+                                     {"maxLen": GRAPH_MAX_CYCLE_LEN, "limit": GRAPH_MAX_LIMIT})
+        if err:
+            return json_error(err, 400)
+        r = graph_snapshot().cycles(acct_id, opts["maxLen"], opts["min_amount"], opts["since_us"], opts["limit"])
+        nos = account_nos(s, [a for c in r["cycles"] for a in c["accounts"]])
+    return ok({
+        "accountNo": acct, "complete": r["complete"],
+        "cycles": [{"accounts": [nos.get(a) for a in c["accounts"]], "amounts": [from_minor(a, currency) for a in c["amounts"]],
+                    "minAmount": from_minor(c["minAmount"], currency)} for c in r["cycles"]],
+    })
+
+@bp.get("/api/graph/account/<acct>/counterparties")
+def api_graph_counterparties(acct):
+    """Top ?limit= accounts by money sent + received, and top merchants paid."""
+    with read_db() as s:
+        found = graph_account(s, acct)
+        if not found:
+            return json_error("account not found", 404)
+        acct_id, currency = found
+        opts, err = parse_graph_args(request.args, currency, {"limit": 10}, {"limit": GRAPH_MAX_LIMIT})
+        if err:
+            return json_error(err, 400)
+        r = graph_snapshot().counterparties(acct_id, opts["limit"])
+        nos = account_nos(s, [a[0] for a in r["accounts"]])
+        merchants = dict(s.execute(select(Merchant.id, Merchant.merchant_id)
+                                   .where(Merchant.id.in_({m[0] for m in r["merchants"]}))).all()) if r["merchants"] else {}
+    return ok({
+        "accountNo": acct,
+        "accounts": [{"accountNo": nos.get(a), "sent": from_minor(sent, currency), "received": from_minor(rec, currency),
+                      "transfers": n, "lastAt": epoch_iso(last)} for a, sent, rec, n, last in r["accounts"]],
+        "merchants": [{"merchantId": merchants.get(m), "paid": from_minor(paid, currency), "pays": n, "lastAt": epoch_iso(last)}
+                      for m, paid, n, last in r["merchants"]],
+    })
+
+@bp.get("/api/graph/stats")
+def api_graph_stats():
+    graph_snapshot()
+    return ok(transfer_graph.stats())
+
+# -------------------- hot queries --------------------
+# statements the EXPLAIN check (`flask explain-check`) requires to be index-served
+HOT_QUERIES: Dict[str, Callable[[], Any]] = {
+    "balance": lambda: balance_stmt(1),
+    "account_lookup": lambda: select(Account).where(Account.account_no == "A-0"),
+    "merchant_lookup": lambda: select(Merchant).where(Merchant.merchant_id == "M-0"),
+    "merchant_search": lambda: merchant_search_stmts("grocery", "5411")[0],
+    "merchant_search_prefix": lambda: merchant_search_stmts("gr")[0],
+    "merchant_mcc": lambda: merchant_search_stmts("", "5411")[0],
+    "transfer_txid": lambda: select(Transfer).where(Transfer.tx_id == "TX-0"),
+    "pay_txid": lambda: select(Pay).where(Pay.tx_id == "TX-0"),
+    "customer_feed": lambda: customer_feed_stmt(1, FEED_DEFAULT_LIMIT),
+    "customer_feed_page": lambda: customer_feed_stmt(1, FEED_DEFAULT_LIMIT, (datetime(2025, 1, 1), "TX-0")),
+    "account_transfers_in": lambda: select(func.sum(Transfer.amount_minor)).where(Transfer.to_account_id == 1, Transfer.created_at < datetime(2025, 1, 1)),
+    "account_transfers_out": lambda: select(func.sum(Transfer.amount_minor)).where(Transfer.from_account_id == 1, Transfer.created_at < datetime(2025, 1, 1)),
+    "balances_many": lambda: balances_stmt(["A-0", "A-1"]),
+    "balances_many_as_of": lambda: balances_stmt(["A-0", "A-1"], datetime(2025, 1, 1)),
+    "export_range": lambda: export_stmt("all", since=datetime(2025, 1, 1), until=datetime(2025, 2, 1)),
+    "export_account": lambda: export_stmt("all", account_id=1),
+    "export_merchant": lambda: export_stmt("pays", merchant_pk=1),
+    "balances_closing": lambda: select(PartitionClosing).where(PartitionClosing.period == "2025-01", PartitionClosing.account_id.in_([1, 2])),
+    "account_pays_out": lambda: select(func.sum(Pay.amount_minor)).where(Pay.from_account_id == 1, Pay.created_at < datetime(2025, 1, 1)),
+}
 
 # ----------- minimal seed (optional) -----------
-@app.post("/api/seed/minimal")
+@bp.post("/api/seed/minimal")
 def api_seed_minimal():
     token = request.headers.get("X-Seed-Token")
     if token != DEV_SEED_TOKEN:
@@ -352,7 +1157,297 @@ def api_seed_minimal():
         ensure_owns(c2, a2)
 
         s.commit()
-        return ok({"seeded": True})
+    invalidate_reference_caches()
+    return ok({"seeded": True})
+
+# -------------------- cache admin --------------------
+@bp.get("/api/cache/stats")
+def api_cache_stats():
+    return ok({c.name: c.stats() for c in REFERENCE_CACHES})
+
+@bp.post("/api/cache/invalidate")
+def api_cache_invalidate():
+    # called by load_csv_into_ultipa.py --invalidate-url after it modifies reference tables, and after archival
+    if request.headers.get("X-Seed-Token") != DEV_SEED_TOKEN:
+        return json_error("unauthorized", 401)
+    invalidate_reference_caches()
+    reload_ledger_partitions()
+    return ok()
+
+@bp.get("/api/partitions")
+def api_partitions():
+    """Closed and archived months of transfers/pays; later months are open."""
+    with read_db() as s:
+        rows = s.execute(select(LedgerPartition).order_by(LedgerPartition.period)).scalars().all()
+    return ok([{"period": r.period, "state": r.state, "transfers": r.transfers, "pays": r.pays,
+                "closedAt": r.closed_at.isoformat() if r.closed_at else None,
+                "archivedAt": r.archived_at.isoformat() if r.archived_at else None,
+                "archiveFile": r.archive_file} for r in rows])
+
+@bp.get("/api/ingest/stats")
+def api_ingest_stats():
+    if not INGEST_MODE:
+        return json_error("ingestion mode is off", 404)
+    return ok(get_ingest_writer().stats())
+
+# -------------------- instrumentation (opt-in) --------------------
+def cache_metrics():
+    lines = []
+    for field, kind in (("hits", "counter"), ("misses", "counter"), ("size", "gauge")):
+        lines.append(f"# TYPE reference_cache_{field} {kind}")
+        for c in REFERENCE_CACHES:
+            lines.append(f'reference_cache_{field}{{cache="{c.name}"}} {c.stats()[field]}')
+    return lines
+
+def ingest_metrics():
+    if ingest_writer is None:
+        return []
+    st = ingest_writer.stats()
+    return [
+        "# TYPE ingest_queue_depth gauge", f"ingest_queue_depth {st['queueDepth']}",
+        "# TYPE ingest_apply_lag_seconds gauge", f"ingest_apply_lag_seconds {st['applyLagSeconds']}",
+        "# TYPE ingest_accepted_total counter", f"ingest_accepted_total {st['accepted']}",
+        "# TYPE ingest_applied_total counter", f"ingest_applied_total {st['applied']}",
+        "# TYPE ingest_duplicates_total counter", f"ingest_duplicates_total {st['duplicates']}",
+        "# TYPE ingest_group_commits_total counter", f"ingest_group_commits_total {st['groupCommits']}",
+        "# TYPE ingest_failures_total counter", f"ingest_failures_total {st['failures']}",
+    ]
+
+instrumentation = None
+
+def watch_engines(inst: Instrumentation, writer, reader):
+    inst.watch_engine(writer)
+    if reader is not writer:
+        inst.watch_engine(reader)
+
+def install_instrumentation(app: Flask):
+    global instrumentation
+    instrumentation = Instrumentation(
+        app,
+        n_plus_one_threshold=int(os.getenv("N_PLUS_ONE_THRESHOLD", "10")),
+        slow_ms=float(os.environ["PROFILE_SLOW_MS"]) if os.getenv("PROFILE_SLOW_MS") else None,
+        profile_dir=os.getenv("PROFILE_DIR", "./records/profiles"),
+    )
+    with _init_lock:
+        if engine is not None:
+            watch_engines(instrumentation, engine, read_engine)
+    instrumentation.add_collector(cache_metrics)
+    if INGEST_MODE:
+        instrumentation.add_collector(ingest_metrics)
+
+# -------------------- maintenance commands --------------------
+@bp.cli.command("db-upgrade")
+@click.option("--target", type=int, default=None, help="Stop at this migration version.")
+def cli_db_upgrade(target):
+    """Apply pending schema migrations."""
+    applied = upgrade_schema(target=target)
+    for version, name in applied:
+        click.echo(f"applied {version:04d} {name}")
+    click.echo(f"{len(applied)} migration(s) applied")
+
+@bp.cli.command("db-status")
+def cli_db_status():
+    """List migrations and whether they are applied."""
+    for m in migrations.status(get_read_engine()):
+        click.echo(f"{m['version']:04d} {m['name']:<40} {m['applied_at'] or 'pending'}")
+
+@bp.cli.command("storage-status")
+def cli_storage_status():
+    """Print the SQLite profile and the pragmas in effect on the writer and reader connections."""
+    init_engines()
+    report = storage.report(engine, read_engine, SQLITE_PROFILE, SQLITE_PRAGMA_VALUES)
+    click.echo(json.dumps(report, indent=2))
+    if report.get("mismatches"):
+        raise SystemExit(1)
+
+@bp.cli.command("explain-check")
+@click.option("--verbose", is_flag=True, help="Print every plan, not only failures.")
+def cli_explain_check(verbose):
+    """Fail if any registered hot query does a full table scan."""
+    report = migrations.check_query_plans(get_read_engine(), Base.metadata, HOT_QUERIES)
+    failed = [name for name, r in report.items() if r["full_scans"]]
+    for name, r in report.items():
+        if verbose or r["full_scans"]:
+            click.echo(f"{'FAIL' if r['full_scans'] else 'ok  '} {name}")
+            for line in r["plan"]:
+                click.echo(f"       {line}")
+    click.echo(f"{len(report) - len(failed)}/{len(report)} hot queries index-served")
+    if failed:
+        raise SystemExit(1)
+
+@bp.cli.command("rebuild-balances")
+@click.option("--dry-run", is_flag=True, help="Only report drift, do not rewrite the ledger.")
+def cli_rebuild_balances(dry_run):
+    """Recompute account_balances from the raw transfers/pays rows and report drift."""
+    with db() as s:
+        drift = rebuild_balances(s, dry_run=dry_run)
+    for d in drift:
+        click.echo(f"{d['accountNo']}: stored={d['stored']:.2f} expected={d['expected']:.2f} diff={d['diff']:+.2f}")
+    click.echo(f"{len(drift)} account(s) drifted" + (" (dry run)" if dry_run else ", ledger rebuilt"))
+
+@bp.cli.command("close-partitions")
+@click.option("--through", default=None, help="Last month to close, YYYY-MM (default: the previous month).")
+def cli_close_partitions(through):
+    """Store per-account closing balances for every ended month not closed yet."""
+    through = through or partitions.period_of(datetime.now(timezone.utc).replace(day=1) - timedelta(days=1))
+    try:
+        with get_engine().begin() as conn:
+            closed = partitions.close_partitions(conn, Base.metadata, through)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    click.echo(f"closed {len(closed)} month(s)" + (f": {closed[0]} .. {closed[-1]}" if closed else ""))
+
+@bp.cli.command("archive-partitions")
+@click.option("--through", required=True, help="Archive closed months up to this one, YYYY-MM.")
+@click.option("--vacuum", is_flag=True, help="VACUUM the live database afterwards to return the freed space.")
+def cli_archive_partitions(through, vacuum):
+    """Move closed months into read-only ledger-YYYY.db files under ARCHIVE_DIR."""
+    init_engines()
+    archived = partitions.archive_partitions(engine, read_engine, Base.metadata, through, ARCHIVE_DIR, vacuum_live=vacuum)
+    reload_ledger_partitions()
+    click.echo(f"archived {len(archived)} month(s) to {ARCHIVE_DIR}" + (f": {archived[0]} .. {archived[-1]}" if archived else ""))
+    if archived:
+        click.echo("running API processes pick them up after POST /api/cache/invalidate or a restart")
+
+@bp.cli.command("export-transactions")
+@click.option("--kind", type=click.Choice(EXPORT_KINDS), default="all", show_default=True)
+@click.option("--format", "fmt", type=click.Choice(EXPORT_FORMATS), default="ndjson", show_default=True)
+@click.option("--from", "since", default=None, help="created_at >= this ISO time.")
+@click.option("--to", "until", default=None, help="created_at < this ISO time.")
+@click.option("--account", default=None, help="Account number (either side of a transfer).")
+@click.option("--merchant", default=None, help="Merchant id (pays only).")
+@click.option("--out", type=click.Path(dir_okay=False), default="-", help="Output file (default stdout).")
+def cli_export_transactions(kind, fmt, since, until, account, merchant, out):
+    """Stream transactions as NDJSON or seed-format CSV (same as GET /api/export/transactions)."""
+    kind, fmt, filters, err = export_args({"kind": kind, "format": fmt, "from": since, "to": until,
+                                           "account": account, "merchant": merchant})
+    if err:
+        raise click.UsageError(err)
+    with click.open_file(out, "w", encoding="utf-8") as f:
+        for line in export_lines(export_stmt(kind, **filters), kind, fmt):
+            f.write(line)
+
+@bp.cli.command("statements")
+@click.option("--period", "periods", multiple=True, required=True, help="Statement month, YYYY-MM (repeatable).")
+@click.option("--out", type=click.Path(dir_okay=False), default=None, help="Write the statements as CSV.")
+@click.option("--verify", is_flag=True, help="Cross-check against a row-by-row sum and print timings.")
+def cli_statements(periods, out, verify):
+    """Month-end statements (opening, incoming, outgoing, paid, closing) for every account."""
+    cols = ("opening", "incoming", "outgoing", "paid", "closing")
+    mismatched = 0
+    with get_read_engine().connect() as conn:
+        started = time.perf_counter()
+        ledger_columns.refresh(conn)
+        click.echo(f"loaded {len(ledger_columns.transfers)} transfers, {len(ledger_columns.pays)} pays "
+                   f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+        accts = {r.id: r for r in conn.execute(select(Account.id, Account.account_no, Account.currency))}
+        f = open(out, "w", newline="", encoding="utf-8") if out else None
+        w = csv.writer(f) if f else None
+        if w:
+            w.writerow(["account_no", "currency", "period", *cols])
+        for period in periods:
+            stmts = aggregates.month_statements(ledger_columns, period)
+            totals: Dict[str, int] = {}
+            for acct_id, closing in zip(stmts["account_id"], stmts["closing"]):
+                currency = accts[int(acct_id)].currency
+                totals[currency] = totals.get(currency, 0) + int(closing)
+            # one total per currency: minor units of different currencies do not add up
+            closing_totals = ", ".join(f"{format_minor(v, c)} {c}" for c, v in sorted(totals.items(), key=lambda kv: kv[0] or ""))
+            click.echo(f"{period}: {len(stmts['account_id'])} account(s), closing total {closing_totals or '0'}")
+            if w:
+                for i, acct_id in enumerate(stmts["account_id"]):
+                    a = accts[int(acct_id)]
+                    w.writerow([a.account_no, a.currency, period, *(format_minor(stmts[c][i], a.currency) for c in cols)])
+            if verify:
+                r = aggregates.verify_statements(conn, ledger_columns, period)
+                mismatched += len(r["mismatched"])
+                click.echo(f"  numpy {r['numpy_seconds'] * 1000:.1f} ms, row-by-row {r['rowwise_seconds'] * 1000:.1f} ms "
+                           f"({r['rowwise_seconds'] / max(r['numpy_seconds'], 1e-9):.0f}x), {len(r['mismatched'])} mismatched")
+        if f:
+            f.close()
+            click.echo(f"wrote {out}")
+    if mismatched:
+        raise SystemExit(1)
+
+# -------------------- app factory --------------------
+# statements skipped at warmup: a full-range export reads whole months
+WARMUP_SKIP = ("export_",)
+startup_timings: Dict[str, float] = {}
+
+def elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 1)
+
+def warm_up(app: Flask) -> Dict[str, float]:
+    """Worker boot: connect, start ingestion, fill the reference caches and run the hot statements once.
+
+    Every read connection of the pool is opened and runs each HOT_QUERIES statement, which fills SQLAlchemy's
+    compiled-statement cache and the connection's own prepared-statement cache, so the first requests a new
+    worker serves skip connection setup, SQL compilation and cold caches.
+    """
+    timings: Dict[str, float] = {}
+    started = time.perf_counter()
+    init_engines()
+    timings["engines_ms"] = elapsed_ms(started)
+
+    report = storage.report(engine, read_engine, SQLITE_PROFILE, SQLITE_PRAGMA_VALUES)
+    for problem in report.get("mismatches", []):
+        app.logger.warning("storage profile %s: %s", SQLITE_PROFILE, problem)
+    app.logger.info("storage: %s", json.dumps(report))
+    pending = [m for m in migrations.status(read_engine) if m["applied_at"] is None]
+    if pending:
+        app.logger.warning("%d pending migration(s), from %04d %s; run `flask db-upgrade`",
+                           len(pending), pending[0]["version"], pending[0]["name"])
+    get_ingest_writer()
+
+    started = time.perf_counter()
+    with read_db() as s:
+        reference_lists.set("accounts", [account_row(r) for r in s.execute(accounts_stmt()).all()])
+        reference_lists.set(("merchants", "", None), [merchant_row(r) for r in s.execute(merchant_search_stmts("")[0]).all()])
+        for cache, key_col, id_col in ((account_ids, Account.account_no, Account.id), (merchant_ids, Merchant.merchant_id, Merchant.id),
+                                       (customer_ids, Customer.customer_id, Customer.id)):
+            cache.set_many(dict(s.execute(select(key_col, id_col).limit(CACHE_MAX_ENTRIES)).all()))
+    timings["caches_ms"] = elapsed_ms(started)
+
+    started = time.perf_counter()
+    stmts = [make() for name, make in HOT_QUERIES.items() if not name.startswith(WARMUP_SKIP)]
+    conns = [read_engine.connect() for _ in range(SQLITE_READ_POOL_SIZE if read_engine is not engine else 1)]
+    try:
+        for conn in conns:
+            for stmt in stmts:
+                conn.execute(stmt).first()
+    finally:
+        for conn in conns:
+            conn.close()
+    if engine is not read_engine:
+        engine.connect().close()  # the write connection's pragmas
+    timings["statements_ms"] = elapsed_ms(started)
+
+    if WARMUP_LEDGER:
+        started = time.perf_counter()
+        graph_snapshot()  # ledger column snapshot + transfer graph
+        timings["ledger_ms"] = elapsed_ms(started)
+    startup_timings.update(timings)
+    app.logger.info("warmup: %s", json.dumps(timings))
+    return timings
+
+def create_app(warmup: bool = False) -> Flask:
+    """Application factory. Without warmup nothing touches the database until the first request needs it;
+    warmup=True (worker boot) connects and pre-warms before the app is returned.
+    """
+    started = time.perf_counter()
+    app = Flask(__name__)
+    CORS(app, expose_headers=["X-Next-Cursor"])
+    app.register_blueprint(bp)
+    if os.getenv("INSTRUMENTATION", "").lower() in ("1", "true", "yes"):
+        install_instrumentation(app)
+    startup_timings["create_app_ms"] = elapsed_ms(started)
+    if warmup:
+        warm_up(app)
+    return app
+
+# for `flask --app app ...` and WSGI servers pointed at app:app; gunicorn boots warm with 'app:create_app(warmup=True)'
+app = create_app()
+startup_timings["import_ms"] = elapsed_ms(IMPORT_STARTED)
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5050, debug=True)
+    create_app(warmup=True).run(host="0.0.0.0", port=5050, debug=True)
@@ -0,0 +1,138 @@
+# asgi.py
+# Production ASGI entry point: read endpoints run natively on an async SQLAlchemy engine so slow
+# balance/feed queries overlap on one worker; every other route is served by the Flask app.
+#
+#   uvicorn asgi:application --host 0.0.0.0 --port 5050 --workers 4
+import os
+from contextlib import asynccontextmanager
+from typing import Dict
+
+from a2wsgi import WSGIMiddleware
+from sqlalchemy import func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import app as wsgi
+import storage
+
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg", "mysql": "mysql+aiomysql"}
+
+def async_database_url(url: str) -> str:
+    """Swap the sync driver for its asyncio counterpart unless ASYNC_DATABASE_URL says otherwise."""
+    u = make_url(url)
+    backend = u.get_backend_name()
+    if backend in ASYNC_DRIVERS and u.drivername in (backend, f"{backend}+pysqlite", f"{backend}+psycopg2", f"{backend}+pymysql"):
+        u = u.set(drivername=ASYNC_DRIVERS[backend])
+    return u.render_as_string(hide_password=False)
+
+async_engine = create_async_engine(
+    os.getenv("ASYNC_DATABASE_URL") or async_database_url(wsgi.DATABASE_URL),
+    # aiosqlite defaults to NullPool (a new connection per checkout); keep a bounded, reused pool instead
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=int(os.getenv("ASYNC_POOL_SIZE", "10")),
+    max_overflow=int(os.getenv("ASYNC_POOL_OVERFLOW", "10")),
+    pool_timeout=float(os.getenv("ASYNC_POOL_TIMEOUT", "30")),
+    pool_pre_ping=True,
+)
+ASYNC_PRAGMAS = storage.profile_pragmas(wsgi.DATABASE_URL, wsgi.SQLITE_PROFILE, wsgi.SQLITE_PRAGMAS)
+if ASYNC_PRAGMAS and async_engine.dialect.name == "sqlite":
+    # same profile as the WSGI read pool: these routes only read
+    storage.install_pragmas(async_engine.sync_engine, dict(ASYNC_PRAGMAS, query_only=1))
+wsgi.ledger.install(async_engine.sync_engine)  # the feed reads archived months too
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, class_=AsyncSession)
+
+def json_error(msg: str, code: int = 400):
+    return JSONResponse({"error": msg}, status_code=code)
+
+async def resolve_ids(s, cache, key_col, id_col, keys) -> Dict[str, int]:
+    # same contract as app.resolve_ids, sharing its caches within the process
+    found, missing = cache.get_many(keys)
+    if missing:
+        loaded = dict((await s.execute(select(key_col, id_col).where(key_col.in_(missing)))).all())
+        cache.set_many(loaded)
+        found.update(loaded)
+    return found
+
+# -------------------- endpoints --------------------
+async def api_health(request):
+    try:
+        async with AsyncSessionLocal() as s:
+            await s.execute(select(func.count(wsgi.Account.id)))
+        return JSONResponse({"ok": True})
+    except Exception as e:
+        return json_error(f"backend not ready: {e}", 500)
+
+async def api_accounts(request):
+    rows = wsgi.reference_lists.get("accounts")
+    if rows is None:
+        async with AsyncSessionLocal() as s:
+            rows = [wsgi.account_row(r) for r in (await s.execute(wsgi.accounts_stmt())).all()]
+        wsgi.reference_lists.set("accounts", rows)
+    return JSONResponse(rows)
+
+async def api_balance(request):
+    acct = request.path_params["acct"]
+    async with AsyncSessionLocal() as s:
+        acct_id = (await resolve_ids(s, wsgi.account_ids, wsgi.Account.account_no, wsgi.Account.id, {acct})).get(acct)
+        r = (await s.execute(wsgi.balance_stmt(acct_id))).first() if acct_id else None
+    return JSONResponse(wsgi.balance_body(acct, r))
+
+async def api_customer_tx(request):
+    cid = request.path_params["cid"]
+    limit, cursor, err = wsgi.parse_feed_args(request.query_params)
+    if err:
+        return json_error(err, 400)
+    async with AsyncSessionLocal() as s:
+        customer_pk = (await resolve_ids(s, wsgi.customer_ids, wsgi.Customer.customer_id, wsgi.Customer.id, {cid})).get(cid)
+        if not customer_pk:
+            return JSONResponse([])
+        rows = (await s.execute(wsgi.customer_feed_stmt(customer_pk, limit, cursor))).all()
+    resp = JSONResponse([wsgi.feed_row(r) for r in rows])
+    if len(rows) == limit:
+        resp.headers["X-Next-Cursor"] = wsgi.encode_cursor(rows[-1].created_at, rows[-1].tx_id)
+    return resp
+
+async def api_merchants(request):
+    q, mcc = (request.query_params.get("q") or "").strip(), (request.query_params.get("mcc") or "").strip() or None
+    rows = wsgi.reference_lists.get(("merchants", q, mcc))
+    if rows is None:
+        async with AsyncSessionLocal() as s:
+            for stmt in wsgi.merchant_search_stmts(q, mcc):
+                found = (await s.execute(stmt)).all()
+                if found:
+                    break
+        rows = [wsgi.merchant_row(r) for r in found]
+        wsgi.reference_lists.set(("merchants", q, mcc), rows)
+    return JSONResponse(rows)
+
+@asynccontextmanager
+async def lifespan(application):
+    # worker boot: engines, archive routing and caches are ready before the first request
+    wsgi.warm_up(wsgi.app)
+    async with AsyncSessionLocal() as s:
+        for stmt in (wsgi.accounts_stmt(), wsgi.balance_stmt(1), wsgi.customer_feed_stmt(1, wsgi.FEED_DEFAULT_LIMIT)):
+            (await s.execute(stmt)).first()
+    yield
+    await async_engine.dispose()
+
+routes = [
+    Route("/api/health", api_health, methods=["GET"]),
+    Route("/api/accounts", api_accounts, methods=["GET"]),
+    Route("/api/account/{acct}/balance", api_balance, methods=["GET"]),
+    Route("/api/customer/{cid}/transactions", api_customer_tx, methods=["GET"]),
+    Route("/api/merchants", api_merchants, methods=["GET"]),
+    # writes, batch endpoints, seed/cache admin, metrics: unchanged Flask handlers on a thread pool
+    Mount("/", app=WSGIMiddleware(wsgi.app, workers=int(os.getenv("WSGI_THREADS", "10")))),
+]
+
+application = Starlette(
+    routes=routes,
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], expose_headers=["X-Next-Cursor"])],
+    lifespan=lifespan,
+)
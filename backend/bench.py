@@ -0,0 +1,401 @@
+# bench.py
+# Synthetic data generator and mixed-workload benchmark for the Flask API.
+#
+#   python bench.py gen --transactions 100000 --out /tmp/bench_seeds
+#   python bench.py run --transactions 100000 --requests 5000 --out results.json
+#   python bench.py compare baseline.json results.json
+#   python bench.py startup --db sqlite:////tmp/bench.db --runs 10 --out startup.json
+import argparse, base64, csv, importlib, json, os, platform, random, subprocess, sys, tempfile, threading, time
+import urllib.error, urllib.request
+from datetime import datetime, timedelta, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# -------------------- dataset --------------------
+def generate(out_dir, transactions, accounts=None, customers=None, merchants=None, seed=42):
+    """Write customers/accounts/merchants/owns/transfers/pays.csv in the bank_seeds/ layout; rows are streamed."""
+    rnd = random.Random(seed)
+    accounts = accounts or max(100, transactions // 100)
+    customers = customers or accounts
+    merchants = merchants or max(20, accounts // 50)
+    os.makedirs(out_dir, exist_ok=True)
+
+    def writer(name, header):
+        f = open(os.path.join(out_dir, name), "w", newline="", encoding="utf-8")
+        w = csv.writer(f)
+        w.writerow(header)
+        return f, w
+
+    acct_no = [f"A-{i:07d}" for i in range(accounts)]
+    merch_id = [f"M-{i:06d}" for i in range(merchants)]
+
+    f, w = writer("customers.csv", ["customer_id", "name"])
+    for i in range(customers):
+        w.writerow([f"C{i:07d}", f"UserC{i:07d}"])
+    f.close()
+
+    f, w = writer("accounts.csv", ["account_no", "type", "currency", "status"])
+    for i, a in enumerate(acct_no):
+        w.writerow([a, "checking" if i % 2 == 0 else "savings", "USD", "active"])
+    f.close()
+
+    f, w = writer("merchants.csv", ["merchant_id", "name", "mcc"])
+    mccs = ["5411", "5814", "5732", "5812", "4111", "5541"]
+    for i, m in enumerate(merch_id):
+        w.writerow([m, f"Merchant {i:06d}", mccs[i % len(mccs)]])
+    f.close()
+
+    start = datetime(2025, 1, 1)
+    f, w = writer("owns.csv", ["customer_id", "account_no", "since"])
+    for i, a in enumerate(acct_no):
+        w.writerow([f"C{i % customers:07d}", a, (start + timedelta(hours=i)).isoformat()])
+    f.close()
+
+    n_transfers = transactions // 2
+    n_pays = transactions - n_transfers
+    span = 365 * 24 * 3600
+    ft, wt = writer("transfers.csv", ["from_account_no", "to_account_no", "tx_id", "amount", "currency", "channel", "created_at"])
+    fp, wp = writer("pays.csv", ["from_account_no", "merchant_id", "tx_id", "amount", "currency", "channel", "created_at"])
+    channels = ["api", "mobile", "branch", "pos", "web"]
+    for i in range(n_transfers):
+        src, dst = rnd.randrange(accounts), rnd.randrange(accounts)
+        ts = start + timedelta(seconds=span * i // max(1, n_transfers))
+        wt.writerow([acct_no[src], acct_no[dst], f"TR-{i:010d}", f"{rnd.uniform(1, 1000):.2f}", "USD", rnd.choice(channels), ts.isoformat()])
+    for i in range(n_pays):
+        ts = start + timedelta(seconds=span * i // max(1, n_pays))
+        wp.writerow([acct_no[rnd.randrange(accounts)], merch_id[rnd.randrange(merchants)], f"PY-{i:010d}",
+                     f"{rnd.uniform(1, 300):.2f}", "USD", rnd.choice(channels), ts.isoformat()])
+    ft.close(); fp.close()
+    return {"transactions": transactions, "accounts": accounts, "customers": customers, "merchants": merchants}
+
+def read_keys(data_dir, name, column, limit=100000):
+    with open(os.path.join(data_dir, name), newline="", encoding="utf-8") as f:
+        return [row[column] for _, row in zip(range(limit), csv.DictReader(f))]
+
+# -------------------- clients --------------------
+class TestClient:
+    """In-process Flask test client; DATABASE_URL must be set before the app is imported."""
+
+    def __init__(self, database_url):
+        os.environ["DATABASE_URL"] = database_url
+        sys.path.insert(0, HERE)
+        module = importlib.import_module("app")
+        self.app = module.create_app(warmup=True)
+        self.local = threading.local()
+
+    def request(self, method, path, body=None):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        resp = client.open(path, method=method, json=body)
+        resp.get_data()  # drain streamed bodies (export, balances?all=1), as HttpClient does
+        return resp.status_code
+
+class HttpClient:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+
+    def request(self, method, path, body=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=30) as resp:
+                resp.read()
+                return resp.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+# -------------------- workload --------------------
+DEFAULT_MIX = {
+    "balance": 30, "balances": 3, "feed": 15, "feed_page": 5, "merchants": 10, "accounts": 5, "health": 2,
+    "transfer": 12, "pay": 12, "transfers_batch": 2, "pays_batch": 2,
+    "export": 2, "graph_fanout": 2, "graph_cycles": 1, "graph_counterparties": 2,
+}
+
+class Workload:
+    def __init__(self, data_dir, seed, batch_size=100):
+        self.rnd = random.Random(seed)
+        self.accounts = read_keys(data_dir, "accounts.csv", "account_no")
+        self.customers = read_keys(data_dir, "customers.csv", "customer_id")
+        self.merchants = read_keys(data_dir, "merchants.csv", "merchant_id")
+        self.batch_size = batch_size
+        self.run_id = f"{int(time.time())}-{seed}"
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def tx_id(self, prefix):
+        with self.lock:
+            self.counter += 1
+            return f"BENCH-{prefix}-{self.run_id}-{self.counter}"
+
+    def transfer(self):
+        return {"from": self.rnd.choice(self.accounts), "to": self.rnd.choice(self.accounts), "amount": round(self.rnd.uniform(1, 100), 2),
+                "currency": "USD", "channel": "bench", "txId": self.tx_id("TR")}
+
+    def pay(self):
+        return {"from": self.rnd.choice(self.accounts), "merchantId": self.rnd.choice(self.merchants), "amount": round(self.rnd.uniform(1, 100), 2),
+                "currency": "USD", "channel": "bench", "txId": self.tx_id("PY")}
+
+    def make(self, op):
+        r = self.rnd
+        if op == "balance": return "GET", f"/api/account/{r.choice(self.accounts)}/balance", None
+        if op == "balances": return "GET", "/api/balances?accounts=" + ",".join(r.sample(self.accounts, min(50, len(self.accounts)))), None
+        if op == "feed": return "GET", f"/api/customer/{r.choice(self.customers)}/transactions?limit=50", None
+        if op == "feed_page": return "GET", f"/api/customer/{r.choice(self.customers)}/transactions?limit=50&cursor=" + self.deep_cursor(), None
+        if op == "merchants": return "GET", f"/api/merchants?q={r.choice(self.merchants)[-3:]}", None
+        if op == "accounts": return "GET", "/api/accounts", None
+        if op == "health": return "GET", "/api/health", None
+        if op == "transfer": return "POST", "/api/transfer", self.transfer()
+        if op == "pay": return "POST", "/api/pay", self.pay()
+        if op == "transfers_batch": return "POST", "/api/transfers/batch", {"items": [self.transfer() for _ in range(self.batch_size)]}
+        if op == "pays_batch": return "POST", "/api/pays/batch", {"items": [self.pay() for _ in range(self.batch_size)]}
+        if op == "export": return "GET", f"/api/export/transactions?account={r.choice(self.accounts)}", None
+        if op == "graph_fanout": return "GET", f"/api/graph/account/{r.choice(self.accounts)}/fanout?hops=2", None
+        if op == "graph_cycles": return "GET", f"/api/graph/account/{r.choice(self.accounts)}/cycles?maxLen=4", None
+        if op == "graph_counterparties": return "GET", f"/api/graph/account/{r.choice(self.accounts)}/counterparties", None
+        raise ValueError(f"unknown op {op}")
+
+    def deep_cursor(self):
+        # a cursor somewhere in the dataset's year, so pages start deep in history
+        ts = datetime(2025, 1, 1) + timedelta(days=self.rnd.randrange(365))
+        return base64.urlsafe_b64encode(f"{ts.isoformat()}|~".encode()).decode()
+
+def percentile(sorted_vals, p):
+    if not sorted_vals:
+        return None
+    k = max(0, min(len(sorted_vals) - 1, int(round(p / 100.0 * len(sorted_vals) + 0.5)) - 1))
+    return sorted_vals[k]
+
+def summarize(latencies, errors, elapsed):
+    lat = sorted(latencies)
+    return {
+        "count": len(lat),
+        "errors": errors,
+        "throughput_rps": len(lat) / elapsed if elapsed else 0.0,
+        "mean_ms": sum(lat) / len(lat) * 1000 if lat else None,
+        "p50_ms": percentile(lat, 50) * 1000 if lat else None,
+        "p95_ms": percentile(lat, 95) * 1000 if lat else None,
+        "p99_ms": percentile(lat, 99) * 1000 if lat else None,
+        "max_ms": lat[-1] * 1000 if lat else None,
+    }
+
+def run_workload(client, workload, mix, requests, concurrency, warmup):
+    ops = [op for op, w in mix.items() for _ in range(w)]
+    schedule = [workload.rnd.choice(ops) for _ in range(requests + warmup)]
+    results = {op: ([], [0]) for op in mix}
+    lock = threading.Lock()
+    cursor = [0]
+
+    def worker():
+        while True:
+            with lock:
+                i = cursor[0]; cursor[0] += 1
+                if i >= len(schedule):
+                    return
+                op = schedule[i]
+                method, path, body = workload.make(op)
+            t0 = time.perf_counter()
+            try:
+                status = client.request(method, path, body)
+            except Exception:
+                status = 599
+            dt = time.perf_counter() - t0
+            if i < warmup:
+                continue
+            with lock:
+                results[op][0].append(dt)
+                if status >= 400: results[op][1][0] += 1
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - t0
+
+    report = {op: summarize(lat, err[0], elapsed) for op, (lat, err) in results.items() if lat}
+    all_lat = [x for lat, _ in results.values() for x in lat]
+    report["_all"] = summarize(all_lat, sum(err[0] for _, err in results.values()), elapsed)
+    return report, elapsed
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=HERE, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_mix(text):
+    if not text:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in text.split(","):
+        op, _, weight = part.partition("=")
+        mix[op.strip()] = int(weight or 1)
+    return mix
+
+# -------------------- commands --------------------
+def cmd_gen(args):
+    meta = generate(args.out, args.transactions, args.accounts, args.customers, args.merchants, args.seed)
+    print(json.dumps(meta))
+
+def cmd_run(args):
+    tmp = tempfile.mkdtemp(prefix="bench_")
+    data_dir = args.data
+    if not data_dir:
+        data_dir = os.path.join(tmp, "seeds")
+        t0 = time.perf_counter()
+        generate(data_dir, args.transactions, seed=args.seed)
+        print(f"generated {args.transactions} transactions in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+
+    if args.url:
+        client = HttpClient(args.url)
+        load_seconds = None
+    else:
+        db_url = args.db or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        t0 = time.perf_counter()
+        subprocess.check_call([sys.executable, os.path.join(HERE, "load_csv_into_ultipa.py"), "--db", db_url, "--dir", data_dir, "--bulk"],
+                              stdout=subprocess.DEVNULL)
+        load_seconds = time.perf_counter() - t0
+        print(f"loaded in {load_seconds:.1f}s", file=sys.stderr)
+        client = TestClient(db_url)
+
+    workload = Workload(data_dir, args.seed, args.batch_items)
+    report, elapsed = run_workload(client, workload, parse_mix(args.mix), args.requests, args.concurrency, args.warmup)
+    out = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "transactions": args.transactions if not args.data else None,
+            "data": data_dir,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "target": args.url or "test-client",
+            "load_seconds": load_seconds,
+            "elapsed_seconds": elapsed,
+        },
+        "endpoints": report,
+    }
+    text = json.dumps(out, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+# one cold start in a fresh interpreter: import, factory (+ warmup), first request
+STARTUP_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, {here!r})
+import app
+t1 = time.perf_counter()
+application = app.create_app(warmup={warmup})
+t2 = time.perf_counter()
+status = application.test_client().get({path!r}).status_code
+t3 = time.perf_counter()
+print(json.dumps({{"import": t1 - t0, "create_app": t2 - t1, "first_request": t3 - t2, "status": status,
+                  "phases": app.startup_timings}}))
+"""
+
+def cmd_startup(args):
+    env = dict(os.environ, DATABASE_URL=args.db)
+    probe = STARTUP_PROBE.format(here=HERE, warmup=not args.no_warmup, path=args.path)
+    samples = {"process": [], "import": [], "create_app": [], "first_request": [], "ready": []}
+    errors, phases = 0, []
+    for _ in range(args.runs):
+        t0 = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", probe], env=env, cwd=HERE, capture_output=True, text=True)
+        wall = time.perf_counter() - t0
+        if out.returncode != 0:
+            print(out.stderr, file=sys.stderr)
+            raise SystemExit(out.returncode)
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        errors += r["status"] >= 400
+        samples["process"].append(wall)
+        for k in ("import", "create_app", "first_request"):
+            samples[k].append(r[k])
+        samples["ready"].append(r["import"] + r["create_app"])  # import to serving, without interpreter start
+        phases.append(r["phases"])
+    out = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "db": args.db,
+            "runs": args.runs,
+            "warmup": not args.no_warmup,
+            "first_request": args.path,
+            "phases_ms": {k: sorted(p.get(k, 0) for p in phases)[len(phases) // 2] for k in phases[0]},
+        },
+        # per-phase seconds summarized like endpoint latencies, so `compare` works on startup reports too
+        "endpoints": {k: summarize(v, errors if k == "first_request" else 0, sum(v)) for k, v in samples.items()},
+    }
+    text = json.dumps(out, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+def cmd_compare(args):
+    with open(args.baseline, encoding="utf-8") as f: base = json.load(f)["endpoints"]
+    with open(args.current, encoding="utf-8") as f: cur = json.load(f)["endpoints"]
+    regressions = 0
+    print(f"{'endpoint':<18}{'metric':<8}{'baseline':>12}{'current':>12}{'change':>10}")
+    for op in sorted(set(base) & set(cur)):
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            b, c = base[op].get(metric), cur[op].get(metric)
+            if not b or c is None:
+                continue
+            change = (c - b) / b
+            flag = " !" if change > args.threshold else ""
+            regressions += bool(flag)
+            print(f"{op:<18}{metric:<8}{b:>12.2f}{c:>12.2f}{change:>+9.0%}{flag}")
+    print(f"{regressions} regression(s) above {args.threshold:.0%}")
+    if regressions:
+        raise SystemExit(1)
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    g = sub.add_parser("gen", help="generate a synthetic dataset shaped like bank_seeds/")
+    g.add_argument("--transactions", type=int, default=10000)
+    g.add_argument("--accounts", type=int)
+    g.add_argument("--customers", type=int)
+    g.add_argument("--merchants", type=int)
+    g.add_argument("--seed", type=int, default=42)
+    g.add_argument("--out", required=True)
+    g.set_defaults(fn=cmd_gen)
+
+    r = sub.add_parser("run", help="load a dataset and run a mixed workload")
+    r.add_argument("--transactions", type=int, default=10000, help="dataset size when --data is not given")
+    r.add_argument("--data", help="existing dataset directory (skips generation)")
+    r.add_argument("--db", help="database URL to load into (default: fresh sqlite file in a temp dir)")
+    r.add_argument("--url", help="benchmark a running server instead of the in-process test client")
+    r.add_argument("--requests", type=int, default=2000)
+    r.add_argument("--warmup", type=int, default=100)
+    r.add_argument("--concurrency", type=int, default=1)
+    r.add_argument("--mix", help="op=weight,... (default: %s)" % ",".join(f"{k}={v}" for k, v in DEFAULT_MIX.items()))
+    r.add_argument("--batch-items", type=int, default=100, help="items per batch request")
+    r.add_argument("--seed", type=int, default=42)
+    r.add_argument("--out", help="write the JSON report here")
+    r.set_defaults(fn=cmd_run)
+
+    st = sub.add_parser("startup", help="measure cold start (import, app factory, warmup, first request) in fresh processes")
+    st.add_argument("--db", required=True, help="database URL of an upgraded database (`flask db-upgrade`)")
+    st.add_argument("--runs", type=int, default=10)
+    st.add_argument("--no-warmup", action="store_true", help="build the app lazily; the first request pays the connect")
+    st.add_argument("--path", default="/api/accounts", help="first request to time")
+    st.add_argument("--out", help="write the JSON report here")
+    st.set_defaults(fn=cmd_startup)
+
+    c = sub.add_parser("compare", help="compare two JSON reports; exit 1 on regressions")
+    c.add_argument("baseline")
+    c.add_argument("current")
+    c.add_argument("--threshold", type=float, default=0.2, help="relative latency increase counted as a regression")
+    c.set_defaults(fn=cmd_compare)
+
+    args = ap.parse_args()
+    args.fn(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+# graph.py
+# In-memory account graph in CSR form, built from the ledger snapshot (aggregates.LedgerColumns): k-hop fan-out,
+# round-trip (cycle) search and top counterparties without recursive SQL.
+#
+# Transfers are account -> account edges and pays are account -> merchant edges. All transfers between one
+# pair of accounts are folded into a single edge that keeps their count, total and last time. Rows that arrive
+# after the base was built go into a small delta graph, which is rebuilt on each refresh. Once the delta passes
+# a fraction of the base, it is folded into the base.
+import threading
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from aggregates import group_sum
+
+NO_TIME = np.iinfo(np.int64).min
+
+class CSR:
+    """Compressed adjacency: the edges leaving node u are positions ptr[u]:ptr[u+1], sorted by destination."""
+
+    def __init__(self, src: np.ndarray, dst: np.ndarray, amount: np.ndarray, when: np.ndarray, n_src: int, n_dst: int):
+        # one key per (src, dst) pair; sorted keys are CSR order
+        keys, inv = np.unique(src * n_dst + dst, return_inverse=True)
+        self.n_src = n_src
+        self.dst = keys % n_dst
+        self.amount = group_sum(inv, amount, len(keys))
+        self.count = np.bincount(inv, minlength=len(keys))
+        self.last = np.full(len(keys), NO_TIME, dtype=np.int64)
+        np.maximum.at(self.last, inv, when)
+        self.ptr = np.zeros(n_src + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys // n_dst, minlength=n_src), out=self.ptr[1:])
+
+    def __len__(self):
+        return len(self.dst)
+
+    def gather(self, nodes: np.ndarray):
+        """(source node, edge position) for every edge leaving nodes, without a Python loop."""
+        nodes = nodes[nodes < self.n_src]
+        starts = self.ptr[nodes]
+        lens = self.ptr[nodes + 1] - starts
+        offsets = np.arange(int(lens.sum())) - np.repeat(np.cumsum(lens) - lens, lens)
+        return np.repeat(nodes, lens), np.repeat(starts, lens) + offsets
+
+class Layer:
+    """out / in (transposed) transfer adjacency and account -> merchant pay adjacency over one set of rows."""
+
+    def __init__(self, transfers: np.ndarray, pays: np.ndarray, n_accounts: int, n_merchants: int):
+        src, dst, amount, when = transfers[:, 0], transfers[:, 1], transfers[:, 2], transfers[:, 3]
+        self.rows = (len(transfers), len(pays))
+        self.out = CSR(src, dst, amount, when, n_accounts, n_accounts)
+        self.inc = CSR(dst, src, amount, when, n_accounts, n_accounts)
+        self.pay = CSR(pays[:, 0], pays[:, 3], pays[:, 1], pays[:, 2], n_accounts, n_merchants)
+
+class GraphSnapshot:
+    """Immutable set of layers; queries run against one snapshot while a refresh builds the next."""
+
+    def __init__(self, layers: List[Layer], n_accounts: int, n_merchants: int):
+        self.layers, self.n_accounts, self.n_merchants = layers, n_accounts, n_merchants
+
+    def edges(self, kind: str, nodes: np.ndarray, min_amount: int = 0, since_us: int = NO_TIME):
+        """(node, neighbour, amount, count, last_us) of the kind="out"|"inc"|"pay" edges of nodes, across layers.
+
+        An edge present in both layers comes back twice; min_amount/since apply to each layer's part of it.
+        """
+        parts = []
+        for layer in self.layers:
+            g = getattr(layer, kind)
+            src, pos = g.gather(nodes)
+            keep = (g.amount[pos] >= min_amount) & (g.last[pos] >= since_us)
+            pos = pos[keep]
+            parts.append((src[keep], g.dst[pos], g.amount[pos], g.count[pos], g.last[pos]))
+        return tuple(np.concatenate(cols) for cols in zip(*parts))
+
+    def fanout(self, start: int, hops: int, direction: str = "out", min_amount: int = 0, since_us: int = NO_TIME,
+               limit: int = 100) -> Dict[str, Any]:
+        """Accounts reachable from start within `hops` transfers (direction "in" follows money backwards)."""
+        kind = "out" if direction == "out" else "inc"
+        if not 0 <= start < self.n_accounts:  # created after this snapshot: no edges yet
+            return {"hops": [], "reached": 0, "accounts": []}
+        visited = np.zeros(self.n_accounts, dtype=bool)
+        visited[start] = True
+        frontier = np.array([start], dtype=np.int64)
+        per_hop, reached = [], []
+        for hop in range(1, hops + 1):
+            _, nbr, amount, _, _ = self.edges(kind, frontier, min_amount, since_us)
+            nodes, inv = np.unique(nbr, return_inverse=True)
+            into = group_sum(inv, amount, len(nodes))  # money moved onto each neighbour this hop
+            fresh = ~visited[nodes]
+            nodes, into = nodes[fresh], into[fresh]
+            visited[nodes] = True
+            per_hop.append({"hop": hop, "accounts": int(len(nodes)), "edges": int(len(nbr)), "amount": int(amount.sum())})
+            order = np.argsort(-into, kind="stable")
+            reached.extend((int(n), hop, int(a)) for n, a in zip(nodes[order], into[order]))
+            if not len(nodes):
+                break
+            frontier = nodes
+        return {"hops": per_hop, "reached": len(reached), "accounts": reached[:limit]}
+
+    def cycles(self, start: int, max_len: int, min_amount: int = 0, since_us: int = NO_TIME, limit: int = 20,
+               max_steps: int = 20_000) -> Dict[str, Any]:
+        """Directed cycles start -> ... -> start of at most max_len transfers, heaviest edges explored first.
+
+        A reverse BFS first finds how many hops each account is from returning to start, so the search only
+        follows edges that can still close the cycle in the hops left. max_steps bounds the work on dense hubs.
+        """
+        if not 0 <= start < self.n_accounts:
+            return {"cycles": [], "complete": True, "steps": 0}
+        back = np.full(self.n_accounts, max_len + 1, dtype=np.int64)
+        back[start] = 0
+        frontier = np.array([start], dtype=np.int64)
+        for d in range(1, max_len):
+            _, prev, _, _, _ = self.edges("inc", frontier, min_amount, since_us)
+            prev = np.unique(prev)
+            prev = prev[back[prev] > d]
+            back[prev] = d
+            frontier = prev
+        found: List[Dict[str, Any]] = []
+        steps = 0
+        path, amounts, on_path = [start], [], {start}
+
+        def visit(u: int) -> bool:
+            nonlocal steps
+            remaining = max_len - len(amounts)
+            _, nbr, amount, _, _ = self.edges("out", np.array([u], dtype=np.int64), min_amount, since_us)
+            if len(nbr) > len(np.unique(nbr)):  # same pair in base and delta: fold before ranking
+                nbr, inv = np.unique(nbr, return_inverse=True)
+                amount = group_sum(inv, amount, len(nbr))
+            ok = back[nbr] <= remaining - 1
+            nbr, amount = nbr[ok], amount[ok]
+            for i in np.argsort(-amount, kind="stable"):
+                v, a = int(nbr[i]), int(amount[i])
+                steps += 1
+                if steps > max_steps or len(found) >= limit:
+                    return False
+                if v == start:
+                    found.append({"accounts": path + [start], "amounts": amounts + [a], "minAmount": min(amounts + [a])})
+                    continue
+                if v in on_path or remaining <= 1:
+                    continue
+                path.append(v); amounts.append(a); on_path.add(v)
+                go_on = visit(v)
+                path.pop(); amounts.pop(); on_path.discard(v)
+                if not go_on:
+                    return False
+            return True
+
+        complete = visit(start)
+        return {"cycles": found, "complete": complete and len(found) < limit, "steps": steps}
+
+    def counterparties(self, acct: int, limit: int = 10) -> Dict[str, Any]:
+        """Accounts this one sent to / received from, and merchants it paid, by total amount."""
+        node = np.array([acct], dtype=np.int64)
+        _, out_nbr, out_amt, out_cnt, out_last = self.edges("out", node)
+        _, in_nbr, in_amt, in_cnt, in_last = self.edges("inc", node)
+        ids, inv = np.unique(np.concatenate([out_nbr, in_nbr]), return_inverse=True)
+        n_out = len(out_nbr)
+        sent = group_sum(inv[:n_out], out_amt, len(ids))
+        received = group_sum(inv[n_out:], in_amt, len(ids))
+        count = group_sum(inv, np.concatenate([out_cnt, in_cnt]), len(ids))
+        last = np.full(len(ids), NO_TIME, dtype=np.int64)
+        np.maximum.at(last, inv, np.concatenate([out_last, in_last]))
+        top = np.argsort(-(sent + received), kind="stable")[:limit]
+        _, m_nbr, m_amt, m_cnt, m_last = self.edges("pay", node)
+        m_ids, m_inv = np.unique(m_nbr, return_inverse=True)
+        paid, m_count = group_sum(m_inv, m_amt, len(m_ids)), group_sum(m_inv, m_cnt, len(m_ids))
+        m_lastv = np.full(len(m_ids), NO_TIME, dtype=np.int64)
+        np.maximum.at(m_lastv, m_inv, m_last)
+        m_top = np.argsort(-paid, kind="stable")[:limit]
+        return {
+            "accounts": [(int(ids[i]), int(sent[i]), int(received[i]), int(count[i]), int(last[i])) for i in top],
+            "merchants": [(int(m_ids[i]), int(paid[i]), int(m_count[i]), int(m_lastv[i])) for i in m_top],
+        }
+
+class TransferGraph:
+    """Base + delta CSR layers over a LedgerColumns snapshot; refresh(cols) returns an up-to-date GraphSnapshot."""
+
+    def __init__(self, merge_fraction: float = 0.05, min_merge_rows: int = 50_000):
+        self.merge_fraction, self.min_merge_rows = merge_fraction, min_merge_rows
+        self._lock = threading.Lock()
+        self.generation = None
+        self.layers: List[Layer] = []
+        self.n_accounts = self.n_merchants = 0  # array capacity (ids + headroom), not node counts
+        self.accounts = 0  # accounts in the last refreshed ledger snapshot
+        self.snapshot = GraphSnapshot([], 0, 0)
+        self.base_rows = (0, 0)
+        self.rebuilds, self.build_seconds = 0, 0.0
+
+    def refresh(self, cols) -> GraphSnapshot:
+        t, p, ids, gen = cols.transfers, cols.pays, cols.account_ids, cols.generation
+        with self._lock:
+            self.accounts = int(ids.size)
+            seen = sum(layer.rows[0] for layer in self.layers), sum(layer.rows[1] for layer in self.layers)
+            # account ids are sorted; a new account past the arrays' headroom needs a rebuild even without new rows
+            if (self.layers and gen == self.generation and (len(t), len(p)) == seen
+                    and (not ids.size or ids[-1] < self.n_accounts)):
+                return self.snapshot
+            started = time.perf_counter()
+            n_acc = int(max(ids.max() if ids.size else 0, t[:, :2].max() if len(t) else 0, p[:, 0].max() if len(p) else 0)) + 1
+            n_merch = int(p[:, 3].max()) + 1 if len(p) else 1
+            pending = len(t) - self.base_rows[0] + len(p) - self.base_rows[1]
+            if (gen != self.generation or not self.layers or n_acc > self.n_accounts or n_merch > self.n_merchants
+                    or pending > max(self.min_merge_rows, self.merge_fraction * sum(self.base_rows))):
+                # node ids are sized with headroom so new accounts/merchants rarely force a full rebuild
+                self.n_accounts, self.n_merchants = n_acc + n_acc // 8 + 16, n_merch + n_merch // 8 + 16
+                self.layers = [Layer(t, p, self.n_accounts, self.n_merchants)]
+                self.base_rows, self.generation = (len(t), len(p)), gen
+                self.rebuilds += 1
+            else:
+                base = self.layers[0]
+                delta = Layer(t[self.base_rows[0]:], p[self.base_rows[1]:], self.n_accounts, self.n_merchants)
+                self.layers = [base, delta]
+            self.build_seconds = time.perf_counter() - started
+            self.snapshot = GraphSnapshot(self.layers, self.n_accounts, self.n_merchants)
+        return self.snapshot
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            layers, accounts = list(self.layers), self.accounts
+        paid = np.unique(np.concatenate([layer.pay.dst for layer in layers])) if layers else []
+        return {
+            "accounts": accounts, "merchants": len(paid),  # merchants: those with at least one pay
+            "accountCapacity": self.n_accounts, "merchantCapacity": self.n_merchants,
+            "transferEdges": [len(layer.out) for layer in layers], "payEdges": [len(layer.pay) for layer in layers],
+            "rows": [list(layer.rows) for layer in layers], "rebuilds": self.rebuilds,
+            "lastBuildSeconds": round(self.build_seconds, 4),
+        }
@@ -0,0 +1,210 @@
+# ingest.py
+# Durable append-only log + background group-commit writer for high-rate transfer/pay ingestion.
+#
+# A request is acknowledged once its record is fsynced to the log. One writer thread drains the log into
+# the database in groups (every group_ms or group_rows records) and stores the last applied seq in the same
+# transaction, so a restart replays exactly the records that never made it into the tables.
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; the single-writer guard is then best effort
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+class IngestLog:
+    """Newline-delimited JSON records {"seq", "kind", "at", "values"}; concurrent appends share one fsync."""
+
+    def __init__(self, path: str, fsync: bool = True):
+        self.path, self.fsync = path, fsync
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._f = open(path, "a+b")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                raise RuntimeError(f"ingest log {path} is in use by another process")
+        self._lock = threading.Lock()       # serializes writes and seq assignment
+        self._sync_lock = threading.Lock()  # one fsync at a time; it covers every write before it
+        self.last_seq = 0
+        self._written = self._synced = 0
+        for rec in self.read(0):
+            self.last_seq = rec["seq"]
+
+    def read(self, after_seq: int) -> List[Dict[str, Any]]:
+        """Records with seq > after_seq. A torn last line (crash mid-append) is cut off."""
+        records, good_bytes = [], 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                good_bytes += len(line)
+                if rec["seq"] > after_seq:
+                    records.append(rec)
+        if good_bytes < os.path.getsize(self.path):
+            log.warning("truncating torn tail of %s at byte %d", self.path, good_bytes)
+            self._f.truncate(good_bytes)
+        return records
+
+    def write(self, kind: str, values: Dict[str, Any]) -> Dict[str, Any]:
+        """Assign the next seq and buffer the record; it is durable only after sync(seq)."""
+        with self._lock:
+            self.last_seq += 1
+            rec = {"seq": self.last_seq, "kind": kind, "at": time.time(), "values": values}
+            self._f.write(json.dumps(rec, separators=(",", ":")).encode() + b"\n")
+            self._written = rec["seq"]
+            return rec
+
+    def sync(self, seq: int):
+        with self._sync_lock:
+            if self._synced >= seq:
+                return  # another caller's fsync already covered it
+            with self._lock:
+                self._f.flush()
+                upto = self._written
+            if self.fsync:
+                os.fsync(self._f.fileno())
+            self._synced = upto
+
+    def size(self) -> int:
+        with self._lock:
+            self._f.flush()
+            return os.fstat(self._f.fileno()).st_size
+
+    def truncate_applied(self, applied_seq: int) -> bool:
+        """Empty the file if every record in it has been applied. seq keeps counting from last_seq."""
+        with self._lock:
+            if applied_seq < self.last_seq:
+                return False
+            self._f.flush()
+            self._f.truncate(0)
+            os.fsync(self._f.fileno())
+            return True
+
+    def close(self):
+        with self._lock:
+            self._f.close()
+
+class GroupWriter:
+    """Drains submitted records into apply_fn(records) in groups; apply_fn must persist the last seq itself."""
+
+    def __init__(self, ingest_log: IngestLog, apply_fn: Callable[[List[Dict[str, Any]]], int], applied_seq: int,
+                 group_rows: int = 500, group_ms: float = 50, max_log_bytes: int = 64 << 20,
+                 key_fn: Optional[Callable[[Dict[str, Any]], Any]] = None):
+        self.log, self.apply_fn, self.key_fn = ingest_log, apply_fn, key_fn
+        self.group_rows, self.group_s, self.max_log_bytes = group_rows, group_ms / 1000.0, max_log_bytes
+        self.applied_seq = applied_seq
+        # a truncated log starts empty; seq must keep counting past the checkpoint
+        self.log.last_seq = max(self.log.last_seq, applied_seq)
+        self._pending: deque = deque()
+        self._queued: Dict[Any, Dict[str, Any]] = {}  # key_fn(record) -> latest pending record with that key
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self.accepted = self.applied = self.duplicates = self.groups = self.failures = 0
+        self.last_group_rows, self.last_group_seconds = 0, 0.0
+
+    def start(self):
+        # replay: everything in the log past the checkpoint goes first
+        backlog = self.log.read(self.applied_seq)
+        if backlog:
+            log.info("replaying %d ingest record(s) after seq %d", len(backlog), self.applied_seq)
+        with self._cond:
+            for rec in backlog:
+                self._enqueue(rec)
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+
+    def _enqueue(self, rec: Dict[str, Any]):
+        self._pending.append(rec)
+        if self.key_fn is not None:
+            self._queued[self.key_fn(rec)] = rec
+
+    def queued(self, key) -> Optional[Dict[str, Any]]:
+        """The pending (logged, not yet applied) record with this key, if any."""
+        with self._cond:
+            return self._queued.get(key)
+
+    def submit(self, kind: str, values: Dict[str, Any], key=None) -> Dict[str, Any]:
+        """Log the record and queue it; returns once it is durable in the log.
+
+        With a key, a record already pending under that key is returned instead (once durable) and nothing is
+        logged; the caller tells them apart by rec["values"] not being its own values.
+        """
+        with self._cond:
+            rec = self._queued.get(key) if key is not None else None
+            if rec is None:
+                # seq order and queue order must match, or the checkpoint could pass a record still queued
+                rec = self.log.write(kind, values)
+                self._enqueue(rec)
+                self.accepted += 1
+                if len(self._pending) == 1 or len(self._pending) >= self.group_rows:
+                    self._cond.notify()  # first record starts the group timer; a full group goes now
+        self.log.sync(rec["seq"])
+        return rec
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._pending and not self._stopping:
+                    self._cond.wait()
+                if self._pending and len(self._pending) < self.group_rows and not self._stopping:
+                    # give the group time to fill, measured from the oldest record's arrival
+                    self._cond.wait(max(0.0, self._pending[0]["at"] + self.group_s - time.time()))
+                if not self._pending:
+                    if self._stopping:
+                        return
+                    continue
+                group = [self._pending[i] for i in range(min(self.group_rows, len(self._pending)))]
+            started = time.perf_counter()
+            try:
+                duplicates = self.apply_fn(group)
+            except Exception:
+                self.failures += 1
+                log.exception("ingest group of %d record(s) failed; retrying", len(group))
+                time.sleep(min(5.0, 0.1 * self.failures))
+                continue
+            with self._cond:
+                for rec in group:
+                    self._pending.popleft()
+                    if self.key_fn is not None and self._queued.get(self.key_fn(rec)) is rec:
+                        del self._queued[self.key_fn(rec)]
+                self.applied_seq = group[-1]["seq"]
+                self.applied += len(group) - duplicates
+                self.duplicates += duplicates
+                self.groups += 1
+                self.last_group_rows, self.last_group_seconds = len(group), time.perf_counter() - started
+                drained = not self._pending
+            if drained and self.log.size() > self.max_log_bytes:
+                self.log.truncate_applied(self.applied_seq)
+
+    def stop(self, timeout: float = 10.0):
+        """Apply what is pending, then stop the thread."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            depth = len(self._pending)
+            lag = time.time() - self._pending[0]["at"] if depth else 0.0
+            return {
+                "queueDepth": depth, "applyLagSeconds": round(lag, 3),
+                "accepted": self.accepted, "applied": self.applied, "duplicates": self.duplicates,
+                "groupCommits": self.groups, "failures": self.failures,
+                "lastGroupRows": self.last_group_rows, "lastGroupSeconds": round(self.last_group_seconds, 4),
+                "appliedSeq": self.applied_seq, "lastSeq": self.log.last_seq, "logBytes": self.log.size(),
+            }
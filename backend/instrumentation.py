@@ -0,0 +1,219 @@
+# instrumentation.py
+# Opt-in per-request timing, SQL statement accounting and Prometheus-style metrics for the Flask app.
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+from flask import Response, request
+from sqlalchemy import event
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a label tuple."""
+
+    def __init__(self, name: str, help_text: str, buckets, label_names: Tuple[str, ...]):
+        self.name, self.help, self.buckets, self.label_names = name, help_text, tuple(buckets), label_names
+        self._series: Dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        with self._lock:
+            series = self._series.setdefault(labels, [0] * len(self.buckets) + [0.0, 0])
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                base = ",".join(f'{k}="{v}"' for k, v in zip(self.label_names, labels))
+                sep = "," if base else ""
+                for upper, n in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{{{base}{sep}le="{upper}"}} {n}')
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {series[-1]}')
+                lines.append(f"{self.name}_sum{{{base}}} {series[-2]}")
+                lines.append(f"{self.name}_count{{{base}}} {series[-1]}")
+        return lines
+
+class CounterMetric:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name, self.help, self.label_names = name, help_text, label_names
+        self._values: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple, n: int = 1):
+        with self._lock:
+            self._values[labels] += n
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, v in sorted(self._values.items()):
+                base = ",".join(f'{k}="{v2}"' for k, v2 in zip(self.label_names, labels))
+                lines.append(f"{self.name}{{{base}}} {v}")
+        return lines
+
+class RequestStats:
+    __slots__ = ("started", "status", "sql_count", "sql_time", "statements", "_stmt_start")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.status = 500
+        self.sql_count, self.sql_time = 0, 0.0
+        self.statements: Counter = Counter()
+        self._stmt_start = None
+
+class SamplingProfiler:
+    """Samples the stacks of threads currently serving a request; keeps folded stacks per thread."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._active: Dict[int, Counter] = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, ident: int):
+        with self._lock:
+            self._active[ident] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-sampler", daemon=True)
+                self._thread.start()
+
+    def stop(self, ident: int) -> Counter:
+        with self._lock:
+            return self._active.pop(ident, Counter())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for ident, stacks in self._active.items():
+                    frame = frames.get(ident)
+                    parts = []
+                    while frame is not None:
+                        code = frame.f_code
+                        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                        frame = frame.f_back
+                    if parts:
+                        stacks[";".join(reversed(parts))] += 1
+
+class Instrumentation:
+    """Attach with Instrumentation(app, engine); serves /api/metrics in Prometheus text format.
+
+    engine may be None when the app is built before its engines exist; call watch_engine() once they do.
+    """
+
+    def __init__(self, app, engine=None, n_plus_one_threshold: int = 10, slow_ms: float = None,
+                 profile_dir: str = "profiles", sample_interval: float = 0.005):
+        self.app, self.n_plus_one_threshold = app, n_plus_one_threshold
+        self.slow_ms, self.profile_dir = slow_ms, profile_dir
+        self.profiler = SamplingProfiler(sample_interval) if slow_ms is not None else None
+        self._local = threading.local()
+        self._collectors: List[Callable[[], List[str]]] = []
+
+        labels = ("endpoint",)
+        self.request_seconds = Histogram("http_request_duration_seconds", "Total request time.", TIME_BUCKETS, labels)
+        self.sql_statements = Histogram("sql_statements_per_request", "SQL statements executed per request.", COUNT_BUCKETS, labels)
+        self.sql_seconds = Histogram("sql_duration_seconds_per_request", "Time spent in SQL per request.", TIME_BUCKETS, labels)
+        self.requests_total = CounterMetric("http_requests_total", "Requests by endpoint and status.", ("endpoint", "status"))
+        self.n_plus_one = CounterMetric("sql_n_plus_one_requests_total", "Requests that repeated one statement at least the N+1 threshold.", labels)
+
+        if engine is not None:
+            self.watch_engine(engine)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule("/api/metrics", "api_metrics", self.metrics_view, methods=["GET"])
+
+    def watch_engine(self, engine):
+        """Count statements on another engine too (e.g. a separate read pool)."""
+        event.listen(engine, "before_cursor_execute", self._before_cursor)
+        event.listen(engine, "after_cursor_execute", self._after_cursor)
+
+    def add_collector(self, fn: Callable[[], List[str]]):
+        """Register extra exposition lines (e.g. cache or queue gauges) for /api/metrics."""
+        self._collectors.append(fn)
+
+    # ---- SQLAlchemy events: only counted on threads that are serving a request ----
+    def _before_cursor(self, conn, cursor, statement, parameters, context, executemany):
+        stats = getattr(self._local, "stats", None)
+        if stats is not None:
+            stats._stmt_start = time.perf_counter()
+
+    def _after_cursor(self, conn, cursor, statement, parameters, context, executemany):
+        stats = getattr(self._local, "stats", None)
+        if stats is None or stats._stmt_start is None:
+            return
+        stats.sql_time += time.perf_counter() - stats._stmt_start
+        stats.sql_count += 1
+        stats.statements[statement] += 1
+        stats._stmt_start = None
+
+    # ---- Flask hooks ----
+    def _before_request(self):
+        self._local.stats = RequestStats()
+        if self.profiler:
+            self.profiler.start(threading.get_ident())
+
+    def _after_request(self, response):
+        stats = getattr(self._local, "stats", None)
+        if stats is not None:
+            stats.status = response.status_code
+            response.headers["Server-Timing"] = f"sql;dur={stats.sql_time * 1000:.2f};desc=\"{stats.sql_count} stmts\""
+        return response
+
+    def _teardown_request(self, exc):
+        stats = getattr(self._local, "stats", None)
+        self._local.stats = None
+        if stats is None:
+            return
+        elapsed = time.perf_counter() - stats.started
+        # labelled by view name: "api.api_balance" -> "api_balance"
+        endpoint = (request.endpoint or "unmatched").rpartition(".")[2]
+        if endpoint == "api_metrics":
+            if self.profiler: self.profiler.stop(threading.get_ident())
+            return
+        labels = (endpoint,)
+        self.request_seconds.observe(labels, elapsed)
+        self.sql_statements.observe(labels, stats.sql_count)
+        self.sql_seconds.observe(labels, stats.sql_time)
+        self.requests_total.inc((endpoint, "500" if exc else str(stats.status)))
+
+        repeated = [(stmt, n) for stmt, n in stats.statements.items() if n >= self.n_plus_one_threshold]
+        if repeated:
+            self.n_plus_one.inc(labels)
+            stmt, n = max(repeated, key=lambda x: x[1])
+            self.app.logger.warning("possible N+1 in %s: %d executions of %s", endpoint, n, " ".join(stmt.split())[:200])
+
+        if self.profiler:
+            stacks = self.profiler.stop(threading.get_ident())
+            if elapsed * 1000 >= self.slow_ms and stacks:
+                self._dump_profile(endpoint, elapsed, stacks)
+
+    def _dump_profile(self, endpoint: str, elapsed: float, stacks: Counter):
+        # folded-stack format: feed to flamegraph.pl or speedscope
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = f"{datetime.now():%Y%m%dT%H%M%S%f}_{endpoint}_{elapsed * 1000:.0f}ms.folded"
+        with open(os.path.join(self.profile_dir, name), "w", encoding="utf-8") as f:
+            for stack, n in stacks.most_common():
+                f.write(f"{stack} {n}\n")
+
+    def metrics_view(self):
+        lines: List[str] = []
+        for metric in (self.request_seconds, self.sql_statements, self.sql_seconds, self.requests_total, self.n_plus_one):
+            lines.extend(metric.render())
+        for fn in self._collectors:
+            lines.extend(fn())
+        return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
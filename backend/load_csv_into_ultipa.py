@@ -1,64 +1,16 @@
 # load_csv_into_sqlite.py
-import argparse, csv
+import argparse, csv, hashlib, os, queue, threading, time
+import urllib.request
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timezone
-from sqlalchemy import create_engine, select
-from sqlalchemy.orm import declarative_base, sessionmaker
-
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, UniqueConstraint
-from sqlalchemy.orm import relationship
-
-Base = declarative_base()
-
-class Customer(Base):
-    __tablename__ = "customers"
-    id = Column(Integer, primary_key=True)
-    customer_id = Column(String(64), unique=True, index=True, nullable=False)
-    name = Column(String(128))
-
-class Account(Base):
-    __tablename__ = "accounts"
-    id = Column(Integer, primary_key=True)
-    account_no = Column(String(64), unique=True, index=True, nullable=False)
-    type = Column(String(32))
-    currency = Column(String(8), default="USD")
-    status = Column(String(32), default="active")
-
-class Merchant(Base):
-    __tablename__ = "merchants"
-    id = Column(Integer, primary_key=True)
-    merchant_id = Column(String(64), unique=True, index=True, nullable=False)
-    name = Column(String(128))
-    mcc = Column(String(8))
-
-class Owns(Base):
-    __tablename__ = "owns"
-    id = Column(Integer, primary_key=True)
-    customer_id_fk = Column(Integer, ForeignKey("customers.id"), nullable=False)
-    account_id_fk = Column(Integer, ForeignKey("accounts.id"), nullable=False)
-    since = Column(DateTime)
-    __table_args__ = (UniqueConstraint("customer_id_fk", "account_id_fk", name="uq_owns"),)
-
-class Transfer(Base):
-    __tablename__ = "transfers"
-    id = Column(Integer, primary_key=True)
-    tx_id = Column(String(128), unique=True, index=True, nullable=False)
-    amount = Column(Float, nullable=False)
-    currency = Column(String(8), default="USD")
-    channel = Column(String(32), default="api")
-    created_at = Column(DateTime, default=datetime.now)
-    from_account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
-    to_account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
-
-class Pay(Base):
-    __tablename__ = "pays"
-    id = Column(Integer, primary_key=True)
-    tx_id = Column(String(128), unique=True, index=True, nullable=False)
-    amount = Column(Float, nullable=False)
-    currency = Column(String(8), default="USD")
-    channel = Column(String(32), default="api")
-    created_at = Column(DateTime, default=datetime.now)
-    from_account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
-    merchant_id_fk = Column(Integer, ForeignKey("merchants.id"), nullable=False)
+from sqlalchemy import create_engine, select, insert, delete, inspect
+from sqlalchemy.orm import sessionmaker
+
+import migrations
+import partitions
+from models import Base, Customer, Account, Merchant, Owns, Transfer, Pay, AccountBalance, ImportCheckpoint, compute_balances
+from money import to_minor
 
 def upsert_customer(s, customer_id, name):
     obj = s.execute(select(Customer).where(Customer.customer_id==customer_id)).scalar_one_or_none()
@@ -87,14 +39,18 @@ def ensure_owns(s, customer_id, account_no, since_iso):
     o = Owns(customer_id_fk=cust.id, account_id_fk=acct.id, since=since)
     s.add(o); s.flush(); return o
 
-def insert_transfer(s, row):
+def closed_month_error(ledger, row):
+    return ValueError(f"{row['tx_id']}: created_at {row['created_at']} is in a closed month (closed through {ledger.closed[-1]}); "
+                      "closed months take no new rows")
+
+def insert_transfer(s, row, ledger):
     src = s.execute(select(Account).where(Account.account_no==row["from_account_no"])).scalar_one()
     dst = s.execute(select(Account).where(Account.account_no==row["to_account_no"])).scalar_one()
-    exists = s.execute(select(Transfer).where(Transfer.tx_id==row["tx_id"])).scalar_one_or_none()
-    if exists: return False
+    if ledger.find_tx(s, "transfers", {row["tx_id"]}): return False
+    if ledger.in_closed_period(datetime.fromisoformat(row["created_at"])): raise closed_month_error(ledger, row)
     t = Transfer(
         tx_id=row["tx_id"],
-        amount=float(row["amount"]),
+        amount_minor=to_minor(row["amount"], row["currency"]),
         currency=row["currency"],
         channel=row["channel"],
         created_at=datetime.fromisoformat(row["created_at"]),
@@ -103,14 +59,14 @@ def insert_transfer(s, row):
     )
     s.add(t); return True
 
-def insert_pay(s, row):
+def insert_pay(s, row, ledger):
     acc = s.execute(select(Account).where(Account.account_no==row["from_account_no"])).scalar_one()
     m = s.execute(select(Merchant).where(Merchant.merchant_id==row["merchant_id"])).scalar_one()
-    exists = s.execute(select(Pay).where(Pay.tx_id==row["tx_id"])).scalar_one_or_none()
-    if exists: return False
+    if ledger.find_tx(s, "pays", {row["tx_id"]}): return False
+    if ledger.in_closed_period(datetime.fromisoformat(row["created_at"])): raise closed_month_error(ledger, row)
     p = Pay(
         tx_id=row["tx_id"],
-        amount=float(row["amount"]),
+        amount_minor=to_minor(row["amount"], row["currency"]),
         currency=row["currency"],
         channel=row["channel"],
         created_at=datetime.fromisoformat(row["created_at"]),
@@ -119,63 +75,596 @@ def insert_pay(s, row):
     )
     s.add(p); return True
 
+# -------------------- checkpoints --------------------
+# seed files in load order; owns/transfers/pays reference the first three
+KINDS = ("customers", "accounts", "merchants", "owns", "transfers", "pays")
+HASH_BLOCK = 1 << 20
+
+class CsvTail:
+    """The rows of a seed CSV past its import checkpoint.
+
+    The checkpoint counts (resumed) only if the file's first `offset` bytes still hash to the stored sha256,
+    i.e. the file was only appended to; otherwise reading starts at the top and the usual key dedupe skips
+    rows already loaded (open_sources only allows that for a changed file with --full). When resuming, only
+    newline-terminated lines are consumed, so a row still being appended is left for the next run; read from
+    the top, a final line without a newline is a complete last row. offset/rows/digest advance as rows are read.
+    """
+
+    def __init__(self, path, checkpoint=None):
+        self.path, self.name = path, os.path.basename(path)
+        self.digest, self.offset, self.rows, self.resumed = hashlib.sha256(), 0, 0, False
+        with open(path, "rb") as f:
+            self.header = next(csv.reader([f.readline().decode("utf-8")]), [])
+            if checkpoint is not None and checkpoint.offset <= os.path.getsize(path):
+                f.seek(0)
+                digest, remaining = hashlib.sha256(), checkpoint.offset
+                while remaining:
+                    block = f.read(min(HASH_BLOCK, remaining))
+                    digest.update(block)
+                    remaining -= len(block)
+                if digest.hexdigest() == checkpoint.sha256:
+                    self.digest, self.offset, self.rows, self.resumed = digest, checkpoint.offset, checkpoint.rows, True
+        self.start_rows = self.rows
+
+    def _lines(self, f):
+        for line in f:
+            if not line.endswith(b"\n") and self.resumed:
+                print(f"{self.name}: last line has no newline yet; left for the next run")
+                return
+            self.offset += len(line)
+            self.digest.update(line)
+            yield line.decode("utf-8")
+
+    def raw_rows(self):
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            reader = csv.reader(self._lines(f))
+            if self.offset == 0:
+                next(reader, None)  # header
+            for raw in reader:
+                if not raw:  # blank line, e.g. the newline an append adds after an unterminated last row
+                    continue
+                self.rows += 1
+                yield raw
+
+    def dict_rows(self):
+        for raw in self.raw_rows():
+            yield dict(zip(self.header, raw))
+
+def load_checkpoints(s):
+    if not inspect(s.connection()).has_table(ImportCheckpoint.__tablename__):
+        return {}
+    return {c.file: c for c in s.execute(select(ImportCheckpoint)).scalars()}
+
+def open_sources(s, data_dir, full=False):
+    """kind -> CsvTail for every seed file, resuming at its checkpoint unless full."""
+    checkpoints = {} if full else load_checkpoints(s)
+    sources = {}
+    for kind in KINDS:
+        src = sources[kind] = CsvTail(f"{data_dir}/{kind}.csv", checkpoints.get(f"{kind}.csv"))
+        if src.resumed:
+            print(f"{src.name}: resuming after row {src.rows} (byte {src.offset})")
+        elif src.name in checkpoints:
+            # rows edited before the checkpoint would be skipped by the key dedupe; make that a deliberate choice
+            raise SystemExit(f"{src.name}: changed before its checkpoint (row {checkpoints[src.name].rows}); "
+                             "rerun with --full to read every file from the top")
+    return sources
+
+def save_checkpoint(s, src):
+    s.merge(ImportCheckpoint(file=src.name, offset=src.offset, rows=src.rows, sha256=src.digest.hexdigest(),
+                             updated_at=datetime.now(timezone.utc)))
+    s.commit()
+
+# -------------------- bulk mode --------------------
+def chunked(seq, n):
+    for i in range(0, len(seq), n):
+        yield seq[i:i + n]
+
+def read_batches(src, batch_size):
+    batch = []
+    for row in src.dict_rows():
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class Progress:
+    def __init__(self, label):
+        self.label, self.rows, self.inserted, self.t0 = label, 0, 0, time.perf_counter()
+
+    def add(self, rows, inserted):
+        self.rows += rows; self.inserted += inserted
+        dt = time.perf_counter() - self.t0
+        print(f"{self.label}: {self.rows} rows read, {self.inserted} inserted, {self.rows / dt if dt else 0:,.0f} rows/s", flush=True)
+
+def existing_keys(s, column, keys, chunk=500):
+    # one IN (...) query per chunk instead of one SELECT per row
+    found = set()
+    for part in chunked(list(keys), chunk):
+        found.update(s.execute(select(column).where(column.in_(part))).scalars())
+    return found
+
+def bulk_reference(s, src, model, key, to_values, batch_size):
+    prog = Progress(model.__tablename__)
+    for batch in read_batches(src, batch_size):
+        have = existing_keys(s, getattr(model, key), {r[key] for r in batch})
+        values = []
+        for row in batch:
+            if row[key] in have: continue
+            have.add(row[key])  # first occurrence wins, as with upsert_*
+            values.append(to_values(row))
+        if values: s.execute(insert(model), values)
+        s.commit(); prog.add(len(batch), len(values))
+    save_checkpoint(s, src)
+
+def key_map(s, key_col, id_col):
+    return dict(s.execute(select(key_col, id_col)).all())
+
+def bulk_owns(s, src, batch_size, cust_ids, acct_ids):
+    prog = Progress("owns")
+    have = set(s.execute(select(Owns.customer_id_fk, Owns.account_id_fk)).all())
+    for batch in read_batches(src, batch_size):
+        values = []
+        for row in batch:
+            pair = (cust_ids[row["customer_id"]], acct_ids[row["account_no"]])
+            if pair in have: continue
+            have.add(pair)
+            values.append({"customer_id_fk": pair[0], "account_id_fk": pair[1], "since": datetime.fromisoformat(row["since"])})
+        if values: s.execute(insert(Owns), values)
+        s.commit(); prog.add(len(batch), len(values))
+    save_checkpoint(s, src)
+
+def bulk_tx(s, src, model, batch_size, to_values, ledger):
+    prog = Progress(model.__tablename__)
+    for batch in read_batches(src, batch_size):
+        # earlier batches are already in the DB, so only in-batch duplicates need tracking
+        have = set(ledger.find_tx(s, model.__tablename__, {r["tx_id"] for r in batch}))
+        values = []
+        for row in batch:
+            v = to_values(row)  # resolve ids first: unknown accounts/merchants fail like the row path
+            if row["tx_id"] in have: continue
+            if ledger.in_closed_period(v["created_at"]): raise closed_month_error(ledger, row)
+            have.add(row["tx_id"])
+            values.append(v)
+        if values: s.execute(insert(model), values)
+        s.commit(); prog.add(len(batch), len(values))
+    save_checkpoint(s, src)
+    return prog.inserted
+
+def bulk_load(s, sources, batch_size, ledger):
+    """Load every file past its checkpoint; returns the number of transfers + pays inserted."""
+    bulk_reference(s, sources["customers"], Customer, "customer_id",
+                   lambda r: {"customer_id": r["customer_id"], "name": r["name"]}, batch_size)
+    bulk_reference(s, sources["accounts"], Account, "account_no",
+                   lambda r: {"account_no": r["account_no"], "type": r["type"], "currency": r["currency"], "status": r["status"]}, batch_size)
+    bulk_reference(s, sources["merchants"], Merchant, "merchant_id",
+                   lambda r: {"merchant_id": r["merchant_id"], "name": r["name"], "mcc": r["mcc"]}, batch_size)
+
+    cust_ids = key_map(s, Customer.customer_id, Customer.id)
+    acct_ids = key_map(s, Account.account_no, Account.id)
+    merch_ids = key_map(s, Merchant.merchant_id, Merchant.id)
+
+    bulk_owns(s, sources["owns"], batch_size, cust_ids, acct_ids)
+
+    n = bulk_tx(s, sources["transfers"], Transfer, batch_size, lambda r: {
+        "tx_id": r["tx_id"], "amount_minor": to_minor(r["amount"], r["currency"]), "currency": r["currency"], "channel": r["channel"],
+        "created_at": datetime.fromisoformat(r["created_at"]),
+        "from_account_id": acct_ids[r["from_account_no"]], "to_account_id": acct_ids[r["to_account_no"]],
+    }, ledger)
+    print("inserted transfers:", n)
+    total = n
+
+    n = bulk_tx(s, sources["pays"], Pay, batch_size, lambda r: {
+        "tx_id": r["tx_id"], "amount_minor": to_minor(r["amount"], r["currency"]), "currency": r["currency"], "channel": r["channel"],
+        "created_at": datetime.fromisoformat(r["created_at"]),
+        "from_account_id": acct_ids[r["from_account_no"]], "merchant_id_fk": merch_ids[r["merchant_id"]],
+    }, ledger)
+    print("inserted pays:", n)
+    return total + n
+
+# -------------------- pipeline mode --------------------
+def parse_time(field):
+    return lambda row: datetime.fromisoformat(row[field])
+
+def parse_minor(row):
+    return to_minor(row["amount"], row["currency"])
+
+# required columns and typed conversions (output field -> fn(row)) per seed file; validation runs in worker processes
+FILE_SPECS = {
+    "customers": (["customer_id"], {}),
+    "accounts": (["account_no"], {}),
+    "merchants": (["merchant_id"], {}),
+    "owns": (["customer_id", "account_no", "since"], {"since": parse_time("since")}),
+    "transfers": (["from_account_no", "to_account_no", "tx_id", "amount", "currency", "channel", "created_at"],
+                  {"amount_minor": parse_minor, "created_at": parse_time("created_at")}),
+    "pays": (["from_account_no", "merchant_id", "tx_id", "amount", "currency", "channel", "created_at"],
+             {"amount_minor": parse_minor, "created_at": parse_time("created_at")}),
+}
+
+def parse_chunk(kind, header, first_row, raws):
+    """Validate a chunk of raw csv rows; returns ([(row_no, row, raw)], [(row_no, reason, raw)])."""
+    required, converters = FILE_SPECS[kind]
+    good, bad = [], []
+    for i, raw in enumerate(raws):
+        row_no = first_row + i
+        if len(raw) != len(header):
+            bad.append((row_no, f"expected {len(header)} columns, got {len(raw)}", raw)); continue
+        row = dict(zip(header, raw))
+        missing = [f for f in required if not row.get(f)]
+        if missing:
+            bad.append((row_no, "missing " + ",".join(missing), raw)); continue
+        try:
+            for f, conv in converters.items():
+                row[f] = conv(row)
+        except ValueError as e:
+            bad.append((row_no, f"invalid {f}: {e}", raw)); continue
+        good.append((row_no, row, raw))
+    return good, bad
+
+def iter_raw_chunks(src, chunk_size):
+    # row numbers stay file-absolute when resuming from a checkpoint
+    chunk, first = [], src.rows + 1
+    for raw in src.raw_rows():
+        chunk.append(raw)
+        if len(chunk) >= chunk_size:
+            yield src.header, first, chunk
+            first += len(chunk); chunk = []
+    if chunk:
+        yield src.header, first, chunk
+
+def parse_file(pool, kind, src, chunk_size, max_inflight, out):
+    # at most max_inflight chunks are parsing and out is bounded, so a slow writer stalls the reader
+    pending = deque()
+    for header, first, chunk in iter_raw_chunks(src, chunk_size):
+        pending.append(pool.submit(parse_chunk, kind, header, first, chunk))
+        if len(pending) >= max_inflight:
+            out.put((kind, src.path) + pending.popleft().result())
+    while pending:
+        out.put((kind, src.path) + pending.popleft().result())
+
+class Writer(threading.Thread):
+    """Single DB writer fed by the parse pipeline; rows it cannot resolve go to the reject file."""
+
+    def __init__(self, Session, q, reject_path, ledger):
+        super().__init__(daemon=True)
+        self.Session, self.q, self.reject_path, self.ledger = Session, q, reject_path, ledger
+        self.error, self.rejected, self.progress = None, 0, {}
+        self.cust_ids = self.acct_ids = self.merch_ids = {}
+
+    def run(self):
+        s = self.Session()
+        try:
+            with open(self.reject_path, "w", newline="", encoding="utf-8") as rf:
+                rejects = csv.writer(rf)
+                rejects.writerow(["file", "row", "reason", "raw"])
+                while True:
+                    item = self.q.get()
+                    try:
+                        if item is None:
+                            return
+                        if self.error is None:  # after a failure keep draining so producers never block
+                            self.handle(s, rejects, item)
+                    except Exception as e:
+                        s.rollback(); self.error = e
+                    finally:
+                        self.q.task_done()
+        finally:
+            s.close()
+
+    def handle(self, s, rejects, item):
+        if item[0] == "maps":
+            self.cust_ids = key_map(s, Customer.customer_id, Customer.id)
+            self.acct_ids = key_map(s, Account.account_no, Account.id)
+            self.merch_ids = key_map(s, Merchant.merchant_id, Merchant.id)
+            return
+        kind, path, good, bad = item
+        bad = list(bad)
+        values = getattr(self, "rows_" + kind)(s, good, bad)
+        if values:
+            s.execute(insert(MODELS[kind]), values)
+        s.commit()
+        for row_no, reason, raw in bad:
+            rejects.writerow([os.path.basename(path), row_no, reason, ",".join(raw)])
+        self.rejected += len(bad)
+        self.progress.setdefault(kind, Progress(kind)).add(len(good) + len(bad), len(values))
+
+    def new_by_key(self, s, model, key, good):
+        keys = {r[key] for _, r, _ in good}
+        # txIds of archived months are no longer in the live table
+        have = set(self.ledger.find_tx(s, model.__tablename__, keys)) if key == "tx_id" else existing_keys(s, getattr(model, key), keys)
+        for row_no, row, raw in good:
+            if row[key] in have: continue
+            have.add(row[key])
+            yield row_no, row, raw
+
+    def rows_customers(self, s, good, bad):
+        return [{"customer_id": r["customer_id"], "name": r["name"]} for _, r, _ in self.new_by_key(s, Customer, "customer_id", good)]
+
+    def rows_accounts(self, s, good, bad):
+        return [{"account_no": r["account_no"], "type": r["type"], "currency": r["currency"], "status": r["status"]}
+                for _, r, _ in self.new_by_key(s, Account, "account_no", good)]
+
+    def rows_merchants(self, s, good, bad):
+        return [{"merchant_id": r["merchant_id"], "name": r["name"], "mcc": r["mcc"]} for _, r, _ in self.new_by_key(s, Merchant, "merchant_id", good)]
+
+    def rows_owns(self, s, good, bad):
+        resolved = []
+        for row_no, r, raw in good:
+            pair = (self.cust_ids.get(r["customer_id"]), self.acct_ids.get(r["account_no"]))
+            if None in pair:
+                bad.append((row_no, "unknown customer or account", raw)); continue
+            resolved.append((pair, r["since"]))
+        if not resolved:
+            return []
+        have = set(s.execute(select(Owns.customer_id_fk, Owns.account_id_fk)
+                             .where(Owns.customer_id_fk.in_({p[0] for p, _ in resolved}))).all())
+        values = []
+        for pair, since in resolved:
+            if pair in have: continue
+            have.add(pair)
+            values.append({"customer_id_fk": pair[0], "account_id_fk": pair[1], "since": since})
+        return values
+
+    def rows_transfers(self, s, good, bad):
+        values = []
+        for row_no, r, raw in self.new_by_key(s, Transfer, "tx_id", good):
+            src, dst = self.acct_ids.get(r["from_account_no"]), self.acct_ids.get(r["to_account_no"])
+            if src is None or dst is None:
+                bad.append((row_no, "unknown account", raw)); continue
+            if self.ledger.in_closed_period(r["created_at"]):
+                bad.append((row_no, f"created_at in a closed month (closed through {self.ledger.closed[-1]})", raw)); continue
+            values.append({"tx_id": r["tx_id"], "amount_minor": r["amount_minor"], "currency": r["currency"], "channel": r["channel"],
+                           "created_at": r["created_at"], "from_account_id": src, "to_account_id": dst})
+        return values
+
+    def rows_pays(self, s, good, bad):
+        values = []
+        for row_no, r, raw in self.new_by_key(s, Pay, "tx_id", good):
+            acc, m = self.acct_ids.get(r["from_account_no"]), self.merch_ids.get(r["merchant_id"])
+            if acc is None or m is None:
+                bad.append((row_no, "unknown account or merchant", raw)); continue
+            if self.ledger.in_closed_period(r["created_at"]):
+                bad.append((row_no, f"created_at in a closed month (closed through {self.ledger.closed[-1]})", raw)); continue
+            values.append({"tx_id": r["tx_id"], "amount_minor": r["amount_minor"], "currency": r["currency"], "channel": r["channel"],
+                           "created_at": r["created_at"], "from_account_id": acc, "merchant_id_fk": m})
+        return values
+
+MODELS = {"customers": Customer, "accounts": Account, "merchants": Merchant, "owns": Owns, "transfers": Transfer, "pays": Pay}
+
+# owns/transfers/pays only need the reference tables, so each phase's files load concurrently
+PIPELINE_PHASES = (("customers", "accounts", "merchants"), ("owns", "transfers", "pays"))
+
+def pipeline_load(Session, sources, batch_size, workers, queue_size, reject_path, ledger):
+    """Load every file past its checkpoint; returns the number of transfers + pays inserted.
+
+    A phase's checkpoints are saved once the writer has committed all of its rows. Rejected rows count as
+    read, so fix them in the reject file and load that, or rerun with --full.
+    """
+    q = queue.Queue(maxsize=queue_size)
+    writer = Writer(Session, q, reject_path, ledger)
+    writer.start()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for phase in PIPELINE_PHASES:
+            with ThreadPoolExecutor(max_workers=len(phase)) as readers:
+                futs = [readers.submit(parse_file, pool, kind, sources[kind], batch_size, workers * 2, q) for kind in phase]
+                for fut in futs:
+                    fut.result()
+            q.put(("maps",))
+            q.join()
+            if writer.error:
+                break
+            with Session() as s:
+                for kind in phase:
+                    save_checkpoint(s, sources[kind])
+    q.put(None)
+    writer.join()
+    if writer.error:
+        raise writer.error
+    for kind in ("transfers", "pays"):
+        if kind in writer.progress:
+            print(f"inserted {kind}:", writer.progress[kind].inserted)
+    print(f"rejected rows: {writer.rejected} (see {reject_path})")
+    return sum(writer.progress[k].inserted for k in ("transfers", "pays") if k in writer.progress)
+
+def rebuild_balances(s):
+    # the app keeps account_balances in step with its own writes; rows inserted here bypass it
+    totals = compute_balances(s)
+    s.execute(delete(AccountBalance))
+    for acct_id, (inc, out_t, out_p) in totals.items():
+        s.add(AccountBalance(account_id=acct_id, incoming=inc, outgoing_transfers=out_t,
+                             outgoing_pays=out_p, balance=inc - out_t - out_p))
+    s.commit()
+
+# -------------------- verify --------------------
+def canon(value):
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None).isoformat()  # DateTime columns store naive values
+    return "" if value is None else str(value)
+
+def row_hash(fields) -> int:
+    return int.from_bytes(hashlib.blake2b("\x1f".join(canon(v) for v in fields).encode("utf-8"), digest_size=8).digest(), "big")
+
+def tx_file_fields(target):
+    return lambda r: (r["tx_id"], (r["from_account_no"], r[target], to_minor(r["amount"], r["currency"]), r["currency"],
+                                   r["channel"], datetime.fromisoformat(r["created_at"])))
+
+# kind -> (file row -> (key, compared fields), statements yielding (key, *fields) from the DB)
+def verify_specs(router):
+    def transfers():
+        for t in router.tables("transfers"):
+            src, dst = Account.__table__.alias("src"), Account.__table__.alias("dst")
+            yield (select(t.c.tx_id, src.c.account_no, dst.c.account_no, t.c.amount_minor, t.c.currency, t.c.channel, t.c.created_at)
+                   .join(src, src.c.id == t.c.from_account_id).join(dst, dst.c.id == t.c.to_account_id))
+
+    def pays():
+        for p in router.tables("pays"):
+            yield (select(p.c.tx_id, Account.account_no, Merchant.merchant_id, p.c.amount_minor, p.c.currency, p.c.channel, p.c.created_at)
+                   .join(Account, Account.id == p.c.from_account_id).join(Merchant, Merchant.id == p.c.merchant_id_fk))
+
+    return {
+        "customers": (lambda r: (r["customer_id"], (r["name"],)), lambda: [select(Customer.customer_id, Customer.name)]),
+        "accounts": (lambda r: (r["account_no"], (r["type"], r["currency"], r["status"])),
+                     lambda: [select(Account.account_no, Account.type, Account.currency, Account.status)]),
+        "merchants": (lambda r: (r["merchant_id"], (r["name"], r["mcc"])), lambda: [select(Merchant.merchant_id, Merchant.name, Merchant.mcc)]),
+        "owns": (lambda r: ((r["customer_id"], r["account_no"]), (datetime.fromisoformat(r["since"]),)),
+                 lambda: [select(Customer.customer_id, Account.account_no, Owns.since)
+                          .join(Customer, Customer.id == Owns.customer_id_fk).join(Account, Account.id == Owns.account_id_fk)]),
+        "transfers": (tx_file_fields("to_account_no"), transfers),
+        "pays": (tx_file_fields("merchant_id"), pays),
+    }
+
+def open_ledger(engine, archive_dir):
+    """LedgerRouter over the archived months; every connection engine opens from here on attaches them."""
+    router = partitions.LedgerRouter(Base.metadata, archive_dir)
+    with engine.connect() as conn:
+        router.load(conn)
+    router.install(engine)
+    engine.dispose()
+    return router
+
+def verify(engine, data_dir, router):
+    """Compare every seed file with the DB: row counts, per-row differences and an order-independent checksum
+    (sum of per-row hashes mod 2**64) over the file's rows. Archived months are read through router.
+    Returns the number of files that do not match."""
+    with sessionmaker(bind=engine, future=True)() as s:
+        checkpoints = load_checkpoints(s)
+    failed = 0
+    for kind, (file_fields, db_stmts) in verify_specs(router).items():
+        src = CsvTail(f"{data_dir}/{kind}.csv", checkpoints.get(f"{kind}.csv"))
+        resumed, ckpt_rows = src.resumed, src.rows
+        src = CsvTail(src.path)  # hash and read the whole file
+        expected = {}
+        for row in src.dict_rows():
+            key, fields = file_fields(row)
+            expected.setdefault(key, row_hash(fields))  # first occurrence wins, as when loading
+        file_sum = db_sum = 0
+        matched = differing = extra = duplicated = 0
+        seen = set()
+        with engine.connect() as conn:
+            for stmt in db_stmts():
+                for r in conn.execute(stmt.execution_options(yield_per=10_000)):
+                    key = (r[0], r[1]) if kind == "owns" else r[0]
+                    fields = r[2:] if kind == "owns" else r[1:]
+                    want = expected.get(key)
+                    if want is None:
+                        extra += 1
+                        continue
+                    if key in seen:  # e.g. a txId both live and archived; each key counts once
+                        duplicated += 1
+                        continue
+                    seen.add(key)
+                    got = row_hash(fields)
+                    db_sum = (db_sum + got) % (1 << 64)
+                    matched += 1
+                    differing += got != want
+        for h in expected.values():
+            file_sum = (file_sum + h) % (1 << 64)
+        missing = len(expected) - matched
+        ok = not missing and not differing and not duplicated and file_sum == db_sum
+        failed += not ok
+        print(f"{src.name}: {src.rows} rows, {len(expected)} distinct; db {matched} found, {missing} missing, {differing} different, "
+              f"{duplicated} duplicated, {extra} not in file; checksum file {file_sum:016x} db {db_sum:016x} {'ok' if ok else 'MISMATCH'}")
+        if src.name in checkpoints:
+            state = "prefix unchanged" if resumed else "file changed before the checkpoint"
+            print(f"  checkpoint: row {ckpt_rows} of {src.rows}, {state}")
+    return failed
+
+def invalidate_app_caches(base_url, token):
+    # the API caches account/merchant/customer lookups; tell it the tables changed
+    req = urllib.request.Request(base_url.rstrip("/") + "/api/cache/invalidate", data=b"", method="POST",
+                                 headers={"X-Seed-Token": token or ""})
+    try:
+        with urllib.request.urlopen(req, timeout=5) as resp:
+            print("app caches invalidated:", resp.status)
+    except OSError as e:
+        print("warning: could not invalidate app caches:", e)
+
+def finish(s, inserted, args):
+    if inserted:
+        rebuild_balances(s)
+    else:
+        print("no new transfers or pays; balances left as they are")
+    s.close()
+    if args.invalidate_url: invalidate_app_caches(args.invalidate_url, args.seed_token)
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--db", default="sqlite:///bank.db")
     ap.add_argument("--dir", default=".")
+    ap.add_argument("--bulk", action="store_true", help="set-based load: preloaded key maps, chunked dedupe, batched inserts")
+    ap.add_argument("--batch-size", type=int, default=5000, help="rows per batch in --bulk/--pipeline mode")
+    ap.add_argument("--pipeline", action="store_true", help="parse/validate in a process pool feeding a single DB writer")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="parser processes in --pipeline mode")
+    ap.add_argument("--queue-size", type=int, default=8, help="parsed batches buffered ahead of the writer")
+    ap.add_argument("--reject-file", default="rejects.csv", help="where --pipeline writes rows it could not load")
+    ap.add_argument("--invalidate-url", help="base URL of a running API whose reference caches should be flushed afterwards")
+    ap.add_argument("--seed-token", default=os.getenv("DEV_SEED_TOKEN"), help="X-Seed-Token for --invalidate-url")
+    ap.add_argument("--full", action="store_true", help="ignore the import checkpoints and read every file from the top")
+    ap.add_argument("--verify", action="store_true", help="compare every file with the DB (row counts, checksums) and exit 1 on a mismatch")
+    ap.add_argument("--archive-dir", default=os.getenv("ARCHIVE_DIR", "./records/archive"),
+                    help="archived ledger files: their txIds count as loaded, and --verify reads their rows")
     args = ap.parse_args()
 
     engine = create_engine(args.db, future=True)
-    Base.metadata.create_all(engine)
+    if args.verify:
+        raise SystemExit(1 if verify(engine, args.dir, open_ledger(engine, args.archive_dir)) else 0)
+    # same migration chain as `flask db-upgrade`: create_all alone would leave an older schema as it is
+    migrations.upgrade(engine, Base.metadata)
+    ledger = open_ledger(engine, args.archive_dir)
     Session = sessionmaker(bind=engine, future=True)
     s = Session()
+    sources = open_sources(s, args.dir, full=args.full)
+
+    if args.pipeline or args.bulk:
+        if args.pipeline:
+            inserted = pipeline_load(Session, sources, args.batch_size, args.workers, args.queue_size, args.reject_file, ledger)
+        else:
+            inserted = bulk_load(s, sources, args.batch_size, ledger)
+        finish(s, inserted, args)
+        return
 
     # customers
-    with open(f"{args.dir}/customers.csv", newline="", encoding="utf-8") as f:
-        r = csv.DictReader(f)
-        for row in r:
-            upsert_customer(s, row["customer_id"], row["name"])
+    for row in sources["customers"].dict_rows():
+        upsert_customer(s, row["customer_id"], row["name"])
 
     # accounts
-    with open(f"{args.dir}/accounts.csv", newline="", encoding="utf-8") as f:
-        r = csv.DictReader(f)
-        for row in r:
-            upsert_account(s, row["account_no"], row["type"], row["currency"], row["status"])
+    for row in sources["accounts"].dict_rows():
+        upsert_account(s, row["account_no"], row["type"], row["currency"], row["status"])
 
     # merchants
-    with open(f"{args.dir}/merchants.csv", newline="", encoding="utf-8") as f:
-        r = csv.DictReader(f)
-        for row in r:
-            upsert_merchant(s, row["merchant_id"], row["name"], row["mcc"])
+    for row in sources["merchants"].dict_rows():
+        upsert_merchant(s, row["merchant_id"], row["name"], row["mcc"])
 
     s.commit()
+    for kind in ("customers", "accounts", "merchants"):
+        save_checkpoint(s, sources[kind])
 
     # owns
-    with open(f"{args.dir}/owns.csv", newline="", encoding="utf-8") as f:
-        r = csv.DictReader(f)
-        for row in r:
-            ensure_owns(s, row["customer_id"], row["account_no"], row["since"])
+    for row in sources["owns"].dict_rows():
+        ensure_owns(s, row["customer_id"], row["account_no"], row["since"])
     s.commit()
+    save_checkpoint(s, sources["owns"])
 
     # transfers
-    with open(f"{args.dir}/transfers.csv", newline="", encoding="utf-8") as f:
-        r = csv.DictReader(f)
-        n=0
-        for row in r:
-            if insert_transfer(s, row): n+=1
-        s.commit()
-        print("inserted transfers:", n)
+    n = 0
+    for row in sources["transfers"].dict_rows():
+        if insert_transfer(s, row, ledger): n+=1
+    s.commit()
+    save_checkpoint(s, sources["transfers"])
+    print("inserted transfers:", n)
+    inserted = n
 
     # pays
-    with open(f"{args.dir}/pays.csv", newline="", encoding="utf-8") as f:
-        r = csv.DictReader(f)
-        n=0
-        for row in r:
-            if insert_pay(s, row): n+=1
-        s.commit()
-        print("inserted pays:", n)
+    n = 0
+    for row in sources["pays"].dict_rows():
+        if insert_pay(s, row, ledger): n+=1
+    s.commit()
+    save_checkpoint(s, sources["pays"])
+    print("inserted pays:", n)
 
-    s.close()
+    finish(s, inserted + n, args)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,218 @@
+# migrations.py
+# Versioned schema migrations and EXPLAIN-based plan checks for the banking DB.
+#
+# Every migration runs in its own transaction and is recorded in schema_migrations.
+# Migrations must be safe to apply to a schema freshly built by create_all (the
+# baseline), because a new database goes through the same chain as an old one.
+import re
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, select, insert, inspect, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from sqlalchemy.types import Integer as IntegerType
+
+import money
+
+version_meta = MetaData()
+schema_migrations = Table(
+    "schema_migrations", version_meta,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(128), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+MIGRATIONS: List[tuple] = []  # (version, name, fn(conn, metadata))
+
+def migration(version: int, name: str):
+    def register(fn: Callable):
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+# -------------------- migrations --------------------
+@migration(1, "baseline")
+def _baseline(conn, metadata):
+    # creates whatever tables are missing; existing tables are left untouched
+    metadata.create_all(conn)
+
+def columns(conn, table: str) -> Dict[str, Any]:
+    return {c["name"]: c for c in inspect(conn).get_columns(table)}
+
+def amount_column(conn, table: str) -> str:
+    # "amount" (float, major units) before migration 4, "amount_minor" after it
+    return "amount" if "amount" in columns(conn, table) else "amount_minor"
+
+@migration(2, "account_created_at_indexes")
+def _account_created_at_indexes(conn, metadata):
+    # DDL is frozen at the float-amount schema; tables already on amount_minor get their indexes from migration 4
+    for name, table, cols in (
+        ("ix_transfers_from_created", "transfers", "from_account_id, created_at, amount"),
+        ("ix_transfers_to_created", "transfers", "to_account_id, created_at, amount"),
+        ("ix_pays_from_created", "pays", "from_account_id, created_at, amount"),
+    ):
+        if "amount" in columns(conn, table):
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({cols})"))
+
+def backfill_account_balances(conn):
+    t_amt, p_amt = amount_column(conn, "transfers"), amount_column(conn, "pays")
+    conn.execute(text(f"""
+        INSERT INTO account_balances (account_id, incoming, outgoing_transfers, outgoing_pays, balance, updated_at)
+        SELECT account_id, SUM(inc), SUM(out_t), SUM(out_p), SUM(inc) - SUM(out_t) - SUM(out_p), :now
+        FROM (
+            SELECT to_account_id AS account_id, {t_amt} AS inc, 0 AS out_t, 0 AS out_p FROM transfers
+            UNION ALL SELECT from_account_id, 0, {t_amt}, 0 FROM transfers
+            UNION ALL SELECT from_account_id, 0, 0, {p_amt} FROM pays
+        ) GROUP BY account_id
+    """), {"now": datetime.now(timezone.utc)})
+
+@migration(3, "backfill_account_balances")
+def _backfill_account_balances(conn, metadata):
+    if conn.execute(text("SELECT 1 FROM account_balances LIMIT 1")).first() is not None:
+        return
+    backfill_account_balances(conn)
+
+def rebuild_table(conn, table, select_sql: str):
+    """SQLite-style table rebuild: create the current definition under a temp name, copy, swap, re-index."""
+    scratch = MetaData()
+    for other in table.metadata.sorted_tables:  # so foreign keys resolve; only the copy is created
+        if other is not table:
+            other.to_metadata(scratch)
+    tmp = table.to_metadata(scratch, name=f"{table.name}__new")
+    tmp.indexes.clear()
+    tmp.create(conn)
+    cols = ", ".join(c.name for c in table.columns)
+    conn.execute(text(f"INSERT INTO {tmp.name} ({cols}) {select_sql}"))
+    conn.execute(text(f"DROP TABLE {table.name}"))
+    conn.execute(text(f"ALTER TABLE {tmp.name} RENAME TO {table.name}"))
+    for idx in table.indexes:
+        idx.create(conn)
+
+@migration(4, "amounts_to_minor_units")
+def _amounts_to_minor_units(conn, metadata):
+    # REAL amounts -> INTEGER minor units, using each row's currency exponent
+    scale = "CASE UPPER(currency) " + " ".join(
+        f"WHEN '{ccy}' THEN {10 ** e}" for ccy, e in sorted(money.MINOR_EXPONENT.items())
+    ) + f" ELSE {10 ** money.DEFAULT_EXPONENT} END"
+    converted = False
+    for name in ("transfers", "pays"):
+        table = metadata.tables[name]
+        if "amount" not in columns(conn, name):
+            for idx in table.indexes:
+                idx.create(conn, checkfirst=True)
+            continue
+        exprs = ", ".join(
+            f"CAST(ROUND(amount * {scale}) AS INTEGER)" if c.name == "amount_minor" else c.name
+            for c in table.columns
+        )
+        rebuild_table(conn, table, f"SELECT {exprs} FROM {name}")
+        converted = True
+    # the float ledger is recomputed from the converted rows rather than converted itself
+    ledger_is_float = not isinstance(columns(conn, "account_balances")["balance"]["type"], IntegerType)
+    if ledger_is_float:
+        conn.execute(text("DROP TABLE account_balances"))
+        metadata.tables["account_balances"].create(conn)
+    if converted or ledger_is_float:
+        conn.execute(text("DELETE FROM account_balances"))
+        backfill_account_balances(conn)
+
+@migration(5, "created_at_export_indexes")
+def _created_at_export_indexes(conn, metadata):
+    # time-ordered export (created_at, tx_id) and the merchant filter
+    for table, name in (("transfers", "ix_transfers_created"), ("pays", "ix_pays_created"), ("pays", "ix_pays_merchant_created")):
+        next(i for i in metadata.tables[table].indexes if i.name == name).create(conn, checkfirst=True)
+
+@migration(6, "ingest_checkpoints")
+def _ingest_checkpoints(conn, metadata):
+    metadata.tables["ingest_checkpoints"].create(conn, checkfirst=True)
+
+def fts5_available(conn) -> bool:
+    return bool(conn.execute(text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar())
+
+# merchants_fts (trigram: substring + fuzzy) and merchants_prefix (word prefixes) index merchants externally
+MERCHANT_FTS_TABLES = {"merchants_fts": "tokenize='trigram'", "merchants_prefix": "tokenize='unicode61', prefix='1 2 3'"}
+
+@migration(7, "merchant_search_index")
+def _merchant_search_index(conn, metadata):
+    next(i for i in metadata.tables["merchants"].indexes if i.name == "ix_merchants_mcc").create(conn, checkfirst=True)
+    if conn.dialect.name != "sqlite" or not fts5_available(conn):
+        return  # the app falls back to LIKE when merchants_fts is missing
+    for name, opts in MERCHANT_FTS_TABLES.items():
+        conn.execute(text(f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5("
+                          f"merchant_id, name, content='merchants', content_rowid='id', {opts})"))
+        conn.execute(text(f"INSERT INTO {name}({name}) VALUES ('rebuild')"))
+    ins = " ".join(f"INSERT INTO {n}(rowid, merchant_id, name) VALUES (new.id, new.merchant_id, new.name);" for n in MERCHANT_FTS_TABLES)
+    dele = " ".join(f"INSERT INTO {n}({n}, rowid, merchant_id, name) VALUES ('delete', old.id, old.merchant_id, old.name);" for n in MERCHANT_FTS_TABLES)
+    conn.execute(text(f"CREATE TRIGGER IF NOT EXISTS merchants_search_ai AFTER INSERT ON merchants BEGIN {ins} END"))
+    conn.execute(text(f"CREATE TRIGGER IF NOT EXISTS merchants_search_ad AFTER DELETE ON merchants BEGIN {dele} END"))
+    conn.execute(text(f"CREATE TRIGGER IF NOT EXISTS merchants_search_au AFTER UPDATE ON merchants BEGIN {dele} {ins} END"))
+
+@migration(8, "ledger_partitions")
+def _ledger_partitions(conn, metadata):
+    for name in ("ledger_partitions", "partition_closings"):
+        metadata.tables[name].create(conn, checkfirst=True)
+
+@migration(9, "import_checkpoints")
+def _import_checkpoints(conn, metadata):
+    metadata.tables["import_checkpoints"].create(conn, checkfirst=True)
+
+# -------------------- runner --------------------
+def applied_versions(conn) -> Dict[int, Any]:
+    if not inspect(conn).has_table("schema_migrations"):
+        return {}
+    return {r.version: r for r in conn.execute(select(schema_migrations))}
+
+def upgrade(engine, metadata, target: int = None) -> List[tuple]:
+    """Apply pending migrations up to target (default: latest); returns the ones applied."""
+    with engine.begin() as conn:
+        schema_migrations.create(conn, checkfirst=True)
+        done = applied_versions(conn)
+    applied = []
+    for version, name, fn in MIGRATIONS:
+        if version in done or (target is not None and version > target):
+            continue
+        with engine.begin() as conn:
+            fn(conn, metadata)
+            conn.execute(insert(schema_migrations).values(version=version, name=name, applied_at=datetime.now(timezone.utc)))
+        applied.append((version, name))
+    return applied
+
+def status(engine) -> List[Dict[str, Any]]:
+    with engine.connect() as conn:
+        done = applied_versions(conn)
+    return [
+        {"version": v, "name": name, "applied_at": done[v].applied_at if v in done else None}
+        for v, name, _ in MIGRATIONS
+    ]
+
+# -------------------- plan checks --------------------
+class ExplainQueryPlan(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, stmt):
+        self.stmt = stmt
+
+@compiles(ExplainQueryPlan, "sqlite")
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN QUERY PLAN " + compiler.process(element.stmt, **kw)
+
+def full_scans(plan: List[str], tables) -> List[str]:
+    # "SCAN accounts" / "SCAN accounts_1 USING COVERING INDEX ..." read every row; SCAN of a subquery is fine
+    bad = []
+    for line in plan:
+        m = re.match(r"SCAN (\w+)", line)
+        if m and re.sub(r"_\d+$", "", m.group(1)) in tables:
+            bad.append(line)
+    return bad
+
+def check_query_plans(engine, metadata, queries: Dict[str, Callable]) -> Dict[str, Dict[str, Any]]:
+    """EXPLAIN each registered hot query; a query fails if any real table is fully scanned."""
+    tables = set(metadata.tables)
+    report = {}
+    with engine.connect() as conn:
+        for name, make_stmt in queries.items():
+            plan = [row[-1] for row in conn.execute(ExplainQueryPlan(make_stmt()))]
+            report[name] = {"plan": plan, "full_scans": full_scans(plan, tables)}
+    return report
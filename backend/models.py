@@ -0,0 +1,169 @@
+# models.py
+# ORM models shared by the API (app.py) and the CSV loader (load_csv_into_ultipa.py), so both build the same
+# schema with the same column defaults.
+from datetime import datetime, timezone
+from typing import Dict
+
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, MetaData, String, Table, UniqueConstraint, func, select
+from sqlalchemy.orm import declarative_base, relationship
+
+from aggregates import month_bounds
+
+Base = declarative_base()
+
+# -------------------- models --------------------
+class Customer(Base):
+    __tablename__ = "customers"
+    id = Column(Integer, primary_key=True)
+    customer_id = Column(String(64), unique=True, index=True, nullable=False)
+    name = Column(String(128))
+
+    accounts = relationship("Owns", back_populates="customer", cascade="all, delete-orphan")
+
+class Account(Base):
+    __tablename__ = "accounts"
+    id = Column(Integer, primary_key=True)
+    account_no = Column(String(64), unique=True, index=True, nullable=False)
+    type = Column(String(32))
+    currency = Column(String(8), default="USD")
+    status = Column(String(32), default="active")
+
+    owners = relationship("Owns", back_populates="account", cascade="all, delete-orphan")
+    transfers_out = relationship("Transfer", foreign_keys="Transfer.from_account_id", back_populates="from_account")
+    transfers_in = relationship("Transfer", foreign_keys="Transfer.to_account_id", back_populates="to_account")
+    pays_out = relationship("Pay", back_populates="from_account")
+
+class Merchant(Base):
+    __tablename__ = "merchants"
+    id = Column(Integer, primary_key=True)
+    merchant_id = Column(String(64), unique=True, index=True, nullable=False)
+    name = Column(String(128))
+    mcc = Column(String(8))
+    __table_args__ = (Index("ix_merchants_mcc", "mcc", "name"),)
+
+    pays_in = relationship("Pay", back_populates="merchant")
+
+class Owns(Base):
+    __tablename__ = "owns"
+    id = Column(Integer, primary_key=True)
+    customer_id_fk = Column(Integer, ForeignKey("customers.id"), nullable=False)
+    account_id_fk = Column(Integer, ForeignKey("accounts.id"), nullable=False)
+    since = Column(DateTime, default=datetime.now)
+
+    customer = relationship("Customer", back_populates="accounts")
+    account = relationship("Account", back_populates="owners")
+    __table_args__ = (UniqueConstraint("customer_id_fk", "account_id_fk", name="uq_owns"),)
+
+class Transfer(Base):
+    __tablename__ = "transfers"
+    id = Column(Integer, primary_key=True)
+    tx_id = Column(String(128), unique=True, index=True, nullable=False)
+    amount_minor = Column(Integer, nullable=False)  # minor units, see money.py
+    currency = Column(String(8), default="USD")
+    channel = Column(String(32), default="api")
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    from_account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
+    to_account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
+
+    from_account = relationship("Account", foreign_keys=[from_account_id], back_populates="transfers_out")
+    to_account = relationship("Account", foreign_keys=[to_account_id], back_populates="transfers_in")
+    # amount_minor is carried so per-account sums are answered from the index alone
+    __table_args__ = (
+        Index("ix_transfers_from_created", "from_account_id", "created_at", "amount_minor"),
+        Index("ix_transfers_to_created", "to_account_id", "created_at", "amount_minor"),
+        Index("ix_transfers_created", "created_at", "tx_id"),
+    )
+
+class Pay(Base):
+    __tablename__ = "pays"
+    id = Column(Integer, primary_key=True)
+    tx_id = Column(String(128), unique=True, index=True, nullable=False)
+    amount_minor = Column(Integer, nullable=False)  # minor units, see money.py
+    currency = Column(String(8), default="USD")
+    channel = Column(String(32), default="api")
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    from_account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
+    merchant_id_fk = Column(Integer, ForeignKey("merchants.id"), nullable=False)
+
+    from_account = relationship("Account", back_populates="pays_out")
+    merchant = relationship("Merchant", back_populates="pays_in")
+    __table_args__ = (
+        Index("ix_pays_from_created", "from_account_id", "created_at", "amount_minor"),
+        Index("ix_pays_created", "created_at", "tx_id"),
+        Index("ix_pays_merchant_created", "merchant_id_fk", "created_at"),
+    )
+
+class AccountBalance(Base):
+    # materialized running balance (minor units), maintained in the same transaction as each Transfer/Pay insert
+    __tablename__ = "account_balances"
+    account_id = Column(Integer, ForeignKey("accounts.id"), primary_key=True)
+    incoming = Column(Integer, nullable=False, default=0)
+    outgoing_transfers = Column(Integer, nullable=False, default=0)
+    outgoing_pays = Column(Integer, nullable=False, default=0)
+    balance = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+class IngestCheckpoint(Base):
+    # last ingest-log seq applied to transfers/pays; written in the same transaction as the rows (see ingest.py)
+    __tablename__ = "ingest_checkpoints"
+    name = Column(String(64), primary_key=True)
+    applied_seq = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+class ImportCheckpoint(Base):
+    # how far load_csv_into_ultipa.py has read a seed file: the next run parses only bytes past offset,
+    # provided the first offset bytes still hash to sha256
+    __tablename__ = "import_checkpoints"
+    file = Column(String(255), primary_key=True)
+    offset = Column(Integer, nullable=False, default=0)
+    rows = Column(Integer, nullable=False, default=0)
+    sha256 = Column(String(64), nullable=False)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+class LedgerPartition(Base):
+    # a closed month of transfers/pays (see partitions.py); state is "closed", or "archived" once its rows moved out
+    __tablename__ = "ledger_partitions"
+    period = Column(String(7), primary_key=True)  # YYYY-MM
+    state = Column(String(16), nullable=False, default="closed")
+    transfers = Column(Integer, nullable=False, default=0)
+    pays = Column(Integer, nullable=False, default=0)
+    closed_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    archived_at = Column(DateTime)
+    archive_file = Column(String(255))
+
+class PartitionClosing(Base):
+    # cumulative per-account totals (minor units) at the end of a closed month
+    __tablename__ = "partition_closings"
+    period = Column(String(7), ForeignKey("ledger_partitions.period"), primary_key=True)
+    account_id = Column(Integer, ForeignKey("accounts.id"), primary_key=True)
+    incoming = Column(Integer, nullable=False, default=0)
+    outgoing_transfers = Column(Integer, nullable=False, default=0)
+    outgoing_pays = Column(Integer, nullable=False, default=0)
+
+# FTS5 indexes over merchants (migration 7); kept outside Base.metadata so create_all never touches them
+search_meta = MetaData()
+merchants_fts = Table("merchants_fts", search_meta, Column("rowid", Integer), Column("merchants_fts", String), Column("rank", String))
+merchants_prefix = Table("merchants_prefix", search_meta, Column("rowid", Integer), Column("merchants_prefix", String), Column("rank", String))
+
+# -------------------- derived state --------------------
+def compute_balances(s) -> Dict[int, tuple]:
+    """Recompute (incoming, outgoing_transfers, outgoing_pays) per account: the last closing plus the live rows after it."""
+    totals: Dict[int, list] = {}
+    queries = [
+        (0, select(Transfer.to_account_id, func.sum(Transfer.amount_minor)).group_by(Transfer.to_account_id)),
+        (1, select(Transfer.from_account_id, func.sum(Transfer.amount_minor)).group_by(Transfer.from_account_id)),
+        (2, select(Pay.from_account_id, func.sum(Pay.amount_minor)).group_by(Pay.from_account_id)),
+    ]
+    last = s.execute(select(func.max(LedgerPartition.period))).scalar()
+    if last:
+        # archived months are only in the closing; closed-but-live months are counted there, not again below
+        for c in s.execute(select(PartitionClosing).where(PartitionClosing.period == last)).scalars():
+            totals[c.account_id] = [c.incoming, c.outgoing_transfers, c.outgoing_pays]
+        end = month_bounds(last)[1]
+        queries = [(slot, stmt.where((Transfer if slot < 2 else Pay).created_at >= end)) for slot, stmt in queries]
+    for slot, stmt in queries:
+        for acct_id, total in s.execute(stmt).all():
+            totals.setdefault(acct_id, [0, 0, 0])[slot] += int(total or 0)
+    return {k: tuple(v) for k, v in totals.items()}
@@ -0,0 +1,32 @@
+# money.py
+# Amounts are stored as integer minor units (cents for USD); conversions happen only at the edges.
+from decimal import Decimal, InvalidOperation
+
+DEFAULT_EXPONENT = 2
+# ISO 4217 currencies whose minor unit is not 1/100
+MINOR_EXPONENT = {"JPY": 0, "KRW": 0, "VND": 0, "CLP": 0, "ISK": 0, "BHD": 3, "KWD": 3, "OMR": 3, "JOD": 3, "TND": 3}
+
+def exponent(currency: str = None) -> int:
+    return MINOR_EXPONENT.get((currency or "").upper(), DEFAULT_EXPONENT)
+
+def to_minor(value, currency: str = None) -> int:
+    """'214.35' / 214.35 -> 21435. Raises ValueError for non-numbers or more decimals than the currency has."""
+    try:
+        d = Decimal(str(value).strip())
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"not a number: {value!r}")
+    if not d.is_finite():
+        raise ValueError(f"not a finite amount: {value!r}")
+    scaled = d.scaleb(exponent(currency))
+    if scaled != scaled.to_integral_value():
+        raise ValueError(f"too many decimal places for {currency or 'default currency'}: {value!r}")
+    return int(scaled)
+
+def from_minor(minor: int, currency: str = None) -> float:
+    """Minor units -> JSON number, for API responses."""
+    return float(Decimal(int(minor or 0)).scaleb(-exponent(currency)))
+
+def format_minor(minor: int, currency: str = None) -> str:
+    """Minor units -> fixed-point string ('21435' -> '214.35'), the bank_seeds CSV format."""
+    e = exponent(currency)
+    return f"{Decimal(int(minor or 0)).scaleb(-e):.{e}f}"
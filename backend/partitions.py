@@ -0,0 +1,253 @@
+# partitions.py
+# Monthly ledger partitions: closing balances for closed months and archival of old months into compact,
+# read-only yearly SQLite files that read connections ATTACH.
+#
+# A partition is one calendar month of transfers/pays by created_at. Closing a month stores every account's
+# cumulative totals at its end (partition_closings), so history sums start at the last closing instead of the
+# first row. Archiving moves a closed month's rows out of the live tables into ledger-YYYY.db. LedgerRouter
+# lists the tables that can hold rows for a time range (the live table plus the overlapping archives), and the
+# query builders in app.py union over them.
+import os
+import stat
+from datetime import datetime, timezone
+from itertools import groupby
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from sqlalchemy import Column, Index, MetaData, Table, create_engine, delete, event, func, insert, inspect, select, update
+
+from aggregates import month_bounds
+
+LEDGER_TABLES = ("transfers", "pays")
+ARCHIVE_COPY_ROWS = 10_000
+TX_LOOKUP_CHUNK = 500
+MAX_ATTACHED = 10  # SQLite's default SQLITE_MAX_ATTACHED
+
+def naive_utc(dt: datetime) -> datetime:
+    # created_at is stored as naive UTC
+    return dt.astimezone(timezone.utc).replace(tzinfo=None) if dt.tzinfo else dt
+
+def period_of(dt: datetime) -> str:
+    return dt.strftime("%Y-%m")
+
+def next_period(period: str) -> str:
+    return period_of(month_bounds(period)[1])
+
+def in_period(table, period: str):
+    start, end = month_bounds(period)
+    return (table.c.created_at >= start) & (table.c.created_at < end)
+
+def detached_copy(table, metadata, schema: str = None) -> Table:
+    """Same columns and indexes as table but no foreign keys: an archive file holds no accounts or merchants."""
+    copy = Table(table.name, metadata, *(Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable)
+                                         for c in table.columns), schema=schema)
+    for idx in table.indexes:
+        Index(idx.name, *(copy.c[c.name] for c in idx.columns), unique=idx.unique)
+    return copy
+
+def archive_path(archive_dir: str, year: str) -> str:
+    return os.path.join(archive_dir, f"ledger-{year}.db")
+
+# -------------------- closing --------------------
+def period_sums(conn, metadata, period: str) -> Dict[int, List[int]]:
+    """incoming / outgoing_transfers / outgoing_pays per account for the live rows of one month."""
+    t, p = metadata.tables["transfers"], metadata.tables["pays"]
+    out: Dict[int, List[int]] = {}
+    for slot, table, acct_col in ((0, t, t.c.to_account_id), (1, t, t.c.from_account_id), (2, p, p.c.from_account_id)):
+        stmt = select(acct_col, func.sum(table.c.amount_minor)).where(in_period(table, period)).group_by(acct_col)
+        for acct_id, total in conn.execute(stmt):
+            out.setdefault(acct_id, [0, 0, 0])[slot] += int(total or 0)
+    return out
+
+def close_partitions(conn, metadata, through: str) -> List[str]:
+    """Close every month after the last closed one up to and including `through`; returns the periods closed.
+
+    Months are closed in order and never reopened, so load historical rows before closing their month.
+    """
+    parts, closings = metadata.tables["ledger_partitions"], metadata.tables["partition_closings"]
+    now = datetime.now(timezone.utc)
+    if month_bounds(through)[1] > now.replace(tzinfo=None):
+        raise ValueError(f"{through} has not ended yet")
+    last = conn.execute(select(func.max(parts.c.period))).scalar()
+    if last:
+        period = next_period(last)
+        totals = {r.account_id: [r.incoming, r.outgoing_transfers, r.outgoing_pays]
+                  for r in conn.execute(select(closings).where(closings.c.period == last))}
+    else:
+        first = [conn.execute(select(func.min(metadata.tables[n].c.created_at))).scalar() for n in LEDGER_TABLES]
+        first = [f for f in first if f is not None]
+        if not first:
+            return []
+        period, totals = period_of(min(first)), {}
+    closed = []
+    while period <= through:
+        for acct_id, sums in period_sums(conn, metadata, period).items():
+            running = totals.setdefault(acct_id, [0, 0, 0])
+            for i, v in enumerate(sums):
+                running[i] += v
+        counts = {n: conn.execute(select(func.count()).select_from(metadata.tables[n])
+                                  .where(in_period(metadata.tables[n], period))).scalar() for n in LEDGER_TABLES}
+        conn.execute(insert(parts).values(period=period, state="closed", closed_at=now, **counts))
+        if totals:
+            conn.execute(insert(closings), [
+                {"period": period, "account_id": a, "incoming": v[0], "outgoing_transfers": v[1], "outgoing_pays": v[2]}
+                for a, v in totals.items()
+            ])
+        closed.append(period)
+        period = next_period(period)
+    return closed
+
+# -------------------- archival --------------------
+def set_writable(path: str, writable: bool):
+    if os.path.exists(path):
+        os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH | (stat.S_IWUSR if writable else 0))
+
+def vacuum(engine):
+    # VACUUM cannot run inside a transaction, so it goes through a raw DBAPI connection
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        cur.execute("VACUUM")
+        cur.close()
+    finally:
+        raw.close()
+
+def archive_partitions(writer, reader, metadata, through: str, archive_dir: str, vacuum_live: bool = False) -> List[str]:
+    """Move closed months up to `through` into ledger-YYYY.db files; returns the periods archived.
+
+    Each month is copied and committed to the archive first, then deleted from the live tables and marked
+    archived in one transaction. A run interrupted between the two steps is safe to repeat: the copy replaces
+    whatever an earlier attempt left for that month.
+    """
+    parts = metadata.tables["ledger_partitions"]
+    with reader.connect() as conn:
+        todo = conn.execute(select(parts.c.period, parts.c.transfers, parts.c.pays)
+                            .where(parts.c.state == "closed", parts.c.period <= through).order_by(parts.c.period)).all()
+    os.makedirs(archive_dir, exist_ok=True)
+    done = []
+    for year, rows in groupby(todo, key=lambda r: r.period[:4]):
+        path = archive_path(archive_dir, year)
+        set_writable(path, True)
+        arch = create_engine(f"sqlite:///{path}", future=True)
+        arch_meta = MetaData()
+        arch_tables = {n: detached_copy(metadata.tables[n], arch_meta) for n in LEDGER_TABLES}
+        try:
+            arch_meta.create_all(arch)
+            for r in rows:
+                with arch.begin() as dst, reader.connect() as src:
+                    for name, table in arch_tables.items():
+                        live = metadata.tables[name]
+                        dst.execute(delete(table).where(in_period(table, r.period)))
+                        result = src.execute(select(live).where(in_period(live, r.period)).order_by(live.c.id)
+                                             .execution_options(yield_per=ARCHIVE_COPY_ROWS))
+                        for chunk in result.mappings().partitions():
+                            dst.execute(insert(table), [dict(m) for m in chunk])
+                        copied = dst.execute(select(func.count()).select_from(table).where(in_period(table, r.period))).scalar()
+                        if copied != getattr(r, name):
+                            raise RuntimeError(f"{r.period} {name}: closed with {getattr(r, name)} rows, copied {copied}; "
+                                               "rows were added to a closed month")
+                with writer.begin() as conn:
+                    for name in LEDGER_TABLES:
+                        live = metadata.tables[name]
+                        conn.execute(delete(live).where(in_period(live, r.period)))
+                    conn.execute(update(parts).where(parts.c.period == r.period).values(
+                        state="archived", archived_at=datetime.now(timezone.utc), archive_file=os.path.basename(path)))
+                done.append(r.period)
+            vacuum(arch)
+        finally:
+            arch.dispose()
+            set_writable(path, False)
+    if vacuum_live and done:
+        vacuum(writer)
+    return done
+
+# -------------------- routing --------------------
+class LedgerRouter:
+    """Which tables can hold transfers/pays for a time range, and the closing to start history sums from.
+
+    load() reads ledger_partitions; install(engine) ATTACHes the archive files read-only to every new connection
+    of that engine. After an archive run, load() again and dispose the installed engines' pools.
+    """
+
+    def __init__(self, metadata, archive_dir: str):
+        self.metadata, self.archive_dir = metadata, archive_dir
+        self.closed: List[str] = []              # closed periods (archived included), ascending
+        self.archives: Dict[str, Dict[str, Any]] = {}  # schema -> path, start, end, tables
+        self.engines: List[Any] = []
+
+    def load(self, conn) -> "LedgerRouter":
+        parts = self.metadata.tables["ledger_partitions"]
+        if not inspect(conn).has_table(parts.name):  # schema not upgraded yet: nothing closed or archived
+            rows = []
+        else:
+            rows = conn.execute(select(parts.c.period, parts.c.state, parts.c.archive_file).order_by(parts.c.period)).all()
+        archives: Dict[str, Dict[str, Any]] = {}
+        meta = MetaData()
+        for r in rows:
+            if r.state != "archived":
+                continue
+            start, end = month_bounds(r.period)
+            schema = f"ledger_{r.period[:4]}"
+            if schema not in archives:
+                archives[schema] = {"path": os.path.abspath(os.path.join(self.archive_dir, r.archive_file)), "start": start,
+                                    "tables": {n: detached_copy(self.metadata.tables[n], meta, schema=schema) for n in LEDGER_TABLES}}
+            archives[schema]["end"] = end
+        if len(archives) > MAX_ATTACHED:
+            raise RuntimeError(f"{len(archives)} archive files; SQLite attaches at most {MAX_ATTACHED}")
+        self.closed, self.archives = [r.period for r in rows], archives
+        return self
+
+    def install(self, engine):
+        @event.listens_for(engine, "connect")
+        def _attach(dbapi_conn, record):
+            cur = dbapi_conn.cursor()
+            for schema, a in self.archives.items():
+                cur.execute(f"ATTACH DATABASE ? AS {schema}", (f"file:{quote(a['path'])}?mode=ro",))
+            cur.close()
+        self.engines.append(engine)
+
+    def reattach(self):
+        # pooled connections keep their old ATTACH list; new ones pick up the current archives
+        for engine in self.engines:
+            engine.dispose(close=False)
+
+    def tables(self, name: str, since: datetime = None, until: datetime = None) -> List[Table]:
+        """The live table plus every archive table that can hold rows with since <= created_at < until."""
+        out = [self.metadata.tables[name]]
+        for a in self.archives.values():
+            if (until is None or a["start"] < until) and (since is None or a["end"] > since):
+                out.append(a["tables"][name])
+        return out
+
+    def closed_until(self) -> Optional[datetime]:
+        """End of the last closed month. Closings are never adjusted, so new rows must be created at or after it."""
+        return month_bounds(self.closed[-1])[1] if self.closed else None
+
+    def in_closed_period(self, created_at: datetime) -> bool:
+        until = self.closed_until()
+        return until is not None and naive_utc(created_at) < until
+
+    def find_tx(self, conn, name: str, tx_ids, *columns: str) -> Dict[str, tuple]:
+        """tx_id -> (columns...) for those txIds found in the live table or any archive (live wins).
+
+        Archival deletes rows from the live table, so its unique tx_id index no longer covers archived months;
+        insert paths dedupe through here to keep a txId unique across the whole ledger. conn must have the
+        archives attached (install()).
+        """
+        ids, found = list(tx_ids), {}
+        for table in self.tables(name):
+            cols = [table.c[c] for c in columns]
+            for i in range(0, len(ids), TX_LOOKUP_CHUNK):
+                for r in conn.execute(select(table.c.tx_id, *cols).where(table.c.tx_id.in_(ids[i:i + TX_LOOKUP_CHUNK]))):
+                    found.setdefault(r[0], tuple(r[1:]))
+        return found
+
+    def closing_at(self, as_of: datetime) -> Optional[Tuple[str, datetime]]:
+        """(period, end) of the latest closed month that ended at or before as_of."""
+        best = None
+        for period in self.closed:
+            end = month_bounds(period)[1]
+            if end > as_of:
+                break
+            best = (period, end)
+        return best
@@ -0,0 +1,110 @@
+# storage.py
+# SQLite storage profiles: per-connection pragmas plus a read/write engine split.
+#
+# In WAL mode readers see the last committed snapshot and never wait for a writer, and one writer at a time
+# appends to the WAL. The write engine therefore has a single pooled connection that opens every transaction
+# with BEGIN IMMEDIATE, so writers queue in the pool instead of failing with SQLITE_BUSY halfway through. GET
+# endpoints use a separate pool of query_only connections. Other databases get one engine and no pragmas.
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+
+# pragma values are applied in this order on every new connection
+PROFILES: Dict[str, Dict[str, Any]] = {
+    # rollback journal, one engine for everything: the behaviour before profiles existed
+    "legacy": {},
+    # WAL, fsync at checkpoints only: a commit survives a process crash, the last few may be lost on power loss
+    "wal": {"journal_mode": "wal", "synchronous": "normal", "busy_timeout": 5000, "cache_size": -65536,
+            "mmap_size": 256 << 20, "temp_store": "memory"},
+    # WAL with an fsync on every commit
+    "wal-full": {"journal_mode": "wal", "synchronous": "full", "busy_timeout": 5000, "cache_size": -65536,
+                 "mmap_size": 256 << 20, "temp_store": "memory"},
+}
+PRAGMA_NAMES = ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size", "temp_store", "query_only")
+SYNCHRONOUS = {0: "off", 1: "normal", 2: "full", 3: "extra"}
+TEMP_STORE = {0: "default", 1: "file", 2: "memory"}
+
+def parse_overrides(spec: str) -> Dict[str, Any]:
+    """'mmap_size=0,synchronous=full' -> {'mmap_size': 0, 'synchronous': 'full'}."""
+    out = {}
+    for item in filter(None, (p.strip() for p in (spec or "").split(","))):
+        name, _, value = item.partition("=")
+        name = name.strip().lower()
+        if name not in PRAGMA_NAMES or not value.strip():
+            raise ValueError(f"unsupported pragma override: {item!r}")
+        value = value.strip().lower()
+        out[name] = int(value) if value.lstrip("-").isdigit() else value
+    return out
+
+def resolve_profile(name: str, overrides: str = None) -> Dict[str, Any]:
+    if name not in PROFILES:
+        raise ValueError(f"unknown SQLITE_PROFILE {name!r}; expected one of {', '.join(PROFILES)}")
+    return dict(PROFILES[name], **parse_overrides(overrides))
+
+def is_file_sqlite(url: str) -> bool:
+    u = make_url(url)
+    return u.get_backend_name() == "sqlite" and u.database not in (None, "", ":memory:")
+
+def profile_pragmas(url: str, profile: str, overrides: str = None) -> Dict[str, Any]:
+    """Pragmas the profile applies to url's connections; {} for other databases."""
+    pragmas = resolve_profile(profile, overrides)
+    return pragmas if is_file_sqlite(url) else {}
+
+def install_pragmas(engine, pragmas: Dict[str, Any], begin: str = None):
+    """Apply pragmas on every new DBAPI connection; with begin, issue it to start each transaction.
+
+    pysqlite normally opens transactions lazily on the first write, so a transaction that reads first
+    and writes later takes its write lock late and can fail with SQLITE_BUSY. Starting transactions
+    ourselves with BEGIN IMMEDIATE takes the lock up front (the SQLAlchemy-documented pysqlite recipe).
+    """
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_conn, record):
+        if begin:
+            dbapi_conn.isolation_level = None  # driver autocommit; "begin" below opens transactions
+        cur = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cur.execute(f"PRAGMA {name}={value}")
+        cur.close()
+
+    if begin:
+        @event.listens_for(engine, "begin")
+        def _on_begin(conn):
+            conn.exec_driver_sql(begin)
+
+def create_engines(url: str, profile: str, overrides: str = None, read_pool_size: int = 8,
+                   write_timeout: float = 30.0) -> Tuple[Any, Any, Dict[str, Any]]:
+    """(write engine, read engine, pragmas). The two engines are the same object unless the split applies."""
+    pragmas = profile_pragmas(url, profile, overrides)
+    if not pragmas:
+        engine = create_engine(url, echo=False, future=True)
+        return engine, engine, {}
+    writer = create_engine(url, echo=False, future=True, pool_size=1, max_overflow=0, pool_timeout=write_timeout)
+    install_pragmas(writer, pragmas, begin="BEGIN IMMEDIATE")
+    reader = create_engine(url, echo=False, future=True, pool_size=read_pool_size, max_overflow=read_pool_size)
+    install_pragmas(reader, dict(pragmas, query_only=1))
+    return writer, reader, pragmas
+
+def read_pragmas(engine) -> Dict[str, Any]:
+    with engine.connect() as conn:
+        values = {name: conn.execute(text(f"PRAGMA {name}")).scalar() for name in PRAGMA_NAMES}
+    values["synchronous"] = SYNCHRONOUS.get(values["synchronous"], values["synchronous"])
+    values["temp_store"] = TEMP_STORE.get(values["temp_store"], values["temp_store"])
+    return values
+
+def report(writer, reader, profile: str, pragmas: Dict[str, Any]) -> Dict[str, Any]:
+    """Settings actually in effect on both engines, and any pragma SQLite did not accept as requested."""
+    out: Dict[str, Any] = {"profile": profile, "dialect": writer.dialect.name, "split": writer is not reader}
+    if writer.dialect.name != "sqlite":
+        return out
+    out["writer"], out["reader"] = read_pragmas(writer), read_pragmas(reader)
+    out["readPoolSize"], out["writePoolSize"] = reader.pool.size(), writer.pool.size()
+    mismatches: List[str] = []
+    for role, want in (("writer", pragmas), ("reader", dict(pragmas, query_only=1) if pragmas else {})):
+        for name, value in want.items():
+            got = out[role][name]
+            if str(got).lower() != str(value).lower():
+                # e.g. journal_mode stays 'delete' on filesystems without shared memory
+                mismatches.append(f"{role} {name}: requested {value}, got {got}")
+    out["mismatches"] = mismatches
+    return out